@@ -0,0 +1,237 @@
+"""
+Benchmark of queries for hashes cache of images. Needs local PostgreSQL or MySQL and an empty database, run from the
+root of repository:
+
+    python3 -m benchmarks.bench_cache_queries --dbtype pgsql --port 5432 --user postgres --database mdc_bench
+    python3 -m benchmarks.bench_cache_queries --dbtype mysql --port 3306 --user root --password X --database mdc_bench
+
+Tables `bench_filecache` and `bench_mediadc_photos` are created with columns and indexes of Nextcloud and MediaDC,
+that matter for these queries, and are filled with `--files` files in a tree of directories. Most of images have
+valid cache records, some are changed after hashing(other `mtime`). Use `--no-seed` to run again on the same tables.
+
+Queries are the same as in `python.db_requests`:
+
+    join     get_images_caches: LEFT JOIN of `filecache` on fileid and mtime, for files of one directory
+    fileid   get_images_caches(lookup="fileid"): only `mediadc_photos` by fileid, mtime is checked in Python
+
+Queries of `join` and `fileid` are also measured for `--batch` random files at once, as for a huge directory.
+"""
+
+import argparse
+import random
+from time import perf_counter
+
+TABLES_SQL = {
+    "pgsql": [
+        (
+            "CREATE TABLE bench_filecache (fileid BIGSERIAL PRIMARY KEY, storage BIGINT NOT NULL, path VARCHAR(4000), "
+            "path_hash VARCHAR(32) NOT NULL, parent BIGINT NOT NULL, name VARCHAR(250), mimetype BIGINT NOT NULL, "
+            "mimepart BIGINT NOT NULL, size BIGINT NOT NULL, mtime BIGINT NOT NULL, storage_mtime BIGINT NOT NULL, "
+            "etag VARCHAR(40), permissions INT NOT NULL);"
+        ),
+        (
+            "CREATE TABLE bench_mediadc_photos (fileid BIGINT PRIMARY KEY, hash BYTEA, mtime BIGINT NOT NULL, "
+            "skipped INT NOT NULL);"
+        ),
+    ],
+    "mysql": [
+        (
+            "CREATE TABLE bench_filecache (fileid BIGINT AUTO_INCREMENT PRIMARY KEY, storage BIGINT NOT NULL, "
+            "path VARCHAR(4000), path_hash VARCHAR(32) NOT NULL, parent BIGINT NOT NULL, name VARCHAR(250), "
+            "mimetype BIGINT NOT NULL, mimepart BIGINT NOT NULL, size BIGINT NOT NULL, mtime BIGINT NOT NULL, "
+            "storage_mtime BIGINT NOT NULL, etag VARCHAR(40), permissions INT NOT NULL) CHARACTER SET utf8mb4;"
+        ),
+        (
+            "CREATE TABLE bench_mediadc_photos (fileid BIGINT PRIMARY KEY, hash VARBINARY(256), mtime BIGINT NOT NULL, "
+            "skipped INT NOT NULL);"
+        ),
+    ],
+}
+INDEXES_SQL = [
+    "CREATE UNIQUE INDEX fs_storage_path_hash ON bench_filecache (storage, path_hash);",
+    "CREATE INDEX fs_parent_name_hash ON bench_filecache (parent, name);",
+    "CREATE INDEX fs_storage_mimetype ON bench_filecache (storage, mimetype);",
+    "CREATE INDEX fs_storage_mimepart ON bench_filecache (storage, mimepart);",
+    "CREATE INDEX fs_mtime ON bench_filecache (mtime);",
+    "CREATE INDEX fs_size ON bench_filecache (size);",
+]
+MIMEPART_DIR, MIMEPART_IMAGE, MIMEPART_VIDEO, MIMEPART_OTHER = 1, 2, 3, 4
+
+
+def connect(args):
+    if args.dbtype == "pgsql":
+        from pg8000.dbapi import connect as pgsql_connect  # pylint: disable=import-outside-toplevel
+
+        return pgsql_connect(
+            host=args.host, port=args.port, user=args.user, password=args.password, database=args.database
+        )
+    from pymysql import connect as mysql_connect  # pylint: disable=import-outside-toplevel
+
+    return mysql_connect(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
+
+
+def bytes_literal(dbtype: str, hex_str: str) -> str:
+    return f"0x{hex_str}" if dbtype == "mysql" else f"'\\x{hex_str}'"
+
+
+def generate_tree(files: int, dir_files: int, fanout: int, seed: int) -> tuple[dict, dict]:
+    """Returns parent of each directory and files of each directory: list of (fileid, mtime, mimepart)."""
+
+    rng = random.Random(seed)
+    n_dirs = max(files // dir_files, 1)
+    parents = {1: 0}
+    for dir_id in range(2, n_dirs + 1):
+        parents[dir_id] = (dir_id - 2) // fanout + 1
+    dir_files_list: dict[int, list] = {i: [] for i in parents}
+    file_id = n_dirs
+    for dir_id in parents:  # files uploaded together have close ids
+        for _ in range(dir_files):
+            file_id += 1
+            mimepart = rng.choices((MIMEPART_IMAGE, MIMEPART_VIDEO, MIMEPART_OTHER), (0.6, 0.1, 0.3))[0]
+            dir_files_list[dir_id].append((file_id, rng.randint(1600000000, 1700000000), mimepart))
+    return parents, dir_files_list
+
+
+def seed_tables(connection, dbtype: str, parents: dict, dir_files: dict, valid_cache: float, seed: int) -> None:
+    rng = random.Random(seed)
+    cursor = connection.cursor()
+    for table in ("bench_filecache", "bench_mediadc_photos"):
+        cursor.execute(f"DROP TABLE IF EXISTS {table};")
+    for query in TABLES_SQL[dbtype] + INDEXES_SQL:
+        cursor.execute(query)
+    filecache, photos = [], []
+
+    def flush(force: bool) -> None:
+        for table, rows in (("bench_filecache", filecache), ("bench_mediadc_photos", photos)):
+            if rows and (force or len(rows) >= 2000):
+                cursor.execute(f"INSERT INTO {table} VALUES{','.join(rows)};")
+                rows.clear()
+        connection.commit()
+
+    for dir_id, parent in parents.items():
+        filecache.append(
+            f"({dir_id},1,'files/d{dir_id}','{dir_id:032x}',{parent},'d{dir_id}',2,{MIMEPART_DIR},0,0,0,'e',31)"
+        )
+    for dir_id, files in dir_files.items():
+        for file_id, mtime, mimepart in files:
+            filecache.append(
+                f"({file_id},1,'files/d{dir_id}/f{file_id}','{file_id:032x}',{dir_id},'f{file_id}.jpg',"
+                f"{mimepart + 10},{mimepart},{rng.randint(10000, 5000000)},{mtime},{mtime},'e',27)"
+            )
+            if mimepart == MIMEPART_IMAGE and rng.random() < valid_cache + 0.05:
+                cache_mtime = mtime if rng.random() < valid_cache / (valid_cache + 0.05) else mtime - 1
+                photos.append(f"({file_id},{bytes_literal(dbtype, rng.randbytes(32).hex())},{cache_mtime},0)")
+        flush(False)
+    flush(True)
+    cursor.execute("ANALYZE bench_filecache;" if dbtype == "pgsql" else "ANALYZE TABLE bench_filecache;")
+    cursor.execute("ANALYZE bench_mediadc_photos;" if dbtype == "pgsql" else "ANALYZE TABLE bench_mediadc_photos;")
+    connection.commit()
+
+
+def fetchall(connection, query: str) -> list:
+    cursor = connection.cursor()
+    cursor.execute(query)
+    return cursor.fetchall()
+
+
+def query_join(connection, file_ids: list[int]) -> list:
+    return fetchall(
+        connection,
+        "SELECT fcache.fileid, imgcache.mtime, imgcache.hash, imgcache.skipped "
+        "FROM bench_filecache AS fcache "
+        "LEFT JOIN bench_mediadc_photos AS imgcache "
+        "ON fcache.fileid = imgcache.fileid AND fcache.mtime = imgcache.mtime "
+        f"WHERE fcache.fileid IN({','.join(str(x) for x in file_ids)});",
+    )
+
+
+def query_fileid(connection, file_ids: list[int]) -> list:
+    return fetchall(
+        connection,
+        "SELECT fileid, mtime, hash, skipped "
+        "FROM bench_mediadc_photos "
+        f"WHERE fileid IN({','.join(str(x) for x in file_ids)});",
+    )
+
+
+def run_mode(connection, mode: str, groups: list[list[int]], dir_files: dict) -> tuple[int, int, int, float]:
+    """Returns number of queries, valid records, directories and time, `groups` are sub directories of one parent."""
+
+    queries = valid = directories = 0
+    time_start = perf_counter()
+    for sub_dirs in groups:
+        for dir_id in sub_dirs:
+            images = [i for i in dir_files[dir_id] if i[2] == MIMEPART_IMAGE]
+            directories += 1
+            if not images:
+                continue
+            query = query_join if mode == "join" else query_fileid
+            records = {i[0]: i for i in query(connection, [i[0] for i in images])}
+            queries += 1
+            valid += sum(1 for i in images if i[0] in records and records[i[0]][1] == i[1])
+    return queries, valid, directories, perf_counter() - time_start
+
+
+def run_batch(connection, mode: str, batches: list[list[tuple]]) -> tuple[int, int, float]:
+    queries = valid = 0
+    time_start = perf_counter()
+    for images in batches:
+        query = query_join if mode == "join" else query_fileid
+        records = {i[0]: i for i in query(connection, [i[0] for i in images])}
+        queries += 1
+        valid += sum(1 for i in images if i[0] in records and records[i[0]][1] == i[1])
+    return queries, valid, perf_counter() - time_start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of queries for hashes cache.")
+    parser.add_argument("--dbtype", type=str, default="pgsql", choices=["pgsql", "mysql"])
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--user", type=str, default="postgres")
+    parser.add_argument("--password", type=str, default=None)
+    parser.add_argument("--database", type=str, default="mdc_bench")
+    parser.add_argument("--files", type=int, default=1000000, help="Number of files in `filecache`.")
+    parser.add_argument("--dir-files", type=int, default=20, help="Files in each directory.")
+    parser.add_argument("--fanout", type=int, default=10, help="Sub directories of each directory.")
+    parser.add_argument("--valid-cache", type=float, default=0.9, help="Part of images with valid cache.")
+    parser.add_argument("--parents", type=int, default=200, help="Number of directories, whose sub dirs are read.")
+    parser.add_argument("--batch", type=int, default=1000, help="Size of `IN` list for a huge directory.")
+    parser.add_argument("--no-seed", action="store_true", help="Use tables from the previous run.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    tree_parents, tree_files = generate_tree(args.files, args.dir_files, args.fanout, args.seed)
+    db_connection = connect(args)
+    if not args.no_seed:
+        time_seed = perf_counter()
+        seed_tables(db_connection, args.dbtype, tree_parents, tree_files, args.valid_cache, args.seed)
+        print(
+            f"seeded {len(tree_parents) + sum(map(len, tree_files.values()))} rows: {perf_counter() - time_seed:.1f}s"
+        )
+    children: dict[int, list[int]] = {}
+    for child, parent_id in tree_parents.items():
+        children.setdefault(parent_id, []).append(child)
+    rng_sample = random.Random(args.seed + 1)
+    sample = rng_sample.sample([i for i in children if i], min(args.parents, len(children) - 1))
+    all_images = [i for files_list in tree_files.values() for i in files_list if i[2] == MIMEPART_IMAGE]
+    batches = [rng_sample.sample(all_images, min(args.batch, len(all_images))) for _ in range(20)]
+    for warm_up in (True, False):  # the first run reads pages of tables into memory of DB
+        if not warm_up:
+            print(f"{'mode':>8} {'queries':>8} {'valid':>8} {'time, s':>8} {'ms/query':>9} {'ms/dir':>8}")
+        for lookup in ("join", "fileid"):
+            n_queries, n_valid, n_dirs, elapsed = run_mode(
+                db_connection, lookup, [children[i] for i in sample], tree_files
+            )
+            if not warm_up:
+                print(
+                    f"{lookup:>8} {n_queries:>8} {n_valid:>8} {elapsed:>8.2f} {1000 * elapsed / n_queries:>9.2f}"
+                    f" {1000 * elapsed / n_dirs:>8.3f}"
+                )
+        for lookup in ("join", "fileid"):
+            n_queries, n_valid, elapsed = run_batch(db_connection, lookup, batches)
+            if not warm_up:
+                print(
+                    f"{lookup + '*':>8} {n_queries:>8} {n_valid:>8} {elapsed:>8.2f} {1000 * elapsed / n_queries:>9.2f}"
+                    f" {'':>8}"
+                )
+    print(f"* {args.batch} random images in one query")
@@ -0,0 +1,30 @@
+"""
+Benchmark of order independent grouping. Run from the root of repository:
+
+    python3 -m benchmarks.bench_clustering --sizes 100000,1000000 --workers 16
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy
+
+from benchmarks.bench_hash_index import generate_hashes
+from python.clustering import cluster_hashes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of order independent grouping.")
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000")
+    parser.add_argument("--hash-size", type=int, default=16)
+    parser.add_argument("--precision", type=int, default=26, help="Default is for hash_size=16 and threshold=90%%.")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Part of hashes that are near-duplicates.")
+    parser.add_argument("--workers", type=int, default=0, help="Number of threads, default is number of CPUs.")
+    parser.add_argument("--block-rows", type=int, default=1024)
+    args = parser.parse_args()
+    print(f"{'hashes':>10} {'groups':>10} {'time, s':>10}")
+    for size in map(int, args.sizes.split(",")):
+        data = generate_hashes(size, args.hash_size**2, args.precision, args.duplicates, 0)
+        time_start = perf_counter()
+        roots = cluster_hashes(data, args.precision, args.workers, args.block_rows)
+        n_groups = numpy.unique(roots).size
+        print(f"{size:>10} {n_groups:>10} {perf_counter() - time_start:>10.2f}")
@@ -0,0 +1,68 @@
+"""
+Benchmark of indexes for images grouping. Run from the root of repository:
+
+    python3 -m benchmarks.bench_hash_index --sizes 10000,100000,1000000,5000000
+
+With `--frames 4` hashes are like video hashes: four frame hashes and four times bigger precision.
+
+Hashes are random, a part of them are copies of previous ones with few flipped bits, so groups appear.
+For sizes up to `--linear-max` results of the index are compared with the results of the linear scan.
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy
+
+from python.hash_index import create_index, hash_words
+
+
+def generate_hashes(count: int, hash_bits: int, precision: int, duplicates: float, seed: int) -> numpy.ndarray:
+    rng = numpy.random.default_rng(seed)
+    hashes = rng.integers(0, 2**64, size=(count, hash_words(hash_bits)), dtype=numpy.uint64, endpoint=False)
+    bits = numpy.unpackbits(hashes.view(numpy.uint8), axis=1)
+    for i in numpy.flatnonzero(rng.random(count) < duplicates):
+        if i == 0:
+            continue
+        bits[i] = bits[rng.integers(0, i)]
+        flip = rng.choice(hash_bits, size=rng.integers(0, precision + 1), replace=False)
+        bits[i, flip] ^= 1
+    return numpy.packbits(bits, axis=1).view(numpy.uint64)
+
+
+def group_hashes(kind: str, precision: int, hash_bits: int, hashes: numpy.ndarray, parts=1) -> tuple[list, float]:
+    index = create_index(kind, precision, hash_bits, parts)
+    assigned = []
+    time_start = perf_counter()
+    for packed_hash in hashes:
+        group_number = index.find(packed_hash)
+        if group_number == -1:
+            group_number = index.add(packed_hash)
+        assigned.append(group_number)
+    return assigned, perf_counter() - time_start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of indexes for images grouping.")
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000,5000000")
+    parser.add_argument("--hash-size", type=int, default=16)
+    parser.add_argument("--precision", type=int, default=26, help="Default is for hash_size=16 and threshold=90%%.")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Part of hashes that are near-duplicates.")
+    parser.add_argument("--linear-max", type=int, default=20000, help="Max size for comparison with linear scan.")
+    parser.add_argument("--frames", type=int, default=1, help="Number of frames in hash, 4 for videos.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    bits = args.frames * args.hash_size**2
+    args.precision *= args.frames
+    print(f"{'hashes':>10} {'groups':>10} {'multi, s':>10} {'us/hash':>8} {'linear, s':>10}")
+    for size in map(int, args.sizes.split(",")):
+        data = generate_hashes(size, bits, args.precision, args.duplicates, args.seed)
+        multi_groups, multi_time = group_hashes("multi", args.precision, bits, data, args.frames)
+        linear_time = ""
+        if size <= args.linear_max:
+            linear_groups, _linear_time = group_hashes("linear", args.precision, bits, data)
+            if linear_groups != multi_groups:
+                raise AssertionError(f"Groups are different from linear scan, size={size}")
+            linear_time = f"{_linear_time:.2f}"
+        n_groups = max(multi_groups) + 1
+        print(f"{size:>10} {n_groups:>10} {multi_time:>10.2f} {multi_time / size * 1e6:>8.1f} {linear_time:>10}")
@@ -0,0 +1,87 @@
+"""
+Benchmark of reduced resolution decoding for images hashing. Run from the root of repository:
+
+    python3 -m benchmarks.bench_image_decode --width 6000 --height 4000
+
+Images are `tests/cat.hif` and the same photo enlarged to the given size and saved as JPEG and PNG.
+For each image and hash algorithm hash is calculated from fully decoded image and from reduced one, hamming distance
+between them must be not bigger than `--max-distance` percents of hash bits, otherwise benchmark exits with error.
+"""
+
+import argparse
+import sys
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+
+import numpy
+from pi_heif import register_heif_opener
+from PIL import Image, ImageOps
+
+from python.image_decode import hash_input_size, reduce_image
+from python.imagehash import average_hash, dhash, phash, whash
+
+ALGORITHMS = {"phash": phash, "dhash": dhash, "whash": whash, "average": average_hash}
+
+register_heif_opener()
+
+
+def generate_image(photo: bytes, width: int, height: int, image_format: str) -> bytes:
+    """Returns photo resized to `width` x `height` and saved in `image_format`, with noise like from camera."""
+
+    pixels = numpy.asarray(Image.open(BytesIO(photo)).convert("RGB").resize((width, height), Image.BICUBIC))
+    pixels = pixels + numpy.random.default_rng(0).normal(0, 4, pixels.shape)
+    buf = BytesIO()
+    Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8)).save(buf, format=image_format, quality=90)
+    return buf.getvalue()
+
+
+def full_decode_hash(algo: str, hash_size: int, image_data: bytes):
+    return ALGORITHMS[algo](ImageOps.exif_transpose(Image.open(BytesIO(image_data))), hash_size=hash_size)
+
+
+def reduced_decode_hash(algo: str, hash_size: int, image_data: bytes):
+    """The same as `hash_image_data` from `python.images`."""
+
+    pil_image = Image.open(BytesIO(image_data))
+    image_scale = hash_input_size(algo, hash_size, pil_image.size)
+    pil_image = ImageOps.exif_transpose(reduce_image(pil_image, image_scale))
+    if algo == "whash":
+        return whash(pil_image, hash_size=hash_size, image_scale=image_scale)
+    return ALGORITHMS[algo](pil_image, hash_size=hash_size)
+
+
+def measure(func, repeat: int, *args):
+    result, time_start = None, perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return result, (perf_counter() - time_start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of reduced resolution decoding for images hashing.")
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--hash-sizes", type=str, default="8,16")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-distance", type=float, default=5.0, help="Max distance in percents of hash bits.")
+    args = parser.parse_args()
+    photo = Path(__file__).parent.parent.joinpath("tests/cat.hif").read_bytes()
+    images = {"HEIF": photo}
+    images.update({i: generate_image(photo, args.width, args.height, i) for i in ("JPEG", "PNG")})
+    failed = False
+    print(f"{'image':>6} {'algo':>8} {'size':>5} {'full, ms':>10} {'reduced, ms':>12} {'distance':>9}")
+    for image_format, image_data in images.items():
+        for hash_size in map(int, args.hash_sizes.split(",")):
+            for algo in ALGORITHMS:
+                full_hash, full_time = measure(full_decode_hash, args.repeat, algo, hash_size, image_data)
+                reduced_hash, reduced_time = measure(reduced_decode_hash, args.repeat, algo, hash_size, image_data)
+                distance = int(numpy.count_nonzero(full_hash != reduced_hash))
+                if distance > hash_size**2 * args.max_distance / 100:
+                    failed = True
+                print(
+                    f"{image_format:>6} {algo:>8} {hash_size:>5} {full_time * 1000:>10.1f} {reduced_time * 1000:>12.1f}"
+                    f" {distance:>9}"
+                )
+    if failed:
+        sys.exit(f"Distance between hashes is bigger than {args.max_distance}% of hash bits.")
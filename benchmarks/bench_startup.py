@@ -0,0 +1,79 @@
+"""
+Benchmark of startup: wall time and peak RSS from launch of process until the first query of tasks. Run from the root
+of repository, on a host with Nextcloud, as `occ` and the database are needed to get to the query:
+
+    python3 -m benchmarks.bench_startup --repeat 10
+
+Each run is a new `python3` process, that runs `main.py` with `-t 1` or `--daemon` and exits at the first call of
+`get_tasks`, so only startup is measured. `--info` is measured until the exit. Mode `eager` imports before `main.py`
+all modules and libraries that were imported at start before they were loaded on demand, for comparison.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+EXIT_AT_QUERY = 3
+
+EAGER_IMPORTS = """
+import numpy, pywt, scipy.fftpack, scipy.sparse.csgraph
+try:
+    import av
+except ImportError:
+    pass
+from pi_heif import register_heif_opener
+register_heif_opener()
+import python.bundle_info, python.daemon, python.images, python.tasks_pool
+"""
+
+CHILD_CODE = """
+import os, runpy, sys
+import python.db_requests
+
+def exit_at_query(*args, **kwargs):
+    sys.stdout.flush()
+    os._exit({exit_code})
+
+python.db_requests.get_tasks = exit_at_query
+{eager}
+sys.argv = ["main.py"] + {main_args!r}
+runpy.run_path("main.py", run_name="__main__")
+"""
+
+MAIN_ARGS = {"tasks": ["-t", "1"], "daemon": ["--daemon"], "info": ["--info"]}
+
+
+def run_once(main_args: list[str], eager: bool) -> tuple[float, int]:
+    """Returns wall time in seconds and peak RSS in KiB of the child process."""
+
+    code = CHILD_CODE.format(eager=EAGER_IMPORTS if eager else "", exit_code=EXIT_AT_QUERY, main_args=main_args)
+    time_start = perf_counter()
+    with subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL) as process:
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = perf_counter() - time_start
+        process.returncode = os.waitstatus_to_exitcode(status)
+    expected = 0 if main_args == MAIN_ARGS["info"] else EXIT_AT_QUERY
+    if process.returncode != expected:
+        sys.exit(f"`main.py {' '.join(main_args)}` exited with {process.returncode}, is `occ` working?")
+    return elapsed, rusage.ru_maxrss
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of startup until the first query of tasks.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cmd", type=str, action="append", choices=list(MAIN_ARGS), help="Default is all.")
+    parser.add_argument("--no-eager", action="store_true", help="Do not measure mode `eager`.")
+    args = parser.parse_args()
+    run_once(MAIN_ARGS["info"], False)  # the first run reads files of libraries into page cache
+    print(f"{'cmd':>8} {'mode':>6} {'min, ms':>8} {'median, ms':>11} {'RSS, MiB':>9}")
+    for cmd in args.cmd or list(MAIN_ARGS):
+        for eager_mode in (False,) if args.no_eager else (False, True):
+            results = [run_once(MAIN_ARGS[cmd], eager_mode) for _ in range(args.repeat)]
+            times = [i[0] * 1000 for i in results]
+            print(
+                f"{cmd:>8} {'eager' if eager_mode else 'lazy':>6} {min(times):>8.1f} {median(times):>11.1f}"
+                f" {median(i[1] for i in results) / 1024:>9.1f}"
+            )
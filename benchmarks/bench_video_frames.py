@@ -0,0 +1,159 @@
+"""
+Benchmark of frames extraction for video hashes. Run from the root of repository:
+
+    python3 -m benchmarks.bench_video_frames --duration 60 --size 1280x720
+
+Synthetic videos are generated with ffmpeg: one starts from a good frame, another one fades in from black, so the
+first frame for hash is found by the scan. Each video is processed from the path and from the data in memory, with
+the previous way(separate ffmpeg process for the scan and for each frame) and with `get_hash_frames`.
+Frames must be the same, otherwise benchmark exits with error.
+
+Then for each hash algorithm full size BMP frames are compared with grayscale frames scaled by ffmpeg to the input
+size of algorithm: bytes of frames, time of extraction and hashing, and hamming distance between video hashes.
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy
+
+from benchmarks.bench_image_decode import ALGORITHMS, reduced_decode_hash
+from python.video_frames import (
+    FIRST_FRAME_RESOLUTION,
+    build_times_for_hashes,
+    get_first_timestamp,
+    get_hash_frames,
+    get_max_first_frame_time,
+    gray_frame_size,
+)
+
+
+class CountingPopen(subprocess.Popen):
+    """Counts started processes and bytes written to their stdin."""
+
+    spawns = 0
+    bytes_piped = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.spawns += 1
+        super().__init__(*args, **kwargs)
+
+    def communicate(self, input=None, timeout=None):  # pylint: disable=redefined-builtin
+        CountingPopen.bytes_piped += len(input) if input else 0
+        return super().communicate(input, timeout)
+
+
+def generate_video(path: str, duration: int, size: str, fade_in: bool) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size={size}:rate=30:duration={duration}",
+            *(["-vf", "fade=in:st=0:d=3"] if fade_in else []),
+            "-c:v",
+            "libx264",
+            "-g",
+            "120",
+            "-movflags",
+            "+faststart",
+            path,
+        ],
+        check=True,
+    )
+
+
+def previous_hash_frames(duration: int, path, data) -> tuple[list[int], list[bytes], str]:
+    """Frames extraction as it was before `get_hash_frames`: one process for the scan and one for each frame."""
+
+    max_timestamp = get_max_first_frame_time(duration)
+    video_input = "pipe:0" if path is None else path
+    scan = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "fatal", "-an", "-sn", "-dn", "-to", f"{max_timestamp}ms"]
+        + ["-i", video_input, "-f", "rawvideo", "-s", f"{FIRST_FRAME_RESOLUTION}x{FIRST_FRAME_RESOLUTION}"]
+        + ["-pix_fmt", "rgb24", "pipe:1"],
+        input=data,
+        capture_output=True,
+        check=True,
+    ).stdout
+    timestamps = build_times_for_hashes(duration, get_first_timestamp(scan, max_timestamp)[0])
+    frames = [
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "fatal", "-an", "-sn", "-dn", "-ss", f"{timestamp}ms"]
+            + ["-i", video_input, "-f", "image2", "-c:v", "bmp", "-frames", "1", "pipe:1"],
+            input=data,
+            capture_output=True,
+            check=True,
+        ).stdout
+        for timestamp in timestamps
+    ]
+    return timestamps, frames, ""
+
+
+def hash_video(algo: str, hash_size: int, duration: int, path: str, gray: bool) -> tuple[numpy.ndarray, int]:
+    """Returns hash of video and number of bytes in frames."""
+
+    _, frames, err = get_hash_frames(duration, path, None, gray_frame_size(algo, hash_size) if gray else None)
+    if err:
+        raise RuntimeError(err)
+    if gray:
+        hashes = [ALGORITHMS[algo](frame, hash_size=hash_size) for frame in frames]
+        return numpy.concatenate([i.flatten() for i in hashes]), sum(i.nbytes for i in frames)
+    hashes = [reduced_decode_hash(algo, hash_size, frame) for frame in frames]
+    return numpy.concatenate([i.flatten() for i in hashes]), sum(len(i) for i in frames)
+
+
+def measure(func, duration: int, path, data):
+    CountingPopen.spawns, CountingPopen.bytes_piped = 0, 0
+    time_start = perf_counter()
+    result = func(duration, path, data)
+    return result, CountingPopen.spawns, CountingPopen.bytes_piped, perf_counter() - time_start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of frames extraction for video hashes.")
+    parser.add_argument("--duration", type=int, default=60, help="Duration of videos in seconds.")
+    parser.add_argument("--size", type=str, default="1280x720")
+    parser.add_argument("--hash-size", type=int, default=16)
+    args = parser.parse_args()
+    subprocess.Popen = CountingPopen
+    failed = False
+    print(f"{'video':>8} {'input':>6} {'processes':>14} {'piped, MB':>16} {'time, s':>14}")
+    with TemporaryDirectory() as tmp_dir:
+        for name, fade_in in (("plain", False), ("fade_in", True)):
+            video_path = str(Path(tmp_dir).joinpath(f"{name}.mp4"))
+            generate_video(video_path, args.duration, args.size, fade_in)
+            video_data = Path(video_path).read_bytes()
+            for input_type, video_args in (("path", (video_path, None)), ("data", (None, video_data))):
+                old = measure(previous_hash_frames, args.duration * 1000, *video_args)
+                new = measure(get_hash_frames, args.duration * 1000, *video_args)
+                if new[0][2] or old[0][:2] != new[0][:2]:
+                    failed = True
+                print(
+                    f"{name:>8} {input_type:>6} {old[1]:>6} -> {new[1]:>4} {old[2] / 2**20:>7.1f} ->"
+                    f" {new[2] / 2**20:>5.1f} {old[3]:>6.2f} -> {new[3]:>4.2f}"
+                )
+        print(f"\n{'algo':>8} {'frames, KB':>18} {'time, s':>14} {'distance':>9}")
+        video_path = str(Path(tmp_dir).joinpath("plain.mp4"))
+        for algo in ALGORITHMS:
+            results = []
+            for gray in (False, True):
+                time_start = perf_counter()
+                results.append((*hash_video(algo, args.hash_size, args.duration * 1000, video_path, gray),))
+                results[-1] += (perf_counter() - time_start,)
+            distance = numpy.count_nonzero(results[0][0] != results[1][0])
+            print(
+                f"{algo:>8} {results[0][1] / 1024:>8.0f} -> {results[1][1] / 1024:>6.0f}"
+                f" {results[0][2]:>6.2f} -> {results[1][2]:>4.2f} {distance:>9}"
+            )
+    if failed:
+        sys.exit("Frames are different from the previous way of extraction.")
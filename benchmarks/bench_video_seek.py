@@ -0,0 +1,104 @@
+"""
+Benchmark of `accurate` and `keyframe` seek modes for video hashes. Run from the root of repository:
+
+    python3 -m benchmarks.bench_video_seek --clips 8 --duration 120 --gop 300
+
+Synthetic clips are generated with ffmpeg(`life` source with different seeds), each clip has two copies, that are
+re-encoded with lower resolution and quality: one with the same distance between keyframes, another one with
+`--copy-gop`. Keyframes of the second copy are at other timestamps, which is the worst case for `keyframe` seek.
+
+For each mode videos are hashed and grouped as in `python.videos`, then groups are compared with the expected ones:
+copies that were found in the group of original, average distances to copies, and pairs of different clips that
+were joined.
+"""
+
+import argparse
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy
+
+from benchmarks.bench_image_decode import ALGORITHMS, reduced_decode_hash
+from python.clustering import create_grouping_index
+from python.hash_index import hash_from_bytes
+from python.video_frames import get_hash_frames, gray_frame_size
+
+
+def encode_video(path: str, video_input: list[str], gop: int, crf: int) -> None:
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *video_input, "-c:v", "libx264", "-crf", str(crf)]
+        + ["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0", path],
+        check=True,
+    )
+
+
+def hash_video(algo: str, hash_size: int, duration: int, path: str, gray: bool, seek: str) -> bytes:
+    _, frames, err = get_hash_frames(duration, path, None, gray_frame_size(algo, hash_size) if gray else None, seek)
+    if err:
+        raise RuntimeError(err)
+    if gray:
+        hashes = [ALGORITHMS[algo](frame, hash_size=hash_size) for frame in frames]
+    else:
+        hashes = [reduced_decode_hash(algo, hash_size, frame) for frame in frames]
+    return numpy.packbits(numpy.concatenate([i.flatten() for i in hashes])).tobytes()
+
+
+def group_videos(hashes: list[bytes], precision: int, hash_bits: int) -> list[int]:
+    """Returns group number for each video, the same way as `FilesGroups.add` does."""
+
+    index = create_grouping_index("first_match", "multi", precision, hash_bits, parts=4)
+    assigned = []
+    for video_hash in map(hash_from_bytes, hashes):
+        group_number = index.find(video_hash)
+        if group_number == -1:
+            group_number = index.add(video_hash)
+        assigned.append(group_number)
+    return assigned
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of seek modes for video hashes.")
+    parser.add_argument("--clips", type=int, default=4, help="Number of clips, each one has two copies.")
+    parser.add_argument("--duration", type=int, default=60, help="Duration of videos in seconds.")
+    parser.add_argument("--size", type=str, default="1280x720")
+    parser.add_argument("--gop", type=int, default=300, help="Frames between keyframes of originals.")
+    parser.add_argument("--copy-gop", type=int, default=250, help="Frames between keyframes of the second copy.")
+    parser.add_argument("--algo", type=str, default="phash", choices=list(ALGORITHMS))
+    parser.add_argument("--hash-size", type=int, default=16)
+    parser.add_argument("--precision", type=int, default=26, help="Default is for hash_size=16 and threshold=90%%.")
+    parser.add_argument("--gray", action="store_true", help="Use `gray` format of frames.")
+    args = parser.parse_args()
+    hash_bits = 4 * args.hash_size**2
+    print(f"{'':>18} {'copies found':>13} {'distance to copy':>17}")
+    print(f"{'seek':>9} {'time, s':>8} {'same':>6} {'other':>6} {'same':>8} {'other':>8} {'wrong pairs':>12}")
+    with TemporaryDirectory() as tmp_dir:
+        videos = []  # original, copy with the same keyframes, copy with other keyframes
+        for clip in range(args.clips):
+            original = str(Path(tmp_dir).joinpath(f"{clip}_orig.mp4"))
+            source = f"life=size={args.size}:rate=30:seed={clip}:mold=10:ratio=0.3"
+            encode_video(original, ["-f", "lavfi", "-i", source, "-t", str(args.duration)], args.gop, 20)
+            videos.append(original)
+            for copy_name, copy_gop in (("same", args.gop), ("other", args.copy_gop)):
+                videos.append(str(Path(tmp_dir).joinpath(f"{clip}_{copy_name}.mp4")))
+                encode_video(videos[-1], ["-i", original, "-vf", "scale=iw*3/4:-2"], copy_gop, 30)
+        for seek in ("accurate", "keyframe"):
+            time_start = perf_counter()
+            video_hashes = [
+                hash_video(args.algo, args.hash_size, args.duration * 1000, i, args.gray, seek) for i in videos
+            ]
+            hashing_time = perf_counter() - time_start
+            groups = group_videos(video_hashes, 4 * args.precision, hash_bits)
+            bits = [numpy.unpackbits(numpy.frombuffer(i, dtype=numpy.uint8)) for i in video_hashes]
+            found, distances = [], []
+            for copy_offset in (1, 2):
+                copies = [(i, i + copy_offset) for i in range(0, len(videos), 3)]
+                found.append(f"{sum(groups[i] == groups[j] for i, j in copies)}/{args.clips}")
+                distances.append(numpy.mean([numpy.count_nonzero(bits[i] != bits[j]) for i, j in copies]))
+            pairs = [(i, j) for i in range(len(videos)) for j in range(i + 1, len(videos)) if i // 3 != j // 3]
+            wrong = sum(groups[i] == groups[j] for i, j in pairs)
+            print(
+                f"{seek:>9} {hashing_time:>8.2f} {found[0]:>6} {found[1]:>6} {distances[0]:>8.1f} {distances[1]:>8.1f}"
+                f" {wrong:>12}"
+            )
@@ -1,15 +1,11 @@
 import argparse
+import os
 import sys
 
-from nc_py_api import CONFIG
-from numpy import count_nonzero
-from PIL import Image, ImageOps
-
-from python.bundle_info import bundle_info
-from python.db_requests import get_tasks
-from python.images import pil_to_hash
 from python.log import logger as log
-from python.task import process_task
+
+# Modules are imported by the option that uses them, so the binary starts without loading unused libraries.
+# pylint: disable=import-outside-toplevel
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Module for performing objects operations.", add_help=True)
@@ -24,24 +20,78 @@ if __name__ == "__main__":
     group.add_argument(
         "--info", dest="bundle_info", action="store_true", help="Print information about bundled packages."
     )
+    group.add_argument(
+        "--daemon",
+        dest="daemon",
+        action="store_true",
+        help="Run as worker, that processes not finished MediaDC tasks until SIGTERM or SIGINT.",
+    )
     group.add_argument(
         "--test", dest="test", type=str, action="append", help="Performs a comparison of two files. Specify twice."
     )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        help=(
+            "Number of processes for hashing images and of concurrent ffmpeg processes for videos, 0 means the number"
+            " of CPUs. Overrides `MDC_WORKERS` env variable."
+        ),
+    )
+    parser.add_argument(
+        "--parallel",
+        dest="parallel",
+        type=int,
+        help=(
+            "Number of tasks from `-t`, that are processed at the same time, each with its own `--workers`."
+            " Overrides `MDC_PARALLEL_TASKS` env variable, default is 1."
+        ),
+    )
+    parser.add_argument(
+        "--poll",
+        dest="poll",
+        type=float,
+        default=10.0,
+        help="Interval in seconds between checks of tasks table in `--daemon` mode.",
+    )
     args = parser.parse_args()
+    if args.workers is not None:
+        os.environ["MDC_WORKERS"] = str(args.workers)
     if args.bundle_info:
+        from python.bundle_info import bundle_info
+
         bundle_info()
     elif args.mdc_tasks_id:
+        from nc_py_api import CONFIG
+
+        from python.db_requests import get_tasks
+
         if not CONFIG["valid"]:
             log.error("Unable to parse config or connect to database. Does `occ` works?")
             sys.exit(1)
-        tasks_to_process = get_tasks()
-        tasks_to_process = list(filter(lambda row: row["id"] in args.mdc_tasks_id, tasks_to_process))
+        tasks_to_process = get_tasks(args.mdc_tasks_id)
         missing_tasks = list(filter(lambda r: not any(row["id"] == r for row in tasks_to_process), args.mdc_tasks_id))
         for x in missing_tasks:
             log.warning("Cant find task with id=%u", x)
-        for i in tasks_to_process:
-            process_task(i)
+        from python.tasks_pool import process_tasks
+
+        process_tasks(tasks_to_process, args.parallel or int(os.environ.get("MDC_PARALLEL_TASKS", "1")))
+    elif args.daemon:
+        from nc_py_api import CONFIG
+
+        from python.daemon import run_daemon
+
+        if not CONFIG["valid"]:
+            log.error("Unable to parse config or connect to database. Does `occ` works?")
+            sys.exit(1)
+        run_daemon(args.poll)
     elif args.test:
+        from numpy import count_nonzero
+        from PIL import Image, ImageOps
+
+        from python.images import pil_to_hash, register_heif
+
+        register_heif()
         for algo in ("phash", "dhash", "whash", "average"):
             img_hashes = [
                 pil_to_hash(algo, 16, ImageOps.exif_transpose(Image.open(args.test[0]))).flatten(),
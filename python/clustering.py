@@ -0,0 +1,193 @@
+"""
+Order independent grouping: groups are connected components of the graph, where edges are pairs of hashes
+within `precision`. Pairs are searched in all hashes by blocks, so memory usage does not depend on their number.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from typing import Optional
+
+import numpy
+
+from .hash_index import LinearIndex, create_index, popcount
+
+GROUPING_MODES = ("first_match", "connected")
+BLOCK_ROWS = 1024
+
+
+class DisjointSets:
+    """Union-find with path halving."""
+
+    def __init__(self, size: int):
+        self.parent = numpy.arange(size, dtype=numpy.intp)
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def roots(self) -> numpy.ndarray:
+        """Returns root of set for each element."""
+
+        parent = self.parent.copy()
+        while True:
+            grand_parent = parent[parent]
+            if numpy.array_equal(grand_parent, parent):
+                return parent
+            parent = grand_parent
+
+
+def block_links(hashes: numpy.ndarray, precision: int, row_start: int, col_start: int, block_rows: int):
+    """Searches pairs within `precision` between two blocks of hashes.
+
+    Returns two arrays: indexes of hashes and indexes of hashes they should be joined with. Instead of all found
+    pairs, each hash is linked only with the first hash of its connected component inside these two blocks."""
+
+    rows = numpy.ascontiguousarray(hashes[row_start : row_start + block_rows].T)
+    cols = numpy.ascontiguousarray(hashes[col_start : col_start + block_rows].T)
+    distances = numpy.zeros((rows.shape[1], cols.shape[1]), dtype=numpy.uint16)
+    xor_words = numpy.empty(distances.shape, dtype=numpy.uint64)
+    for word in range(hashes.shape[1]):
+        numpy.bitwise_xor(rows[word, :, None], cols[word, None, :], out=xor_words)
+        distances += popcount(xor_words)
+    within_precision = distances <= precision
+    if not within_precision.any():
+        return numpy.empty(0, dtype=numpy.intp), numpy.empty(0, dtype=numpy.intp)
+    pair_rows, pair_cols = numpy.nonzero(within_precision)
+    if row_start == col_start:
+        upper = pair_rows < pair_cols
+        pair_rows, pair_cols = pair_rows[upper], pair_cols[upper]
+    if not pair_rows.size:
+        return pair_rows, pair_cols
+    import scipy.sparse.csgraph  # pylint: disable=import-outside-toplevel
+
+    nodes = numpy.concatenate((pair_rows + row_start, pair_cols + col_start))
+    nodes, local_ids = numpy.unique(nodes, return_inverse=True)
+    graph = scipy.sparse.coo_matrix(
+        (numpy.ones(pair_rows.size, dtype=numpy.int8), (local_ids[: pair_rows.size], local_ids[pair_rows.size :])),
+        shape=(nodes.size, nodes.size),
+    )
+    _, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    _, first_of_label = numpy.unique(labels, return_index=True)
+    return nodes, nodes[first_of_label[labels]]
+
+
+def cluster_hashes(
+    hashes: numpy.ndarray, precision: int, workers: int = 0, block_rows: int = BLOCK_ROWS
+) -> numpy.ndarray:
+    """Returns for each hash the index of the first hash in its group. Result does not depend on order of hashes.
+
+    :param hashes: matrix of packed hashes, one hash per row.
+    :param precision: maximum hamming distance between hashes to be joined.
+    :param workers: number of threads, zero means the number of CPUs.
+    :param block_rows: size of blocks, in the worst case each worker allocates block_rows^2 * 8 bytes."""
+
+    count = hashes.shape[0]
+    sets = DisjointSets(count)
+    blocks = [(i, j) for i in range(0, count, block_rows) for j in range(i, count, block_rows)]
+    workers = workers if workers > 0 else cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk_start in range(0, len(blocks), 4 * workers):
+            futures = [
+                executor.submit(block_links, hashes, precision, row_start, col_start, block_rows)
+                for row_start, col_start in blocks[chunk_start : chunk_start + 4 * workers]
+            ]
+            for future in futures:
+                for a, b in zip(*future.result()):
+                    sets.union(a, b)
+    return sets.roots()
+
+
+class ConnectedIndex(LinearIndex):
+    """Keeps each hash as a separate group, groups are joined in `merge_groups` when all hashes are collected."""
+
+    def __init__(self, precision: int, hash_bits: int, workers: int = 0):
+        super().__init__(precision, hash_bits)
+        self.workers = workers
+
+    def find(self, packed_hash: numpy.ndarray) -> int:
+        return -1
+
+    def merge_groups(self, groups: dict[int, list[int]]) -> None:
+        """Joins groups of connected hashes. Groups are sorted by the smallest file id, as file ids inside them."""
+
+        roots = cluster_hashes(self.hashes.rows, self.precision, self.workers)
+        merged: dict[int, list[int]] = {}
+        for group_number, root in enumerate(roots):
+            merged.setdefault(int(root), []).extend(groups[group_number])
+        groups.clear()
+        for files_id in sorted((sorted(i) for i in merged.values()), key=lambda x: x[0]):
+            groups[len(groups)] = files_id
+
+
+def create_grouping_index(
+    mode: str, index_kind: str, precision: int, hash_bits: int, parts: int = 1, workers: int = 0
+) -> LinearIndex:
+    """For `first_match` mode returns index of `index_kind`, for `connected` returns `ConnectedIndex`,
+    that uses `workers` threads."""
+
+    if mode == "first_match":
+        return create_index(index_kind, precision, hash_bits, parts)
+    if mode == "connected":
+        return ConnectedIndex(precision, hash_bits, workers)
+    raise ValueError(f"Unknown grouping mode: `{mode}`. Supported: {GROUPING_MODES}")
+
+
+class FilesGroups:
+    """Groups of files of one task. Number of group is the number of its representative in `index`."""
+
+    def __init__(self, index: LinearIndex):
+        self.index = index
+        self.groups: dict[int, list[int]] = {}
+        self.deferred: Optional[list[tuple[int, numpy.ndarray]]] = None
+
+    def add(self, fileid: int, packed_hash: numpy.ndarray) -> None:
+        if self.deferred is not None:
+            self.deferred.append((fileid, packed_hash))
+            return
+        group_number = self.index.find(packed_hash)
+        if group_number != -1:
+            self.groups[group_number].append(fileid)
+            return
+        self.groups[self.index.add(packed_hash)] = [fileid]
+
+    def defer_adding(self) -> None:
+        """Files are not added to groups, until `add_deferred` is called."""
+
+        self.deferred = []
+
+    def add_deferred(self) -> None:
+        """Adds files, that were deferred by `defer_adding`, in the same order."""
+
+        deferred, self.deferred = self.deferred, None
+        for fileid, packed_hash in deferred or []:
+            self.add(fileid, packed_hash)
+
+    def get_state(self) -> tuple[numpy.ndarray, dict[int, list[int]]]:
+        """Returns representatives of groups, in order of groups numbers, and files of each group."""
+
+        return self.index.hashes.rows, self.groups
+
+    def restore_state(self, hashes: numpy.ndarray, groups: dict[int, list[int]]) -> None:
+        """Replaces groups with `get_state` result of groups with the same settings.
+
+        Groups without files are dropped, so hashes of removed files do not join other groups."""
+
+        self.index.clear()
+        self.groups.clear()
+        keys = [key for key in sorted(groups) if groups[key]]
+        self.index.extend(hashes[keys])
+        self.groups.update(zip(range(len(keys)), [groups[key] for key in keys]))
+
+    def get_results(self) -> list[list[int]]:
+        """Called when all files are added, returns groups with more than one file."""
+
+        self.index.merge_groups(self.groups)
+        return [files_id for files_id in self.groups.values() if len(files_id) > 1]
@@ -0,0 +1,48 @@
+"""
+Long-running worker, that polls table of tasks and processes runnable tasks one by one.
+
+Process keeps DB connection, imported modules and caches between tasks. Tasks are claimed with the same lock as
+tasks from command line, so several workers and command line runs can be used together. On SIGTERM or SIGINT
+the current task is interrupted at the next checkpoint, and is continued later as hanged task. Stale checkpoints are
+removed once in `CLEANUP_INTERVAL` seconds.
+"""
+
+import signal
+from time import perf_counter
+
+from .db_requests import get_tasks
+from .log import logger as log
+from .task import (
+    StopRequest,
+    is_task_hanged,
+    process_task,
+    remove_stale_task_checkpoints,
+)
+
+CLEANUP_INTERVAL = 3600
+
+
+def stop_handler(signum, _frame):
+    log.info("Received signal %u, stopping.", signum)
+    StopRequest.set()
+
+
+def run_daemon(poll_interval: float) -> None:
+    """Processes tasks, that are not finished and have no errors, until a signal is received."""
+
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+    log.info("Worker started, poll interval: %s seconds.", poll_interval)
+    cleanup_time = None
+    while not StopRequest.is_set():
+        if cleanup_time is None or perf_counter() - cleanup_time >= CLEANUP_INTERVAL:
+            remove_stale_task_checkpoints()
+            cleanup_time = perf_counter()
+        for task_info in get_tasks(unfinished=True):
+            if StopRequest.is_set():
+                break
+            if task_info["py_pid"] != 0 and not is_task_hanged(task_info):
+                continue  # task is running by another process
+            process_task(task_info, lock_delay=0.0)
+        StopRequest.wait(timeout=poll_interval)
+    log.info("Worker stopped.")
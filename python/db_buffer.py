@@ -0,0 +1,38 @@
+"""
+Write-behind buffer for records of hashes cache.
+
+Records are collected and written by a multi-row query, when there are `batch_size` of them or when the oldest one
+waits longer than `max_delay` seconds. Callers flush it at the end of each directory, at the end of task and on
+exceptions, so a crash loses no more than one batch.
+"""
+
+from time import perf_counter
+from typing import Callable
+
+
+class WriteBuffer:
+    """Records are keyed by fileid: a newer record of the same file replaces the pending one."""
+
+    def __init__(self, store: Callable[[list[tuple]], None], batch_size: int = 1, max_delay: float = 0.0):
+        self.store = store
+        self.batch_size = max(batch_size, 1)
+        self.max_delay = max_delay
+        self.records: dict[int, tuple] = {}
+        self._oldest = 0.0
+
+    def add(self, fileid: int, record: tuple) -> None:
+        if not self.records:
+            self._oldest = perf_counter()
+        self.records[fileid] = record
+        if len(self.records) >= self.batch_size or perf_counter() - self._oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.records:
+            return
+        records = list(self.records.values())
+        self.records.clear()
+        self.store(records)
+
+    def clear(self) -> None:
+        self.records.clear()
@@ -1,16 +1,27 @@
 import os
 from json import loads
+from typing import Optional
 
 from nc_py_api import CONFIG, TABLES, execute_commit, execute_fetchall, get_time
+from nc_py_api.db_requests import FIELD_NAME_LIST
 
 from .db_tables import MDC_TABLES
 
+CACHE_LOOKUPS = ("fileid", "join")
 
-def get_tasks() -> list:
-    """Return list of all tasks(each task is a dict)."""
 
+def get_tasks(task_ids: Optional[list[int]] = None, unfinished: bool = False) -> list:
+    """Return list of all tasks(each task is a dict), or only of `task_ids`, or only not finished without errors."""
+
+    conditions = []
+    if task_ids is not None:
+        conditions.append(f"id IN ({','.join(str(x) for x in task_ids)})")
+    if unfinished:
+        conditions.append("finished_time = 0 AND (errors = '' OR errors IS NULL)")
     _where = ""
-    if CONFIG["dbtype"] == "mysql":
+    if conditions:
+        _where = " WHERE " + " AND ".join(conditions)
+    elif CONFIG["dbtype"] == "mysql":
         _where = " WHERE 1"
     query = (
         "SELECT id, target_directory_ids, exclude_list, collector_settings, files_scanned, "
@@ -56,15 +67,23 @@ def finalize_task(task_id: int) -> None:
     execute_commit(query)
 
 
-def clear_task_files_scanned_groups(task_id: int) -> int:
-    """Prepare task for re-run, cleat count of scanned files."""
+def clear_task_files_scanned_groups(task_id: int, files_scanned: int = 0) -> int:
+    """Prepare task for re-run, cleat count of scanned files. Task that continues from checkpoint keeps `files_scanned`
+    of it."""
 
-    query = f"UPDATE {MDC_TABLES.tasks} SET files_scanned = 0 WHERE id = {task_id};"
+    query = f"UPDATE {MDC_TABLES.tasks} SET files_scanned = {files_scanned} WHERE id = {task_id};"
     execute_commit(query)
     query = f"DELETE FROM {MDC_TABLES.tasks_details} WHERE task_id = {task_id};"
     return execute_commit(query)
 
 
+def clear_task_files_scanned(task_id: int) -> None:
+    """Prepare task for incremental re-run, that keeps groups of previous run."""
+
+    query = f"UPDATE {MDC_TABLES.tasks} SET files_scanned = 0 WHERE id = {task_id};"
+    execute_commit(query)
+
+
 def increase_processed_files_count(task_id: int, count: int) -> None:
     """Increases number of processed files in task."""
 
@@ -90,117 +109,164 @@ def set_task_keepalive(task_id: int, connection_id: int = 1) -> None:
     execute_commit(query, connection_id=connection_id)
 
 
-def get_images_caches(file_ids: list[int]) -> list:
+def get_directories_list(dir_ids: list[int], mount_ids: list[int], after_fileid: int, limit: int) -> list:
+    """Lists directories `dir_ids` together, with storages `mount_ids` mounted to them. Returns up to `limit` records
+    with fileid greater than `after_fileid`, ordered by fileid, so the next page starts after the last one."""
+
+    mp_query = ""
+    if mount_ids:
+        mp_query = f" OR fcache.fileid IN ({','.join(str(x) for x in mount_ids)})"
+    query = (
+        f"SELECT {FIELD_NAME_LIST} FROM {TABLES.file_cache} AS fcache "
+        f"WHERE (fcache.parent IN ({','.join(str(x) for x in dir_ids)}){mp_query}) AND fcache.fileid > {after_fileid} "
+        f"ORDER BY fcache.fileid ASC LIMIT {limit};"
+    )
+    return execute_fetchall(query)
+
+
+def get_ignored_directories(dir_ids: list[int]) -> list[int]:
+    """Returns directories from `dir_ids` with `.noimage` or `.nomedia` file, media files in them are ignored."""
+
+    query = (
+        f"SELECT DISTINCT fcache.parent FROM {TABLES.file_cache} AS fcache "
+        f"WHERE fcache.parent IN ({','.join(str(x) for x in dir_ids)}) AND fcache.name IN ('.noimage', '.nomedia');"
+    )
+    return [i["parent"] for i in execute_fetchall(query)]
+
+
+def get_images_caches(file_ids: list[int], lookup: str = "join") -> list:
+    """With `join` lookup returns a record for each of `file_ids`, `hash` and `skipped` are NULL if there is no
+    valid cache. With `fileid` lookup returns only records of cache, `mtime` should be checked by caller."""
+
+    if lookup == "fileid":
+        query = (
+            "SELECT fileid, mtime, hash, skipped "
+            f"FROM {MDC_TABLES.photos} "
+            f"WHERE fileid IN({','.join(str(x) for x in file_ids)});"
+        )
+        return execute_fetchall(query)
     query = (
-        "SELECT fcache.fileid, imgcache.hash, imgcache.skipped "
+        "SELECT fcache.fileid, imgcache.mtime, imgcache.hash, imgcache.skipped "
         f"FROM {TABLES.file_cache} AS fcache "
         f"LEFT JOIN {MDC_TABLES.photos} AS imgcache "
         "ON fcache.fileid = imgcache.fileid AND fcache.mtime = imgcache.mtime "
-        f"WHERE fcache.fileid IN({','.join(str(x) for x in file_ids)}) "
-        "ORDER BY fileid ASC;"
+        f"WHERE fcache.fileid IN({','.join(str(x) for x in file_ids)});"
     )
     return execute_fetchall(query)
 
 
-def get_videos_caches(file_ids: list[int]) -> list:
+def get_videos_caches(file_ids: list[int], lookup: str = "join") -> list:
+    """With `join` lookup returns a record for each of `file_ids`, cache fields are NULL if there is no valid cache.
+    With `fileid` lookup returns only records of cache, `mtime` should be checked by caller."""
+
+    if lookup == "fileid":
+        query = (
+            "SELECT fileid, mtime, duration, timestamps, hash, skipped "
+            f"FROM {MDC_TABLES.videos} "
+            f"WHERE fileid IN({','.join(str(x) for x in file_ids)});"
+        )
+        return load_timestamps(execute_fetchall(query))
     query = (
-        "SELECT fcache.fileid, vcache.duration, vcache.timestamps, vcache.hash, vcache.skipped "
+        "SELECT fcache.fileid, vcache.mtime, vcache.duration, vcache.timestamps, vcache.hash, vcache.skipped "
         f"FROM {TABLES.file_cache} AS fcache "
         f"LEFT JOIN {MDC_TABLES.videos} AS vcache "
         "ON fcache.fileid = vcache.fileid AND fcache.mtime = vcache.mtime "
-        f"WHERE fcache.fileid IN({','.join(str(x) for x in file_ids)}) "
-        "ORDER BY fileid ASC;"
+        f"WHERE fcache.fileid IN({','.join(str(x) for x in file_ids)});"
     )
-    result = execute_fetchall(query)
+    return load_timestamps(execute_fetchall(query))
+
+
+def load_timestamps(videos_records: list) -> list:
+    """MySQL returns JSON field `timestamps` as string."""
+
     if CONFIG["dbtype"] == "mysql":
-        for each_record in result:
+        for each_record in videos_records:
             if isinstance(each_record["timestamps"], str):
                 each_record["timestamps"] = loads(each_record["timestamps"])
-    return result
+    return videos_records
 
 
-def store_task_files_group(task_id: int, group_id: int, file_id: int) -> None:
-    """Add to table `task_details` one record with similar files."""
+def store_task_files_groups(task_id: int, groups: list[tuple[int, int]], batch_size: int) -> None:
+    """Add to table `task_details` records with similar files, `groups` is a list of (group_id, file_id).
 
-    query = f"INSERT INTO {MDC_TABLES.tasks_details} (task_id,group_id,fileid) VALUES({task_id},{group_id},{file_id});"
-    execute_commit(query)
+    Each query inserts up to `batch_size` records with one commit."""
 
+    batch_size = max(batch_size, 1)
+    for i in range(0, len(groups), batch_size):
+        values = ",".join(f"({task_id},{group_id},{file_id})" for group_id, file_id in groups[i : i + batch_size])
+        execute_commit(f"INSERT INTO {MDC_TABLES.tasks_details} (task_id,group_id,fileid) VALUES{values};")
 
-def store_image_hash(fileid: int, image_hash: str, mtime: int) -> None:
-    """Sets for fileid `mtime`,`hash`. `skipped` sets to zero."""
-    if CONFIG["dbtype"] == "mysql":
-        query = (
-            f"REPLACE INTO {MDC_TABLES.photos} (fileid,hash,mtime,skipped) VALUES({fileid},0x{image_hash},{mtime},0);"
-        )
-    else:
+
+def get_task_files_groups(task_id: int) -> dict[int, int]:
+    """Returns group_id of each file of task, from table `task_details`."""
+
+    query = f"SELECT group_id, fileid FROM {MDC_TABLES.tasks_details} WHERE task_id = {task_id};"
+    return {i["fileid"]: i["group_id"] for i in execute_fetchall(query)}
+
+
+def delete_task_files_groups(task_id: int, file_ids: list[int], batch_size: int) -> None:
+    """Removes from table `task_details` records of `file_ids`, each query removes up to `batch_size` records."""
+
+    batch_size = max(batch_size, 1)
+    for i in range(0, len(file_ids), batch_size):
         query = (
-            f"INSERT INTO {MDC_TABLES.photos} (fileid,hash,mtime,skipped) "
-            f"VALUES({fileid},'\\x{image_hash}',{mtime},0) "
-            "ON CONFLICT (fileid) DO UPDATE "
-            "SET hash = EXCLUDED.hash, "
-            "mtime = EXCLUDED.mtime, "
-            "skipped = EXCLUDED.skipped;"
+            f"DELETE FROM {MDC_TABLES.tasks_details} "
+            f"WHERE task_id = {task_id} AND fileid IN ({','.join(str(x) for x in file_ids[i : i + batch_size])});"
         )
-    execute_commit(query)
+        execute_commit(query)
 
 
-def store_err_image_hash(fileid: int, mtime: int, skipped_count: int) -> None:
-    """Sets for fileid `mtime`,`skipped`. For `hash` set const value:`0x00`."""
+def bytes_literal(hex_str: str) -> str:
+    """Returns SQL literal of binary value for current type of DB."""
 
     if CONFIG["dbtype"] == "mysql":
-        query = (
-            f"REPLACE INTO {MDC_TABLES.photos} (fileid,hash,mtime,skipped) "
-            f"VALUES({fileid},0x00,{mtime},{skipped_count});"
-        )
-    else:
-        query = (
-            f"INSERT INTO {MDC_TABLES.photos} (fileid,hash,mtime,skipped) "
-            f"VALUES({fileid},'\\x00',{mtime},{skipped_count}) "
-            "ON CONFLICT (fileid) DO UPDATE "
-            "SET hash = EXCLUDED.hash, "
-            "mtime = EXCLUDED.mtime, "
-            "skipped = EXCLUDED.skipped;"
-        )
-    execute_commit(query)
+        return f"0x{hex_str}"
+    return f"'\\x{hex_str}'"
+
 
+def store_images_hashes(records: list[tuple[int, str, int, int]]) -> None:
+    """Sets `hash`,`mtime`,`skipped` for each record (fileid, hash, mtime, skipped) with one query.
 
-def store_video_hash(fileid: int, duration: int, timestamps: str, video_hash: str, mtime: int) -> None:
-    """Sets for fileid `duration`,`timestamps`,`mtime`,`hash`. `skipped` sets to zero."""
+    For images that can not be hashed, `hash` should be the const value:`00`."""
+
+    if not records:
+        return
+    values = ",".join(
+        f"({fileid},{bytes_literal(image_hash)},{mtime},{skipped})" for fileid, image_hash, mtime, skipped in records
+    )
     if CONFIG["dbtype"] == "mysql":
-        query = (
-            f"REPLACE INTO {MDC_TABLES.videos} (fileid,duration,timestamps,hash,mtime,skipped) "
-            f"VALUES({fileid},{duration},'{timestamps}',"
-            f"0x{video_hash},{mtime},0);"
-        )
+        query = f"REPLACE INTO {MDC_TABLES.photos} (fileid,hash,mtime,skipped) VALUES{values};"
     else:
         query = (
-            f"INSERT INTO {MDC_TABLES.videos} (fileid,duration,timestamps,hash,mtime,skipped) "
-            f"VALUES({fileid},{duration},'{timestamps}',"
-            f"'\\x{video_hash}',{mtime},0) "
+            f"INSERT INTO {MDC_TABLES.photos} (fileid,hash,mtime,skipped) "
+            f"VALUES{values} "
             "ON CONFLICT (fileid) DO UPDATE "
             "SET hash = EXCLUDED.hash, "
-            "duration = EXCLUDED.duration, "
-            "timestamps = EXCLUDED.timestamps, "
             "mtime = EXCLUDED.mtime, "
             "skipped = EXCLUDED.skipped;"
         )
     execute_commit(query)
 
 
-def store_err_video_hash(fileid: int, duration: int, mtime: int, skipped_count: int) -> None:
-    """Sets for fileid `duration`,`mtime`,`skipped`. For `timestamps` and `hash` set const values:`[0],0x00`."""
+def store_videos_hashes(records: list[tuple[int, int, str, str, int, int]]) -> None:
+    """Sets `duration`,`timestamps`,`hash`,`mtime`,`skipped` for each record
+    (fileid, duration, timestamps, hash, mtime, skipped) with one query.
 
+    For videos that can not be hashed, `timestamps` and `hash` should be the const values:`[0],00`, `timestamps`
+    of frames extracted not in the default way also keep the extraction, see `videos.dump_timestamps`."""
+
+    if not records:
+        return
+    values = ",".join(
+        f"({fileid},{duration},'{timestamps}',{bytes_literal(video_hash)},{mtime},{skipped})"
+        for fileid, duration, timestamps, video_hash, mtime, skipped in records
+    )
     if CONFIG["dbtype"] == "mysql":
-        query = (
-            f"REPLACE INTO {MDC_TABLES.videos} (fileid,duration,timestamps,hash,mtime,skipped) "
-            f"VALUES({fileid},{duration},'[0]',"
-            f"0x00,{mtime},{skipped_count});"
-        )
+        query = f"REPLACE INTO {MDC_TABLES.videos} (fileid,duration,timestamps,hash,mtime,skipped) VALUES{values};"
     else:
         query = (
             f"INSERT INTO {MDC_TABLES.videos} (fileid,duration,timestamps,hash,mtime,skipped) "
-            f"VALUES({fileid},{duration},'[0]',"
-            f"'\\x00',{mtime},{skipped_count}) "
+            f"VALUES{values} "
             "ON CONFLICT (fileid) DO UPDATE "
             "SET hash = EXCLUDED.hash, "
             "duration = EXCLUDED.duration, "
@@ -3,10 +3,11 @@ FFMPEG/FFPROBE call helper functions.
 """
 
 import json
-import re
 import subprocess
 
 from .log import logger as log
+from .mp4_boxes import mp4_get_video_info
+from .video_frames import spooled_file
 
 FF_DEBUG = 0
 
@@ -45,23 +46,15 @@ def ffprobe_parse_results(proc_result) -> dict:
         return {"duration": 0}
 
 
-def is_moov_at_start(std_log) -> bool:
-    """Returns ``True`` if `moov` header is at start of file."""
-
-    trace_log = std_log.decode("utf-8")
-    moov_match = re.search(r"(type:\s*\'moov\')", trace_log, re.IGNORECASE)
-    mdat_match = re.search(r"(type:\s*\'mdat\')", trace_log, re.IGNORECASE)
-    if (moov_match is None) or (mdat_match is None):
-        return True
-    if moov_match.span()[0] < mdat_match.span()[0]:
-        return True
-    return False
-
-
 def ffprobe_get_video_info(path, data) -> dict:
-    """Returns {} or {duration:X ms}. For data input also returns `fast_start` flag."""
+    """Returns {} or {duration:X ms}. Data is spooled to the file, so ffprobe can seek in it for any container.
+
+    For MP4/MOV duration is read from the header without ffprobe, then `fast_start` flag is also returned."""
 
     if path is not None:
+        video_info = mp4_get_video_info(path)
+        if video_info:
+            return video_info
         result, err = stub_call_ff(
             "ffprobe",
             "-hide_banner",
@@ -74,27 +67,11 @@ def ffprobe_get_video_info(path, data) -> dict:
             path,
         )
     elif data is not None:
-        result, err = stub_call_ff(
-            "ffprobe",
-            "-hide_banner",
-            "-loglevel",
-            "trace",
-            "-print_format",
-            "json",
-            "-show_entries",
-            "format=duration",
-            "-i",
-            "pipe:0",
-            stdin_data=data,
-            ignore_errors=True,
-        )
+        with spooled_file(data) as spooled_path:
+            return ffprobe_get_video_info(spooled_path, None)
     else:
         raise ValueError("`path` or `data` argument must be specified.")
     if err:
         log.warning(err)
         return {}
-    ret = ffprobe_parse_results(result)
-    if path is None:
-        if ret["duration"] != 0:
-            ret["fast_start"] = is_moov_at_start(result.stderr)
-    return ret
+    return ffprobe_parse_results(result)
@@ -0,0 +1,88 @@
+"""
+Enumeration of files in trees of directories without recursion and without a query per directory.
+
+Directories are walked level by level: children of up to `batch_size` directories of the current level are listed
+with one query, paged by fileid. Ignore flags and exclude lists are applied to each page, as `fs_list_directory`
+with `fs_apply_ignore_flags` and `fs_apply_exclude_lists` do for one directory.
+"""
+
+from typing import Callable, Iterator, Optional
+
+from nc_py_api import (
+    FsNodeInfo,
+    fs_apply_exclude_lists,
+    fs_extract_sub_dirs,
+    fs_filter_by,
+    fs_node_info,
+)
+from nc_py_api.files import db_record_to_fs_node, get_mounts_to
+
+from .db_requests import get_directories_list, get_ignored_directories
+
+LIST_PAGE_ROWS = 10000
+
+
+def walk_media_files(
+    directories: list[FsNodeInfo],
+    mimeparts: list[int],
+    exclude_fileid: list[int],
+    exclude_mask: list[str],
+    batch_size: int,
+    position: Optional[dict] = None,
+    on_position: Optional[Callable[[dict], None]] = None,
+) -> Iterator[list[FsNodeInfo]]:
+    """Yields batches of files with `mimeparts` from trees of `directories`.
+
+    Excluded directories are not walked, media files of directories with `.noimage` or `.nomedia` file are skipped.
+    When all files of a chunk of directories were yielded and processed, `on_position` is called with position of
+    the walk, that can be passed later as `position` instead of `directories` to continue the walk from there."""
+
+    batch_size = max(batch_size, 1)
+    level, next_level = directories, []
+    if position is not None:
+        # position keeps ids of directories, that are not walked yet: some of them can be deleted since then.
+        level = get_directories(position["level"], batch_size)
+        next_level = get_directories(position["next_level"], batch_size)
+        if not level:
+            level, next_level = next_level, []
+    while level:
+        for i in range(0, len(level), batch_size):
+            chunk = level[i : i + batch_size]
+            dir_ids = [directory["id"] for directory in chunk]
+            mount_ids = []
+            for directory in chunk:
+                mount_ids += get_mounts_to(directory["storageId"], directory["internal_path"])
+            ignored = set(get_ignored_directories(dir_ids))
+            after_fileid = 0
+            while True:
+                page = get_directories_list(dir_ids, mount_ids, after_fileid, LIST_PAGE_ROWS)
+                if not page:
+                    break
+                after_fileid = page[-1]["fileid"]
+                fs_objs = [db_record_to_fs_node(record) for record in page]
+                fs_apply_exclude_lists(fs_objs, exclude_fileid, exclude_mask)
+                next_level += fs_extract_sub_dirs(fs_objs)
+                fs_filter_by(fs_objs, "mimepart", mimeparts)
+                fs_objs = [fs_obj for fs_obj in fs_objs if fs_obj["parent_id"] not in ignored]
+                if fs_objs:
+                    yield fs_objs
+                if len(page) < LIST_PAGE_ROWS:
+                    break
+            if on_position is not None:
+                on_position(
+                    {
+                        "level": [directory["id"] for directory in level[i + batch_size :]],
+                        "next_level": [directory["id"] for directory in next_level],
+                    }
+                )
+        level, next_level = next_level, []
+
+
+def get_directories(dir_ids: list[int], batch_size: int) -> list[FsNodeInfo]:
+    """Returns existing directories from `dir_ids` in the same order."""
+
+    directories = {}
+    for i in range(0, len(dir_ids), batch_size):
+        for directory in fs_node_info(dir_ids[i : i + batch_size]):
+            directories[directory["id"]] = directory
+    return [directories[i] for i in dir_ids if i in directories]
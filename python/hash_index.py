@@ -0,0 +1,284 @@
+"""
+Packed hashes and indexes of group representatives, used to find the group for a new hash.
+
+Hash is stored as a row of `uint64` words(bits of hash packed by `numpy.packbits` and padded with zeros),
+distance between hashes is a popcount of XOR of their words.
+"""
+
+from itertools import combinations
+from math import comb
+
+import numpy
+
+INDEX_KINDS = ("linear", "multi")
+MAX_SUBSTRING_RADIUS = 2
+MAX_SUBSTRING_BITS = 63
+CANDIDATE_COST = 1  # collecting and checking of candidate costs about the same as lookup in the table
+MATRIX_INITIAL_ROWS = 1024
+MULTI_INDEX_MIN_ROWS = 4096  # for each part of hash, smaller index is searched by linear scan, see `MultiIndex`
+
+if hasattr(numpy, "bitwise_count"):
+
+    def popcount(words: numpy.ndarray) -> numpy.ndarray:
+        """Returns number of set bits in each `uint64` word."""
+
+        return numpy.bitwise_count(words)
+
+else:
+    POPCOUNT_TABLE = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+
+    def popcount(words: numpy.ndarray) -> numpy.ndarray:
+        """Returns number of set bits in each `uint64` word."""
+
+        words = numpy.ascontiguousarray(words)
+        return POPCOUNT_TABLE[words.view(numpy.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=numpy.uint8)
+
+
+def popcount_rows(words: numpy.ndarray) -> numpy.ndarray:
+    """For matrix of `uint64` words returns number of set bits in each row."""
+
+    return popcount(words).sum(axis=1, dtype=numpy.uint32)
+
+
+def hash_words(hash_bits: int) -> int:
+    return max(1, (hash_bits + 63) // 64)
+
+
+def hash_from_bytes(buf: bytes) -> numpy.ndarray:
+    padding = -len(buf) % 8
+    if padding:
+        buf += b"\x00" * padding
+    return numpy.frombuffer(buf, dtype=">u8").astype(numpy.uint64)
+
+
+def hash_from_hex(hash_str: str) -> numpy.ndarray:
+    return hash_from_bytes(bytes.fromhex(hash_str))
+
+
+class HashMatrix:
+    """Growable contiguous matrix of packed hashes, one hash per row."""
+
+    def __init__(self, hash_bits: int):
+        self.hash_bits = hash_bits
+        self.data = numpy.zeros((MATRIX_INITIAL_ROWS, hash_words(hash_bits)), dtype=numpy.uint64)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def rows(self) -> numpy.ndarray:
+        return self.data[: self.count]
+
+    def append(self, packed_hash: numpy.ndarray) -> int:
+        if self.count == self.data.shape[0]:
+            data = numpy.zeros((2 * self.data.shape[0], self.data.shape[1]), dtype=numpy.uint64)
+            data[: self.count] = self.data
+            self.data = data
+        self.data[self.count] = packed_hash
+        self.count += 1
+        return self.count - 1
+
+    def extend(self, packed_hashes: numpy.ndarray) -> None:
+        size = self.data.shape[0]
+        while size < self.count + len(packed_hashes):
+            size *= 2
+        if size != self.data.shape[0]:
+            data = numpy.zeros((size, self.data.shape[1]), dtype=numpy.uint64)
+            data[: self.count] = self.data[: self.count]
+            self.data = data
+        self.data[self.count : self.count + len(packed_hashes)] = packed_hashes
+        self.count += len(packed_hashes)
+
+    def clear(self) -> None:
+        self.data = numpy.zeros((MATRIX_INITIAL_ROWS, self.data.shape[1]), dtype=numpy.uint64)
+        self.count = 0
+
+    def distances(self, packed_hash: numpy.ndarray, rows=None) -> numpy.ndarray:
+        """Returns hamming distances from hash to all hashes in matrix, or only to hashes in `rows`."""
+
+        if rows is None:
+            return popcount_rows(self.rows ^ packed_hash)
+        return popcount_rows(self.data[rows] ^ packed_hash)
+
+
+class LinearIndex:
+    """Compares hash with all representatives at once, returns the first one in order of groups creation."""
+
+    def __init__(self, precision: int, hash_bits: int):
+        self.precision = precision
+        self.hash_bits = hash_bits
+        self.hashes = HashMatrix(hash_bits)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, packed_hash: numpy.ndarray) -> int:
+        """Adds representative of a new group, returns number of that group."""
+
+        return self.hashes.append(packed_hash)
+
+    def extend(self, packed_hashes: numpy.ndarray) -> None:
+        """Adds representatives of new groups in order, as `add` does for each of them."""
+
+        self.hashes.extend(packed_hashes)
+
+    def clear(self) -> None:
+        self.hashes.clear()
+
+    def find(self, packed_hash: numpy.ndarray) -> int:
+        """Returns number of the first group with representative within `precision`, or -1."""
+
+        if not self.hashes.count:
+            return -1
+        matches = numpy.flatnonzero(self.hashes.distances(packed_hash) <= self.precision)
+        return int(matches[0]) if matches.size else -1
+
+    def merge_groups(self, groups: dict[int, list[int]]) -> None:
+        """Called when all hashes are added, can join `groups` in place. Groups found by the first match are final."""
+
+
+class MultiIndex(LinearIndex):
+    """Multi-index hashing: hash is split into `m` substrings, each substring has its own hash table.
+
+    If two hashes differ in no more than `precision` bits, then at least one pair of their substrings differs in
+    no more than `precision // m` bits. So only representatives found in tables by the substrings(and by their
+    variants with up to `precision // m` flipped bits) are compared with the hash. Number of substrings is chosen
+    by the size of index, and tables are rebuilt each time when the number of representatives doubles. Until there
+    are `MULTI_INDEX_MIN_ROWS` representatives for each part, there are no tables: linear scan is faster for them.
+
+    Hash can consist of `parts` of equal length(video hash is four hashes of frames). Then the same applies to
+    parts first: at least one part differs in no more than `precision // parts` bits, and each part is split into
+    substrings separately."""
+
+    def __init__(self, precision: int, hash_bits: int, parts: int = 1):
+        super().__init__(precision, hash_bits)
+        self.parts = parts
+        self.starts = numpy.zeros(1, dtype=numpy.intp)  # first bit of each substring
+        self.weights = numpy.zeros(hash_bits, dtype=numpy.uint64)  # value of each bit inside its substring
+        self.flip_masks: list[list[int]] = []
+        self.tables: list[dict[int, list[int]]] = []
+        self.min_rows = MULTI_INDEX_MIN_ROWS * parts
+        self._rebuild_at = self.min_rows
+
+    def add(self, packed_hash: numpy.ndarray) -> int:
+        group_number = super().add(packed_hash)
+        if len(self.hashes) >= self._rebuild_at:
+            self._rebuild(2 * self._rebuild_at)
+        elif self.tables:
+            self._insert(group_number, self.substring_keys(packed_hash[None, :])[0])
+        return group_number
+
+    def extend(self, packed_hashes: numpy.ndarray) -> None:
+        start = len(self.hashes)
+        super().extend(packed_hashes)
+        if len(self.hashes) >= self._rebuild_at:
+            expected_size = self._rebuild_at
+            while len(self.hashes) >= expected_size:
+                expected_size *= 2
+            self._rebuild(expected_size)
+            return
+        if not self.tables:
+            return
+        for group_number, keys in enumerate(self.substring_keys(self.hashes.rows[start:]), start=start):
+            self._insert(group_number, keys)
+
+    def clear(self) -> None:
+        super().clear()
+        self.tables = []
+        self._rebuild_at = self.min_rows
+
+    def find(self, packed_hash: numpy.ndarray) -> int:
+        if not self.tables:
+            return super().find(packed_hash)
+        candidates = self.candidates(self.substring_keys(packed_hash[None, :])[0])
+        if not candidates:
+            return -1
+        rows = numpy.array(candidates, dtype=numpy.intp)
+        matches = numpy.flatnonzero(self.hashes.distances(packed_hash, rows) <= self.precision)
+        return int(rows[matches[0]]) if matches.size else -1
+
+    def substring_keys(self, packed_hashes: numpy.ndarray) -> list[list[int]]:
+        """For each of packed hashes returns values of its substrings."""
+
+        bits = numpy.unpackbits(packed_hashes.astype(">u8").view(numpy.uint8), axis=1)[:, : self.hash_bits]
+        return numpy.add.reduceat(bits * self.weights, self.starts, axis=1).tolist()
+
+    def candidates(self, keys: list[int]) -> list[int]:
+        """Returns sorted numbers of groups which representatives have at least one close substring."""
+
+        found: set[int] = set()
+        if len(self.flip_masks[0]) == 1:
+            found.update(*filter(None, map(dict.get, self.tables, keys)))
+        else:
+            for key, flip_masks, table in zip(keys, self.flip_masks, self.tables):
+                found.update(*filter(None, map(table.get, [key ^ flip_mask for flip_mask in flip_masks])))
+        return sorted(found)
+
+    def _insert(self, group_number: int, keys: list[int]) -> None:
+        for key, table in zip(keys, self.tables):
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [group_number]
+            else:
+                bucket.append(group_number)
+
+    def _rebuild(self, expected_size: int) -> None:
+        part_bits, part_precision = self.hash_bits // self.parts, self.precision // self.parts
+        radius = choose_substring_radius(part_precision, part_bits, expected_size)
+        count = max(part_precision // (radius + 1) + 1, -(-part_bits // MAX_SUBSTRING_BITS))
+        lengths = split_to_substrings(part_bits, count) * self.parts
+        self.starts = numpy.cumsum([0] + lengths[:-1], dtype=numpy.intp)
+        self.weights = numpy.concatenate(
+            [numpy.left_shift(numpy.uint64(1), numpy.arange(i - 1, -1, -1, dtype=numpy.uint64)) for i in lengths]
+        )
+        self.flip_masks = [bit_flip_masks(i, radius) for i in lengths]
+        self.tables = [{} for _ in lengths]
+        for chunk_start in range(0, len(self.hashes), MATRIX_INITIAL_ROWS):
+            chunk = self.hashes.rows[chunk_start : chunk_start + MATRIX_INITIAL_ROWS]
+            for group_number, keys in enumerate(self.substring_keys(chunk), start=chunk_start):
+                self._insert(group_number, keys)
+        self._rebuild_at = expected_size
+
+
+def split_to_substrings(hash_bits: int, count: int) -> list[int]:
+    """Splits `hash_bits` into `count` substrings of almost equal length. Returns lengths of substrings."""
+
+    count = max(1, min(count, hash_bits))
+    return [hash_bits // count + (1 if i < hash_bits % count else 0) for i in range(count)]
+
+
+def bit_flip_masks(length: int, radius: int) -> list[int]:
+    """Returns all masks of `length` bits with no more than `radius` bits set. Zero mask goes first."""
+
+    masks = []
+    for n_bits in range(radius + 1):
+        for bits in combinations(range(length), n_bits):
+            masks.append(sum(1 << bit for bit in bits))
+    return masks
+
+
+def choose_substring_radius(precision: int, hash_bits: int, expected_size: int) -> int:
+    """Estimates cost of lookups in tables plus cost of candidates checks, returns radius with the lowest cost."""
+
+    best_radius, best_cost = 0, -1.0
+    for radius in range(MAX_SUBSTRING_RADIUS + 1):
+        count = precision // (radius + 1) + 1
+        if count > hash_bits:
+            continue
+        length = hash_bits // count
+        variants = sum(comb(length, i) for i in range(radius + 1))
+        cost = count * variants * (1 + CANDIDATE_COST * expected_size / 2**length)
+        if best_cost < 0 or cost < best_cost:
+            best_radius, best_cost = radius, cost
+    return best_radius
+
+
+def create_index(kind: str, precision: int, hash_bits: int, parts: int = 1) -> LinearIndex:
+    """Returns index of `kind`. `parts` is a number of equal parts in hash, used by `multi` index."""
+
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind: `{kind}`. Supported: {INDEX_KINDS}")
+    if kind == "linear" or (precision // parts) // (MAX_SUBSTRING_RADIUS + 1) >= hash_bits // parts:
+        return LinearIndex(precision, hash_bits)
+    return MultiIndex(precision, hash_bits, parts)
@@ -0,0 +1,86 @@
+"""
+Loading of hashes cache records for batches of files.
+
+Records are loaded by fileid, with `IN` lists of no more than `batch_size` items, and are valid only if `mtime` of
+record is the same as of file. Long-running process keeps records with hashes in memory between tasks, so files of
+the next tasks are not loaded from DB again.
+"""
+
+from typing import Callable, Optional
+
+from nc_py_api import FsNodeInfo, fs_sort_by_id
+
+
+class RecordsMemory:
+    """Keeps up to `size` records with hashes, the least recently used are dropped first.
+
+    Records are valid only for the same `key`(settings of hashing), with another key memory is cleared."""
+
+    def __init__(self, size: int = 0):
+        self.size = size
+        self.key = None
+        self.records: dict[int, dict] = {}
+
+    def setup(self, size: int, key) -> None:
+        if key != self.key:
+            self.records.clear()
+            self.key = key
+        self.size = size
+        while len(self.records) > self.size:
+            del self.records[next(iter(self.records))]
+
+    def get(self, fileid: int) -> Optional[dict]:
+        record = self.records.pop(fileid, None)
+        if record is not None:
+            self.records[fileid] = record
+        return record
+
+    def put(self, fileid: int, record: dict) -> None:
+        if self.size <= 0:
+            return
+        self.records.pop(fileid, None)
+        self.records[fileid] = record
+        if len(self.records) > self.size:
+            del self.records[next(iter(self.records))]
+
+
+class HashesCache:
+    """Adds `fields` of the cache to files, for files without valid cache they are set to None."""
+
+    def __init__(
+        self,
+        get_by_fileids: Callable[[list[int]], list],
+        fields: tuple[str, ...],
+        batch_size: int = 1,
+        memory: Optional[RecordsMemory] = None,
+    ):
+        self.get_by_fileids = get_by_fileids
+        self.fields = fields
+        self.batch_size = max(batch_size, 1)
+        self.memory = memory if memory is not None else RecordsMemory()
+
+    def load(self, fs_objs: list[FsNodeInfo]) -> list[dict]:
+        """Returns `fs_objs` sorted by id, with fields of the cache."""
+
+        fs_objs = fs_sort_by_id(fs_objs)
+        records = {}
+        to_load = []
+        for fs_obj in fs_objs:
+            record = self.memory.get(fs_obj["id"])
+            if record is not None and record["mtime"] == fs_obj["mtime"]:
+                records[fs_obj["id"]] = record
+            else:
+                to_load.append(fs_obj["id"])
+        for i in range(0, len(to_load), self.batch_size):
+            for record in self.get_by_fileids(to_load[i : i + self.batch_size]):
+                records[record["fileid"]] = record
+                # records of files, that were not hashed, change on the next try.
+                if record["skipped"] == 0 and record["hash"] is not None:
+                    self.memory.put(record["fileid"], record)
+        result = []
+        for fs_obj in fs_objs:
+            record = records.get(fs_obj["id"])
+            if record is None or record["mtime"] != fs_obj["mtime"]:
+                record = {}
+            result.append(fs_obj | {i: record.get(i) for i in self.fields})
+        return result
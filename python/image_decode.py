@@ -0,0 +1,57 @@
+"""
+Decoding of images with the lowest resolution, that is enough for hash algorithms.
+
+Input of `whash` is the natural scale of image: the biggest power of 2, that is not bigger than its smaller side.
+It is more than a half of the smaller side, so images for `whash` are decoded at full resolution.
+"""
+
+import numpy
+from PIL import ImageOps
+
+DECODE_MARGIN = 8  # hash algorithms resize with antialiasing, it needs a few source pixels per output pixel
+
+
+def hash_input_size(algo: str, hash_size: int, image_size: tuple[int, int]) -> int:
+    """Returns size of the square image, to which hash algorithm resizes the image of `image_size`. For `whash`
+    it depends on `image_size` and is too big for decoding with reduced resolution."""
+
+    if algo == "phash":
+        return hash_size * 4
+    if algo == "dhash":
+        return hash_size + 1
+    if algo == "whash":
+        return max(2 ** int(numpy.log2(min(image_size))), hash_size)
+    return hash_size
+
+
+def heif_thumbnail(pil_image, min_size: int):
+    """Returns the smallest thumbnail of HEIF image, where both sides are not less than `min_size`, or None.
+    `pi_heif` is imported here, as it is already loaded by the opener of HEIF images."""
+
+    try:
+        from pi_heif import thumbnail  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    thumbnail_image = thumbnail(pil_image, min_size * max(pil_image.size) // max(1, min(pil_image.size)))
+    return thumbnail_image if min(thumbnail_image.size) >= min_size else None
+
+
+def reduce_image(pil_image, hash_input: int):
+    """Decodes not loaded image with the smallest size, where both sides are not less than `hash_input` multiplied
+    by `DECODE_MARGIN`.
+
+    JPEG is decoded with DCT scaling, for HEIF the smallest suitable thumbnail is used, if there is one.
+    Other images are decoded fully and then reduced by integer factor, which is cheaper than the resize."""
+
+    min_size = hash_input * DECODE_MARGIN
+    if pil_image.format == "JPEG":
+        pil_image.draft("L", (min_size, min_size))
+        return pil_image
+    if pil_image.format in ("HEIF", "AVIF"):
+        thumbnail = heif_thumbnail(pil_image, min_size)
+        if thumbnail is not None:
+            return thumbnail
+    factor = min(pil_image.size) // min_size
+    if factor >= 2:
+        pil_image = ImageOps.exif_transpose(pil_image).reduce(factor)
+    return pil_image
@@ -1,8 +1,8 @@
 import numpy
-import pywt
-import scipy.fftpack
 from PIL import Image
 
+# scipy.fftpack and pywt are imported by phash and whash, so other algorithms do not load them.
+
 __version__ = "4.2.1"
 
 """
@@ -39,11 +39,21 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+def gray_pixels(image, size):
+    """Converts PIL image to grayscale and resizes it to `size`(width, height), returns array of pixels.
+    Image can also be an array of grayscale pixels, that already has this size."""
+
+    if isinstance(image, numpy.ndarray):
+        if image.shape != (size[1], size[0]):
+            raise ValueError(f"Expected array of grayscale pixels with shape {(size[1], size[0])}, got {image.shape}")
+        return image
+    return numpy.asarray(image.convert("L").resize(size, Image.LANCZOS))
+
+
 def average_hash(image, hash_size=8, mean=numpy.mean):
     # reduce size and complexity, then covert to grayscale
-    image = image.convert("L").resize((hash_size, hash_size), Image.ANTIALIAS)
+    pixels = gray_pixels(image, (hash_size, hash_size))
     # find average pixel value; 'pixels' is an array of the pixel values, ranging from 0 (black) to 255 (white)
-    pixels = numpy.asarray(image)
     avg = mean(pixels)
     diff = pixels > avg
     return diff
@@ -51,8 +61,9 @@ def average_hash(image, hash_size=8, mean=numpy.mean):
 
 def phash(image, hash_size=8, highfreq_factor=4):
     img_size = hash_size * highfreq_factor
-    image = image.convert("L").resize((img_size, img_size), Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = gray_pixels(image, (img_size, img_size))
+    import scipy.fftpack  # pylint: disable=import-outside-toplevel
+
     dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
     dctlowfreq = dct[:hash_size, :hash_size]
     med = numpy.median(dctlowfreq)
@@ -62,8 +73,9 @@ def phash(image, hash_size=8, highfreq_factor=4):
 
 def phash_simple(image, hash_size=8, highfreq_factor=4):
     img_size = hash_size * highfreq_factor
-    image = image.convert("L").resize((img_size, img_size), Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = gray_pixels(image, (img_size, img_size))
+    import scipy.fftpack  # pylint: disable=import-outside-toplevel
+
     dct = scipy.fftpack.dct(pixels)
     dctlowfreq = dct[:hash_size, 1 : hash_size + 1]
     avg = dctlowfreq.mean()
@@ -72,16 +84,14 @@ def phash_simple(image, hash_size=8, highfreq_factor=4):
 
 
 def dhash(image, hash_size=8):
-    image = image.convert("L").resize((hash_size + 1, hash_size), Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = gray_pixels(image, (hash_size + 1, hash_size))
     # compute differences between columns
     diff = pixels[:, 1:] > pixels[:, :-1]
     return diff
 
 
 def dhash_vertical(image, hash_size=8):
-    image = image.convert("L").resize((hash_size, hash_size + 1), Image.ANTIALIAS)
-    pixels = numpy.asarray(image)
+    pixels = gray_pixels(image, (hash_size, hash_size + 1))
     # compute differences between rows
     diff = pixels[1:, :] > pixels[:-1, :]
     return diff
@@ -91,7 +101,8 @@ def whash(image, hash_size=8, image_scale=None, mode="haar", remove_max_haar_ll=
     if image_scale is not None:
         assert image_scale & (image_scale - 1) == 0, "image_scale is not power of 2"
     else:
-        image_natural_scale = 2 ** int(numpy.log2(min(image.size)))
+        image_size = image.shape if isinstance(image, numpy.ndarray) else image.size
+        image_natural_scale = 2 ** int(numpy.log2(min(image_size)))
         image_scale = max(image_natural_scale, hash_size)
 
     ll_max_level = int(numpy.log2(image_scale))
@@ -101,8 +112,9 @@ def whash(image, hash_size=8, image_scale=None, mode="haar", remove_max_haar_ll=
     assert level <= ll_max_level, "hash_size in a wrong range"
     dwt_level = ll_max_level - level
 
-    image = image.convert("L").resize((image_scale, image_scale), Image.ANTIALIAS)
-    pixels = numpy.asarray(image) / 255.0
+    import pywt  # pylint: disable=import-outside-toplevel
+
+    pixels = gray_pixels(image, (image_scale, image_scale)) / 255.0
 
     # Remove low level frequency LL(max_ll) if @remove_max_haar_ll using haar filter
     if remove_max_haar_ll:
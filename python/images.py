@@ -2,43 +2,79 @@
 Images processing functions.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from io import BytesIO
-from typing import Any, Optional, Union
+from multiprocessing import get_context
+from typing import Iterator, Optional, Union, cast
 
 import numpy
-from nc_py_api import FsNodeInfo, fs_file_data, fs_sort_by_id
-from pi_heif import register_heif_opener
+from nc_py_api import FsNodeInfo, fs_file_data
 from PIL import Image, ImageOps
 
-from .db_requests import (
-    get_images_caches,
-    store_err_image_hash,
-    store_image_hash,
-    store_task_files_group,
-)
+from .clustering import FilesGroups, create_grouping_index
+from .db_buffer import WriteBuffer
+from .db_requests import get_images_caches, store_images_hashes
+from .hash_index import hash_from_bytes, hash_from_hex
+from .hashes_cache import HashesCache, RecordsMemory
+from .image_decode import hash_input_size, reduce_image
 from .imagehash import average_hash, dhash, phash, whash
 from .log import logger as log
 
-try:
-    from hexhamming import check_hexstrings_within_dist
-except ImportError:
-    check_hexstrings_within_dist = None
-
 
 class MdcImageInfo(FsNodeInfo):
-    hash: Optional[Union[bytes, str]]
+    hash: Optional[Union[bytes, numpy.ndarray]]
     skipped: Optional[int]
 
 
-register_heif_opener()
-
-ImagesGroups: dict[int, list[int]] = {}
-SetOfGroups: list[Any] = []  # [flat_numpy_array1,flat_numpy_array2,flat_numpy_array3]
+HeifRegistered = False
+
+HashingPool: Optional[ProcessPoolExecutor] = None
+HashesBuffer = WriteBuffer(store_images_hashes)  # new records of hashes cache
+HashesCaches = HashesCache(get_images_caches, ("hash", "skipped"))
+HashesMemory = RecordsMemory()  # records of hashes cache, that are kept between tasks
+
+
+def init_images(settings: dict):
+    """Prepares processing of images, groups of task are created as `images_groups` of `settings`."""
+
+    global HashingPool, HashesBuffer, HashesCaches  # pylint: disable=global-statement
+    settings["images_groups"] = FilesGroups(
+        create_grouping_index(
+            settings["grouping_mode"],
+            settings["hash_index"],
+            settings["precision_img"],
+            settings["hash_size"] ** 2,
+            workers=settings["workers"],
+        )
+    )
+    HashesBuffer = WriteBuffer(store_images_hashes, settings["db_batch"], settings["db_delay"])
+    HashesMemory.setup(settings["hashes_memory"], (settings["hash_algo"], settings["hash_size"]))
+    HashesCaches = HashesCache(
+        partial(get_images_caches, lookup=settings["cache_lookup"]),
+        ("hash", "skipped"),
+        settings["db_batch"],
+        HashesMemory,
+    )
+    close_hashing_pool()
+    if settings["workers"] > 1:
+        # workers are forked: they inherit state of `nc_py_api` and only read and hash files, without DB access.
+        HashingPool = ProcessPoolExecutor(max_workers=settings["workers"], mp_context=get_context("fork"))
+        # pool forks workers on the first task, it is done now, before threads of videos open pipes to ffmpeg:
+        # forked workers would keep write ends of pipes, and readers of ffmpeg outputs would wait for their exit.
+        HashingPool.submit(int).result()
+
+
+def close_hashing_pool():
+    global HashingPool  # pylint: disable=global-statement
+    if HashingPool is not None:
+        HashingPool.shutdown(cancel_futures=True)
+        HashingPool = None
 
 
 def process_images(settings: dict, fs_objs: list[FsNodeInfo]):
-    mdc_images_info = load_images_caches(fs_objs)
-    for mdc_image_info in mdc_images_info:
+    mdc_images_info: list[MdcImageInfo] = []
+    for mdc_image_info in cast(list[MdcImageInfo], HashesCaches.load(fs_objs)):
         if mdc_image_info["skipped"] is not None:
             if mdc_image_info["skipped"] >= 2:
                 continue
@@ -46,39 +82,52 @@ def process_images(settings: dict, fs_objs: list[FsNodeInfo]):
                 mdc_image_info["hash"] = None
         else:
             mdc_image_info["skipped"] = 0
-        if mdc_image_info["hash"] is None:
-            log.debug("calculating hash for image: fileid = %u", mdc_image_info["id"])
-            mdc_image_info["hash"] = process_hash(
-                settings["hash_algo"],
-                settings["hash_size"],
-                mdc_image_info,
-            )
-        else:
-            if check_hexstrings_within_dist:
-                mdc_image_info["hash"] = mdc_image_info["hash"].hex()
+        mdc_images_info.append(mdc_image_info)
+    to_hash = [i for i in mdc_images_info if i["hash"] is None]
+    hashes: Iterator[Optional[str]]
+    if HashingPool is None or len(to_hash) < 2:
+        hashes = (hash_image_file(settings["hash_algo"], settings["hash_size"], i) for i in to_hash)
+    else:
+        hashes = HashingPool.map(
+            hash_image_file, [settings["hash_algo"]] * len(to_hash), [settings["hash_size"]] * len(to_hash), to_hash
+        )
+    # results are taken in order of files, so groups are the same as with serial hashing.
+    try:
+        for mdc_image_info in mdc_images_info:
+            if mdc_image_info["hash"] is None:
+                mdc_image_info["hash"] = store_hash_result(mdc_image_info, next(hashes))
             else:
-                mdc_image_info["hash"] = arr_hash_from_bytes(mdc_image_info["hash"])
-        if mdc_image_info["hash"] is not None:
-            process_image_record(settings["precision_img"], mdc_image_info)
+                mdc_image_info["hash"] = hash_from_bytes(mdc_image_info["hash"])
+            if mdc_image_info["hash"] is not None:
+                settings["images_groups"].add(mdc_image_info["id"], mdc_image_info["hash"])
+    finally:
+        HashesBuffer.flush()
+
 
+def hash_image_file(algo: str, hash_size: int, mdc_img_info: MdcImageInfo) -> Optional[str]:
+    """Reads and hashes image, can be run in worker process. Returns hash as hex string, empty string if image
+    can not be hashed or None if file can not be read."""
 
-def process_hash(algo: str, hash_size: int, mdc_img_info: MdcImageInfo):
+    log.debug("calculating hash for image: fileid = %u", mdc_img_info["id"])
     data = fs_file_data(mdc_img_info)
     if not data:
         return None
     hash_of_image = calc_hash(algo, hash_size, data)
     if hash_of_image is None:
-        store_err_image_hash(mdc_img_info["id"], mdc_img_info["mtime"], mdc_img_info["skipped"] + 1)
-        return None
-    hash_str = arr_hash_to_string(hash_of_image)
-    store_image_hash(mdc_img_info["id"], hash_str, mdc_img_info["mtime"])
-    if check_hexstrings_within_dist:
-        return hash_str
-    return hash_of_image
+        return ""
+    return arr_hash_to_string(hash_of_image)
 
 
-def arr_hash_from_bytes(buf: bytes):
-    return numpy.unpackbits(numpy.frombuffer(buf, dtype=numpy.uint8), axis=None)
+def store_hash_result(mdc_img_info: MdcImageInfo, hash_str: Optional[str]):
+    if hash_str is None:
+        return None
+    if not hash_str:
+        HashesBuffer.add(
+            mdc_img_info["id"], (mdc_img_info["id"], "00", mdc_img_info["mtime"], mdc_img_info["skipped"] + 1)
+        )
+        return None
+    HashesBuffer.add(mdc_img_info["id"], (mdc_img_info["id"], hash_str, mdc_img_info["mtime"], 0))
+    return hash_from_hex(hash_str)
 
 
 def arr_hash_to_string(arr) -> str:
@@ -92,74 +141,74 @@ def calc_hash(algo: str, hash_size: int, image_data: bytes):
     return image_hash.flatten()
 
 
-def process_image_record(precision: int, mdc_img_info: MdcImageInfo):
-    img_group_number = len(ImagesGroups)
-    if check_hexstrings_within_dist:
-        for i in range(img_group_number):
-            if check_hexstrings_within_dist(SetOfGroups[i], mdc_img_info["hash"], precision):
-                ImagesGroups[i].append(mdc_img_info["id"])
-                return
+def calc_pixels_hash(algo: str, hash_size: int, pixels: numpy.ndarray):
+    """Accepts array of RGB pixels of any size, or of grayscale pixels with the size of `algo` input."""
+
+    if pixels.ndim == 3:
+        pil_image = Image.fromarray(pixels)
+        image_scale = hash_input_size(algo, hash_size, pil_image.size)
+        pil_image = reduce_image(pil_image, image_scale)
+        image_hash = image_to_hash(algo, hash_size, pil_image, image_scale if algo == "whash" else None)
     else:
-        for i in range(img_group_number):
-            if numpy.count_nonzero(SetOfGroups[i] != mdc_img_info["hash"]) <= precision:
-                ImagesGroups[i].append(mdc_img_info["id"])
-                return
-    SetOfGroups.append(mdc_img_info["hash"])
-    ImagesGroups[img_group_number] = [mdc_img_info["id"]]
+        image_hash = image_to_hash(algo, hash_size, pixels)
+    if image_hash is None:
+        return None
+    return image_hash.flatten()
 
 
 def reset_images():
-    ImagesGroups.clear()
-    SetOfGroups.clear()
+    close_hashing_pool()
+    HashesBuffer.clear()
+
 
+def get_image_results(settings: dict) -> list[list[int]]:
+    """Finishes processing of images, returns files of groups with similar images."""
 
-def remove_solo_groups():
-    groups_to_remove = []
-    for group_key, files_id in ImagesGroups.items():
-        if len(files_id) == 1:
-            groups_to_remove.append(group_key)
-    for key in groups_to_remove:
-        del ImagesGroups[key]
+    close_hashing_pool()
+    HashesBuffer.flush()
+    groups = settings["images_groups"].get_results()
+    log.debug("Images: Number of groups: %u", len(groups))
+    return groups
 
 
-def save_image_results(task_id: int) -> int:
-    remove_solo_groups()
-    log.debug("Images: Number of groups: %u", len(ImagesGroups))
-    n_group = 1
-    for files_id in ImagesGroups.values():
-        for file_id in files_id:
-            store_task_files_group(task_id, n_group, file_id)
-        n_group += 1
-    return n_group
+def pil_to_hash(algo: str, hash_size: int, pil_image, image_scale=None):
+    return image_to_hash(algo, hash_size, ImageOps.exif_transpose(pil_image), image_scale)
 
 
-def pil_to_hash(algo: str, hash_size: int, pil_image):
-    pil_image = ImageOps.exif_transpose(pil_image)
+def image_to_hash(algo: str, hash_size: int, image, image_scale=None):
+    """Accepts PIL image or array of grayscale pixels, that already has the size of `algo` input."""
+
     if algo == "phash":
-        image_hash = phash(pil_image, hash_size=hash_size)
+        image_hash = phash(image, hash_size=hash_size)
     elif algo == "dhash":
-        image_hash = dhash(pil_image, hash_size=hash_size)
+        image_hash = dhash(image, hash_size=hash_size)
     elif algo == "whash":
-        image_hash = whash(pil_image, hash_size=hash_size)
+        image_hash = whash(image, hash_size=hash_size, image_scale=image_scale)
     elif algo == "average":
-        image_hash = average_hash(pil_image, hash_size=hash_size)
+        image_hash = average_hash(image, hash_size=hash_size)
     else:
         image_hash = None
     return image_hash
 
 
+def register_heif() -> None:
+    """Registers HEIF opener in PIL, on the first use, as `pi_heif` takes time to load."""
+
+    global HeifRegistered  # pylint: disable=global-statement
+    if not HeifRegistered:
+        import pi_heif  # pylint: disable=import-outside-toplevel
+
+        pi_heif.register_heif_opener()
+        HeifRegistered = True
+
+
 def hash_image_data(algo: str, hash_size: int, image_data: bytes):
+    register_heif()
     try:
         pil_image = Image.open(BytesIO(image_data))
-        return pil_to_hash(algo, hash_size, pil_image)
+        image_scale = hash_input_size(algo, hash_size, pil_image.size)
+        pil_image = reduce_image(pil_image, image_scale)
+        return pil_to_hash(algo, hash_size, pil_image, image_scale if algo == "whash" else None)
     except Exception as exception_info:  # noqa # pylint: disable=broad-except
         log.debug("Exception during image processing:\n%s", str(exception_info))
         return None
-
-
-def load_images_caches(images: list[FsNodeInfo]) -> list[MdcImageInfo]:
-    if not images:
-        return []
-    images = fs_sort_by_id(images)
-    cache_records = get_images_caches([image["id"] for image in images])
-    return [images[i] | cache_records[i] for i in range(len(images))]
@@ -0,0 +1,89 @@
+"""
+Reading of duration from MP4/MOV(ISO base media file format) header without ffprobe.
+
+Only headers of top-level boxes are read, others are skipped with seek, so `moov` at the end of file costs the same
+as at the start. Duration is taken from `mvhd` box inside `moov`.
+"""
+
+from typing import Optional
+
+MP4_TOP_LEVEL_BOXES = (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot", b"uuid", b"meta")
+MAX_TOP_LEVEL_BOXES = 64
+
+
+def read_box_header(file, end: int) -> Optional[tuple[bytes, int, int]]:
+    """Reads header of the box at the current position. Returns type, offset of data and offset of the next box."""
+
+    start = file.tell()
+    header = file.read(8)
+    if len(header) < 8:
+        return None
+    size, box_type = int.from_bytes(header[:4], "big"), header[4:]
+    if size == 1:
+        large_size = file.read(8)
+        if len(large_size) < 8:
+            return None
+        size = int.from_bytes(large_size, "big")
+    elif size == 0:  # the last box, up to the end of file
+        size = end - start
+    if size < file.tell() - start or start + size > end:
+        return None
+    return box_type, file.tell(), start + size
+
+
+def parse_mvhd(data: bytes) -> Optional[int]:
+    """From content of `mvhd` box returns duration in ms, or None if it is unknown."""
+
+    if data[:1] == b"\x01":
+        if len(data) < 32:
+            return None
+        time_scale, duration = int.from_bytes(data[20:24], "big"), int.from_bytes(data[24:32], "big")
+        unknown_duration = 2**64 - 1
+    else:
+        if len(data) < 20:
+            return None
+        time_scale, duration = int.from_bytes(data[12:16], "big"), int.from_bytes(data[16:20], "big")
+        unknown_duration = 2**32 - 1
+    if not time_scale or not duration or duration == unknown_duration:
+        return None
+    return duration * 1000 // time_scale
+
+
+def mp4_get_video_info(path) -> dict:
+    """For MP4/MOV returns {duration:X ms, fast_start: `moov` is before `mdat`}. For other containers, fragmented
+    MP4(duration is in fragments) or damaged header returns {}. Accepts path(bytes/str)."""
+
+    try:
+        with open(path, "rb") as file:
+            end = file.seek(0, 2)
+            file.seek(0)
+            mdat_found = False
+            for box_number in range(MAX_TOP_LEVEL_BOXES):
+                box = read_box_header(file, end)
+                if box is None or (box_number == 0 and box[0] not in MP4_TOP_LEVEL_BOXES):
+                    return {}
+                if box[0] == b"mdat":
+                    mdat_found = True
+                elif box[0] == b"moov":
+                    duration = read_moov_duration(file, box[2])
+                    return {} if duration is None else {"duration": duration, "fast_start": not mdat_found}
+                if box[2] >= end:
+                    break
+                file.seek(box[2])
+    except OSError:
+        pass
+    return {}
+
+
+def read_moov_duration(file, moov_end: int) -> Optional[int]:
+    """Reads children of `moov` box from the current position, returns duration from `mvhd`."""
+
+    duration = None
+    while file.tell() < moov_end:
+        child = read_box_header(file, moov_end)
+        if child is None or child[0] == b"mvex":
+            return None
+        if child[0] == b"mvhd":
+            duration = parse_mvhd(file.read(min(child[2] - child[1], 32)))
+        file.seek(child[2])
+    return duration
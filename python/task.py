@@ -1,17 +1,17 @@
 import math
 import threading
 from enum import Enum
+from functools import lru_cache
+from os import cpu_count, environ, path
+from tempfile import gettempdir
 from time import perf_counter, sleep
+from typing import Optional
 
+import numpy
 from nc_py_api import (
     CONFIG,
-    FsNodeInfo,
     close_connection,
     fs_apply_exclude_lists,
-    fs_apply_ignore_flags,
-    fs_extract_sub_dirs,
-    fs_filter_by,
-    fs_list_directory,
     fs_node_info,
     get_mimetype_id,
     get_time,
@@ -20,19 +20,54 @@ from nc_py_api import (
 )
 
 from .db_requests import (
+    CACHE_LOOKUPS,
     append_task_error,
+    clear_task_files_scanned,
     clear_task_files_scanned_groups,
+    delete_task_files_groups,
     finalize_task,
+    get_task_files_groups,
+    get_tasks,
     increase_processed_files_count,
     lock_task,
     set_task_keepalive,
+    store_task_files_groups,
     unlock_task,
 )
-from .images import process_images, reset_images, save_image_results
+from .fs_walk import walk_media_files
+from .images import get_image_results, init_images, process_images, reset_images
 from .log import logger as log
-from .videos import process_videos, reset_videos, save_video_results
+from .task_checkpoint import TaskCheckpoint, checkpoint_path, remove_stale_checkpoints
+from .task_delta import TaskDelta
+from .videos import (
+    get_video_results,
+    hash_videos,
+    init_videos,
+    process_videos,
+    reset_videos,
+    store_videos,
+)
 
 TASK_KEEP_ALIVE = 8
+StopRequest = threading.Event()  # set on signal, task is interrupted at the next checkpoint
+CHECKPOINT_SETTINGS = (  # settings, that must be the same to continue task from checkpoint
+    "type",
+    "target_dirs",
+    "exclude_fileid",
+    "exclude_mask",
+    "hash_size",
+    "hash_algo",
+    "precision_img",
+    "hash_index",
+    "grouping_mode",
+    "video_frames",
+    "video_seek",
+    "video_decoder",
+)
+
+
+class TaskInterrupted(Exception):
+    """Task was stopped by `StopRequest` after checkpoint, it continues from it as hanged task."""
 
 
 class TaskType(Enum):
@@ -46,15 +81,13 @@ class TaskType(Enum):
 def init_task_settings(task_info: dict) -> dict:
     """Prepares task for execution, returns a dictionary to pass to process_(image/video)_task functions."""
 
-    if task_info["files_scanned"] > 0:
-        clear_task_files_scanned_groups(task_info["id"])
     task_settings = {"id": task_info["id"], "data_dir": CONFIG["datadir"]}
     excl_all = task_info["exclude_list"]
     task_settings["exclude_mask"] = list(dict.fromkeys(excl_all["user"]["mask"] + excl_all["admin"]["mask"]))
     task_settings["exclude_fileid"] = list(dict.fromkeys(excl_all["user"]["fileid"] + excl_all["admin"]["fileid"]))
-    task_settings["mime_dir"] = get_mimetype_id("httpd/unix-directory")
-    task_settings["mime_image"] = get_mimetype_id("image")
-    task_settings["mime_video"] = get_mimetype_id("video")
+    task_settings["mime_dir"] = get_mimetype_id_cached("httpd/unix-directory")
+    task_settings["mime_image"] = get_mimetype_id_cached("image")
+    task_settings["mime_video"] = get_mimetype_id_cached("video")
     collector_settings = task_info["collector_settings"]
     task_settings["hash_size"] = collector_settings["hash_size"]
     task_settings["hash_algo"] = collector_settings["hashing_algorithm"]
@@ -76,12 +109,106 @@ def init_task_settings(task_info: dict) -> dict:
     log.debug("Image hamming distance: %u", task_settings["precision_img"])
     log.debug("Video hamming distance between 4 frames: %u", task_settings["precision_vid"])
     log.debug("Hashing algo: %s", task_settings["hash_algo"])
+    task_settings["hash_index"] = collector_settings.get("hash_index", "multi")
+    task_settings["grouping_mode"] = collector_settings.get("grouping_mode", "first_match")
+    log.debug("Grouping mode: %s", task_settings["grouping_mode"])
+    task_settings["video_frames"] = collector_settings.get("video_frames", "bmp")
+    task_settings["video_seek"] = collector_settings.get("video_seek", "accurate")
+    task_settings["video_decoder"] = environ.get("MDC_VIDEO_DECODER", "subprocess")
+    log.debug(
+        "Video frames: %s, seek: %s, decoder: %s",
+        task_settings["video_frames"],
+        task_settings["video_seek"],
+        task_settings["video_decoder"],
+    )
+    task_settings["workers"] = int(environ.get("MDC_WORKERS", "1")) or cpu_count() or 1
+    log.debug("Number of workers: %u", task_settings["workers"])
+    task_settings["videos_memory"] = int(environ.get("MDC_VIDEOS_MEMORY", "1024")) * 1024 * 1024
+    task_settings["db_batch"] = int(environ.get("MDC_DB_BATCH", "1000"))  # records in one INSERT query
+    task_settings["db_delay"] = float(environ.get("MDC_DB_DELAY", "10"))  # seconds, that new hashes can wait for write
+    # records of hashes cache, kept between tasks of the process: about 0.5KB for image, 1KB for video.
+    task_settings["hashes_memory"] = int(environ.get("MDC_HASHES_MEMORY", "100000"))
+    task_settings["cache_lookup"] = environ.get("MDC_CACHE_LOOKUP", "fileid")
+    if task_settings["cache_lookup"] not in CACHE_LOOKUPS:
+        raise ValueError(
+            f"Unknown lookup of hashes cache: `{task_settings['cache_lookup']}`. Supported: {CACHE_LOOKUPS}"
+        )
     task_settings["type"] = collector_settings["target_mtype"]
     task_settings["target_dirs"] = task_info["target_directory_ids"]
     task_settings["target_dirs"] = sorted(list(map(int, task_settings["target_dirs"])))
+    task_settings["checkpoint"] = TaskCheckpoint(
+        checkpoint_path(get_checkpoint_dir(), task_info["id"]),
+        float(environ.get("MDC_CHECKPOINT_INTERVAL", "60")),  # seconds between checkpoints
+    )
+    # with `MDC_INCREMENTAL=1` re-run of finished task processes only files added or changed after previous run.
+    incremental = environ.get("MDC_INCREMENTAL", "0") == "1"
+    hanged = task_info.get("hanged", False)
+    task_settings["saved"] = None
+    if hanged or (incremental and task_info["finished_time"] > 0 and not task_info["errors"]):
+        task_settings["saved"] = task_settings["checkpoint"].load()
+        if task_settings["saved"] is not None:
+            if task_settings["saved"][0]["settings"] != checkpoint_settings(task_settings):
+                log.info("Settings of task were changed after checkpoint.")
+                task_settings["saved"] = None
+            elif not (incremental if task_settings["saved"][0]["position"] is None else hanged):
+                task_settings["saved"] = None
+    # checkpoint with position of the walk is of interrupted run, without it - of finished walk.
+    task_settings["incremental"] = task_settings["saved"] is not None and task_settings["saved"][0]["position"] is None
+    task_settings["files_scanned"] = 0
+    if task_settings["incremental"]:
+        log.info("Processing files changed after previous run of task.")
+        clear_task_files_scanned(task_info["id"])
+    elif task_settings["saved"] is not None:
+        task_settings["files_scanned"] = task_settings["saved"][0]["files_scanned"]
+        log.info("Continue task from checkpoint: files_scanned = %u", task_settings["files_scanned"])
+        clear_task_files_scanned_groups(task_info["id"], task_settings["files_scanned"])
+    else:
+        task_settings["checkpoint"].remove()
+        if task_info["files_scanned"] > 0:
+            clear_task_files_scanned_groups(task_info["id"])
     return task_settings
 
 
+@lru_cache(maxsize=None)
+def get_mimetype_id_cached(mimetype_name: str) -> int:
+    return get_mimetype_id(mimetype_name)
+
+
+@lru_cache(maxsize=None)
+def get_instance_id() -> Optional[str]:
+    return occ_call_decode("config:system:get", "instanceid")
+
+
+def get_checkpoint_dir() -> str:
+    """Returns `MDC_CHECKPOINT_DIR`, by default it is `checkpoints` in app data of MediaDC. Empty string disables
+    checkpoints."""
+
+    checkpoint_dir = environ.get("MDC_CHECKPOINT_DIR")
+    if checkpoint_dir is not None:
+        return checkpoint_dir
+    instance_id = get_instance_id()
+    if not instance_id:
+        return path.join(gettempdir(), "mediadc_checkpoints")
+    return path.join(CONFIG["datadir"], f"appdata_{instance_id}", "mediadc", "checkpoints")
+
+
+def remove_stale_task_checkpoints() -> None:
+    """Removes checkpoints of deleted tasks and checkpoints not updated for `MDC_CHECKPOINT_DAYS` days, next run of
+    such task is a full one. Tasks are not queried, if there is no directory of checkpoints."""
+
+    checkpoint_dir = get_checkpoint_dir()
+    if not checkpoint_dir or not path.isdir(checkpoint_dir):
+        return
+    max_age = float(environ.get("MDC_CHECKPOINT_DAYS", "30")) * 24 * 3600
+    removed = remove_stale_checkpoints(checkpoint_dir, {int(i["id"]) for i in get_tasks()}, max_age)
+    if removed:
+        log.info("Removed stale checkpoints: %u", removed)
+
+
+def checkpoint_settings(task_settings: dict) -> dict:
+    return {i: task_settings[i] for i in CHECKPOINT_SETTINGS}
+
+
 def reset_data_groups():
     """Reset any results from previous tasks if they present."""
 
@@ -89,13 +216,18 @@ def reset_data_groups():
     reset_videos()
 
 
-def analyze_and_lock(task_info: dict) -> bool:
+def is_task_hanged(task_info: dict) -> bool:
+    return get_time() > task_info["updated_time"] + int(TASK_KEEP_ALIVE) * 3
+
+
+def analyze_and_lock(task_info: dict, lock_delay: float = 1.0) -> bool:
     """Checks if can/need we to work on this task. Returns True if task was locked and must be processed."""
 
-    sleep(1)
+    sleep(lock_delay)
     if task_info["py_pid"] != 0:
-        if get_time() > task_info["updated_time"] + int(TASK_KEEP_ALIVE) * 3:
+        if is_task_hanged(task_info):
             log.info("Task was in hanged state.")
+            task_info["hanged"] = True
         else:
             log.info("Task is already running.")
             return False
@@ -147,13 +279,14 @@ def start_background_thread(task_info: dict):
     task_info["b_thread"].start()
 
 
-def process_task(task_info) -> None:
+def process_task(task_info, lock_delay: float = 1.0) -> None:
     """Top Level function. Checks if we can work on task, and if so - start to process it. Called from `main`."""
 
     log.debug("Processing task: id=%u", task_info["id"])
-    if not analyze_and_lock(task_info):
+    if not analyze_and_lock(task_info, lock_delay):
         return
     _task_status = "error"
+    interrupted = False
     try:
         reset_data_groups()
         task_settings = init_task_settings(task_info)
@@ -162,13 +295,16 @@ def process_task(task_info) -> None:
         if TaskType(task_settings["type"]) == TaskType.IMAGE:
             process_image_task(task_settings)
         elif TaskType(task_settings["type"]) == TaskType.VIDEO:
-            process_video_task(task_settings, 0)
+            process_video_task(task_settings)
         elif TaskType(task_settings["type"]) == TaskType.IMAGE_VIDEO:
-            group_offset = process_image_task(task_settings)
-            process_video_task(task_settings, group_offset)
+            process_image_video_task(task_settings)
         _task_status = "finished"
         log.info("Task execution_time: %d seconds", perf_counter() - time_start)
         finalize_task(task_info["id"])
+    except TaskInterrupted:
+        # task stays locked, without keepalive it becomes hanged and continues from the checkpoint.
+        log.info("Task was interrupted.")
+        interrupted = True
     except Exception as exception_info:  # noqa # pylint: disable=broad-except
         log.exception("Exception during task execution.")
         append_task_error(task_info["id"], f"Exception({type(exception_info).__name__}): `{str(exception_info)}`")
@@ -176,67 +312,162 @@ def process_task(task_info) -> None:
         if "b_thread" in task_info:
             task_info["exit_event"].set()
             task_info["b_thread"].join(timeout=2.0)
-        unlock_task(task_info["id"])
-        log.debug("Task unlocked.")
-        if task_info.get("collector_settings", {}).get("finish_notification", False):
+        if not interrupted:
+            unlock_task(task_info["id"])
+            log.debug("Task unlocked.")
+        if not interrupted and task_info.get("collector_settings", {}).get("finish_notification", False):
             occ_call_decode("mediadc:collector:tasks:notify", str(task_info["id"]), _task_status)
 
 
-def process_image_task(task_settings: dict) -> int:
+def process_image_task(task_settings: dict):
     """Top Level function to process image task. As input param expects dict from `init_task_settings` function."""
 
-    fs_objs = fs_node_info(task_settings["target_dirs"])
-    fs_apply_exclude_lists(fs_objs, task_settings["exclude_fileid"], task_settings["exclude_mask"])
-    process_image_task_dirs(fs_objs, task_settings)
-    return save_image_results(task_settings["id"])
-
-
-def process_image_task_dirs(directories: list[FsNodeInfo], task_settings: dict):
-    """Calls `process_directory_images` for each dir in `directories_ids`. Recursively does that for each sub dir."""
-
-    for directory in directories:
-        process_image_task_dirs(process_directory_images(directory, task_settings), task_settings)
-
-
-def process_directory_images(directory: FsNodeInfo, task_settings: dict) -> list[FsNodeInfo]:
-    """Process all files in `dir_id` with mimetype==mime_image and return list of sub dirs for this `dir_id`."""
-
-    fs_objs = fs_list_directory(directory["id"])
-    fs_apply_ignore_flags(fs_objs)
-    fs_apply_exclude_lists(fs_objs, task_settings["exclude_fileid"], task_settings["exclude_mask"])
-    sub_dirs = fs_extract_sub_dirs(fs_objs)
-    fs_filter_by(fs_objs, "mimepart", [mimetype.IMAGE])
-    process_images(task_settings, fs_objs)
-    if fs_objs:
+    init_images(task_settings)
+    for fs_objs in walk_task_files(task_settings, [mimetype.IMAGE]):
+        process_images(task_settings, fs_objs)
         increase_processed_files_count(task_settings["id"], len(fs_objs))
-    return sub_dirs
+    save_task_results(task_settings, get_image_results(task_settings))
 
 
-def process_video_task(task_settings: dict, group_offset: int):
+def process_video_task(task_settings: dict):
     """Top Level function to process video task. As input param expects dict from `init_task_settings` function."""
 
-    fs_objs = fs_node_info(task_settings["target_dirs"])
-    fs_apply_exclude_lists(fs_objs, task_settings["exclude_fileid"], task_settings["exclude_mask"])
-    process_video_task_dirs(fs_objs, task_settings)
-    save_video_results(task_settings["id"], group_offset)
-
+    init_videos(task_settings)
+    for fs_objs in walk_task_files(task_settings, [mimetype.VIDEO]):
+        process_videos(task_settings, fs_objs)
+        increase_processed_files_count(task_settings["id"], len(fs_objs))
+    save_task_results(task_settings, get_video_results(task_settings))
 
-def process_video_task_dirs(directories: list[FsNodeInfo], task_settings: dict):
-    """Calls `process_directory_videos` for each dir in `directories_ids`. Recursively does that for each sub dir."""
 
-    for directory in directories:
-        process_video_task_dirs(process_directory_videos(directory, task_settings), task_settings)
+def process_image_video_task(task_settings: dict):
+    """Top Level function to process task for images and videos, with one walk over directories."""
 
+    init_images(task_settings)  # before `init_videos`: workers of images are forked before threads of videos start
+    init_videos(task_settings)
+    for fs_objs in walk_task_files(task_settings, [mimetype.IMAGE, mimetype.VIDEO]):
+        # video workers run ffmpeg, while images are hashed. DB is accessed only from this thread.
+        videos_hashing = hash_videos(task_settings, [i for i in fs_objs if i["mimepart"] == mimetype.VIDEO])
+        process_images(task_settings, [i for i in fs_objs if i["mimepart"] == mimetype.IMAGE])
+        store_videos(task_settings, *videos_hashing)
+        increase_processed_files_count(task_settings["id"], len(fs_objs))
+    save_task_results(task_settings, get_image_results(task_settings) + get_video_results(task_settings))
+
+
+def walk_task_files(task_settings: dict, mimeparts: list[int]):
+    """Yields batches of files with `mimeparts` from target directories of task.
+
+    Groups are restored from checkpoint, if task continues from it or runs incrementally, and are saved to checkpoint
+    during the walk and when it is finished. Incremental run yields only added and changed files, and after them
+    unchanged files of groups split by `TaskDelta`, all of them are added to groups only when the walk is finished."""
+
+    groups_state = {}
+    if mimetype.IMAGE in mimeparts:
+        groups_state["images"] = task_settings["images_groups"]
+    if mimetype.VIDEO in mimeparts:
+        groups_state["videos"] = task_settings["videos_groups"]
+    walked_files = []  # rows of (id, mtime) of walked files
+    position = None
+    delta = None
+    if task_settings["saved"] is not None:
+        state, groups, files = task_settings["saved"]
+        task_settings["saved"] = None
+        for kind, files_groups in groups_state.items():
+            files_groups.restore_state(*groups[kind])
+        if task_settings["incremental"]:
+            delta = TaskDelta(files, {kind: files_groups.groups for kind, files_groups in groups_state.items()})
+            # until all removed files are known, groups can have representatives of them.
+            for files_groups in groups_state.values():
+                files_groups.defer_adding()
+        else:
+            position = state["position"]
+            walked_files.append(files)
+
+    def save_checkpoint(walk_position: Optional[dict], force: bool = False):
+        if not task_settings["checkpoint"].is_due(force):
+            return
+        walked_files[:] = [numpy.concatenate(walked_files)] if walked_files else []
+        task_settings["checkpoint"].save(
+            {
+                "position": walk_position,
+                "files_scanned": task_settings["files_scanned"],
+                "settings": checkpoint_settings(task_settings),
+            },
+            {kind: files_groups.get_state() for kind, files_groups in groups_state.items()},
+            walked_files[0] if walked_files else numpy.zeros((0, 2), dtype=numpy.int64),
+            force=force,
+        )
 
-def process_directory_videos(directory: FsNodeInfo, task_settings: dict) -> list[FsNodeInfo]:
-    """Process all files in `dir_id` with mimetype==mime_video and return list of sub dirs for this `dir_id`."""
+    def on_position(walk_position: dict):
+        # incremental run keeps the checkpoint of previous run, until its own walk is finished.
+        if delta is None:
+            save_checkpoint(walk_position, force=StopRequest.is_set())
+        if StopRequest.is_set():
+            raise TaskInterrupted
 
-    fs_objs = fs_list_directory(directory["id"])
-    fs_apply_ignore_flags(fs_objs)
+    fs_objs = fs_node_info(task_settings["target_dirs"])
     fs_apply_exclude_lists(fs_objs, task_settings["exclude_fileid"], task_settings["exclude_mask"])
-    sub_dirs = fs_extract_sub_dirs(fs_objs)
-    fs_filter_by(fs_objs, "mimepart", [mimetype.VIDEO])
-    process_videos(task_settings, fs_objs)
-    if fs_objs:
-        increase_processed_files_count(task_settings["id"], len(fs_objs))
-    return sub_dirs
+    for fs_objs in walk_media_files(
+        fs_objs,
+        mimeparts,
+        task_settings["exclude_fileid"],
+        task_settings["exclude_mask"],
+        task_settings["db_batch"],
+        position=position,
+        on_position=on_position,
+    ):
+        walked_files.append(numpy.array([(i["id"], i["mtime"]) for i in fs_objs], dtype=numpy.int64))
+        files_count = len(fs_objs)
+        if delta is not None:
+            fs_objs = delta.filter(fs_objs)
+            if files_count > len(fs_objs):
+                increase_processed_files_count(task_settings["id"], files_count - len(fs_objs))
+        if fs_objs:
+            yield fs_objs
+        # files of batch are processed, when the walk continues.
+        task_settings["files_scanned"] += files_count
+    if delta is not None:
+        delta.remove_missing()
+        regroup_ids = delta.split_groups()
+        log.info("Files removed from groups of previous run: %u, grouped again: %u", delta.removed, len(regroup_ids))
+        batch_size = max(task_settings["db_batch"], 1)
+        for i in range(0, len(regroup_ids), batch_size):
+            fs_objs = fs_node_info(regroup_ids[i : i + batch_size])
+            # they are unchanged files, that were already counted as processed.
+            increase_processed_files_count(task_settings["id"], -len(fs_objs))
+            yield fs_objs
+        for files_groups in groups_state.values():
+            if delta.removed:
+                hashes, groups = files_groups.get_state()
+                files_groups.restore_state(hashes.copy(), dict(groups))
+            files_groups.add_deferred()
+    save_checkpoint(None, force=True)
+
+
+def save_task_results(task_settings: dict, groups: list[list[int]]):
+    """Writes groups of similar files to table `task_details`.
+
+    Incremental run keeps numbers of groups of previous run and writes only records, that were changed."""
+
+    if not task_settings["incremental"]:
+        store_task_files_groups(
+            task_settings["id"],
+            [(n_group, file_id) for n_group, files_id in enumerate(groups, start=1) for file_id in files_id],
+            task_settings["db_batch"],
+        )
+        return
+    previous = get_task_files_groups(task_settings["id"])
+    taken: set[int] = set()
+    next_group = max(previous.values(), default=0) + 1
+    files_groups: dict[int, int] = {}
+    for files_id in groups:
+        n_group = next((previous[i] for i in files_id if i in previous and previous[i] not in taken), None)
+        if n_group is None:
+            n_group = next_group
+            next_group += 1
+        taken.add(n_group)
+        files_groups.update((i, n_group) for i in files_id)
+    deleted = [i for i, previous_group in previous.items() if files_groups.get(i) != previous_group]
+    added = [(new_group, i) for i, new_group in files_groups.items() if previous.get(i) != new_group]
+    log.info("Changed records of groups: %u removed, %u added", len(deleted), len(added))
+    delete_task_files_groups(task_settings["id"], deleted, task_settings["db_batch"])
+    store_task_files_groups(task_settings["id"], added, task_settings["db_batch"])
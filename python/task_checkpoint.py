@@ -0,0 +1,124 @@
+"""
+Checkpoints of tasks, so a task that was interrupted continues from the last checkpoint instead of the start.
+
+Checkpoint is a `.npz` file with position of the walk over directories, number of processed files and settings of
+task, ids and mtimes of walked files, and for images and videos: representatives of groups with files of each group.
+It is written by the task thread between chunks of directories, when all files before the position of the walk are in
+groups, and at the end of the walk, as the base for the next incremental run of the task.
+
+Checkpoints of deleted tasks and checkpoints, that were not updated for a long time, are removed by
+`remove_stale_checkpoints`.
+"""
+
+import os
+import re
+from contextlib import suppress
+from json import dumps, loads
+from time import perf_counter, time
+from typing import Any, Optional
+
+import numpy
+
+from .log import logger as log
+
+CHECKPOINT_NAME = re.compile(r"task_(\d+)\.npz(?:\.tmp)?")
+
+
+def checkpoint_path(directory: str, task_id: int) -> str:
+    """Returns path of checkpoint of task, or empty string if checkpoints are disabled by empty `directory`."""
+
+    return os.path.join(directory, f"task_{task_id}.npz") if directory else ""
+
+
+def remove_stale_checkpoints(directory: str, task_ids: set[int], max_age: float) -> int:
+    """Removes checkpoints of tasks, that are not in `task_ids`, and checkpoints older than `max_age` seconds.
+    Returns number of removed files."""
+
+    if not directory or not os.path.isdir(directory):
+        return 0
+    removed = 0
+    now = time()
+    for entry in os.scandir(directory):
+        match = CHECKPOINT_NAME.fullmatch(entry.name)
+        if match is None:
+            continue
+        try:
+            if int(match.group(1)) not in task_ids or now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+                removed += 1
+        except OSError as exception_info:
+            log.warning("Can not remove checkpoint `%s`: %s", entry.path, str(exception_info))
+    return removed
+
+
+class TaskCheckpoint:
+    """Checkpoint is written no more often than once in `interval` seconds. With empty `path` it is disabled."""
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._saved = perf_counter()
+
+    def is_due(self, force: bool = False) -> bool:
+        """Returns True if `save` with the same `force` writes the checkpoint."""
+
+        return bool(self.path) and (force or perf_counter() - self._saved >= self.interval)
+
+    def save(
+        self,
+        state: dict,
+        groups: dict[str, tuple[numpy.ndarray, dict[int, list[int]]]],
+        files: numpy.ndarray,
+        force: bool = False,
+    ) -> None:
+        """Writes `state`, `groups` of each kind and `files` as rows of (id, mtime), replacing the previous checkpoint
+        only when all is written. If it can not be written, task continues without this checkpoint."""
+
+        if not self.is_due(force):
+            return
+        arrays: dict[str, Any] = {"state": numpy.array(dumps(state)), "files": files}
+        for kind, (hashes, kind_groups) in groups.items():
+            keys = sorted(kind_groups)
+            arrays[f"{kind}_hashes"] = hashes
+            arrays[f"{kind}_keys"] = numpy.array(keys, dtype=numpy.int64)
+            arrays[f"{kind}_sizes"] = numpy.array([len(kind_groups[i]) for i in keys], dtype=numpy.int64)
+            arrays[f"{kind}_files"] = numpy.array([j for i in keys for j in kind_groups[i]], dtype=numpy.int64)
+        tmp_path = self.path + ".tmp"
+        self._saved = perf_counter()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "wb") as checkpoint_file:
+                numpy.savez(checkpoint_file, **arrays)
+            os.replace(tmp_path, self.path)
+        except OSError as exception_info:
+            log.warning("Can not save checkpoint `%s`: %s", self.path, str(exception_info))
+            with suppress(OSError):
+                os.remove(tmp_path)
+            return
+        log.debug("Checkpoint saved: files_scanned = %u", state.get("files_scanned", 0))
+
+    def load(self) -> Optional[tuple[dict, dict[str, tuple[numpy.ndarray, dict[int, list[int]]]], numpy.ndarray]]:
+        """Returns state, groups of each kind and files, or None if there is no valid checkpoint."""
+
+        if not self.path or not os.path.isfile(self.path):
+            return None
+        try:
+            with numpy.load(self.path, allow_pickle=False) as data:
+                state = loads(str(data["state"]))
+                files = data["files"]
+                groups = {}
+                for kind in [i[: -len("_hashes")] for i in data.files if i.endswith("_hashes")]:
+                    sizes = data[f"{kind}_sizes"]
+                    members = numpy.split(data[f"{kind}_files"], numpy.cumsum(sizes)[:-1]) if sizes.size else []
+                    groups[kind] = (
+                        data[f"{kind}_hashes"],
+                        {int(key): i.tolist() for key, i in zip(data[f"{kind}_keys"], members)},
+                    )
+        except (OSError, ValueError, KeyError) as exception_info:
+            log.warning("Can not load checkpoint `%s`: %s", self.path, str(exception_info))
+            return None
+        return state, groups, files
+
+    def remove(self) -> None:
+        if self.path and os.path.isfile(self.path):
+            os.remove(self.path)
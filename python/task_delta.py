@@ -0,0 +1,77 @@
+"""
+Changes of files since the previous run of task, for incremental re-run that keeps its groups.
+
+File is unchanged if it has the same mtime as in the previous run, the same check as for records of hashes cache.
+Unchanged files stay in their groups and are not processed again, changed and deleted files are removed from groups,
+added and changed files are processed as in a full run.
+
+Representative of group is the hash of its first file. When the first file is removed, the group is split: its other
+files are grouped again, as the outdated hash must not join other files with them.
+"""
+
+from typing import Optional
+
+import numpy
+from nc_py_api import FsNodeInfo
+
+
+class TaskDelta:
+    """`files` are rows of (id, mtime) of files walked by the previous run, `groups` are groups of each kind
+    restored from it, they are changed in place."""
+
+    def __init__(self, files: numpy.ndarray, groups: dict[str, dict[int, list[int]]]):
+        order = numpy.argsort(files[:, 0], kind="stable")
+        self.ids = files[order, 0]
+        self.mtimes = files[order, 1]
+        self.seen = numpy.zeros(len(self.ids), dtype=bool)
+        self.groups = groups
+        self.removed = 0
+        self._files_groups: Optional[dict[int, tuple[str, int]]] = None  # built on the first removal
+        self._split: set[tuple[str, int]] = set()  # groups, that lost the file of their representative
+
+    def filter(self, fs_objs: list[FsNodeInfo]) -> list[FsNodeInfo]:
+        """Returns added and changed files from `fs_objs`, changed files are removed from groups."""
+
+        if not fs_objs or not len(self.ids):
+            return fs_objs
+        ids = numpy.array([fs_obj["id"] for fs_obj in fs_objs], dtype=numpy.int64)
+        mtimes = numpy.array([fs_obj["mtime"] for fs_obj in fs_objs], dtype=numpy.int64)
+        positions = numpy.minimum(numpy.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[positions] == ids
+        self.seen[positions[found]] = True
+        unchanged = found & (self.mtimes[positions] == mtimes)
+        for fileid in ids[found & ~unchanged]:
+            self._remove(int(fileid))
+        return [fs_obj for fs_obj, skip in zip(fs_objs, unchanged) if not skip]
+
+    def remove_missing(self) -> None:
+        """Called when the walk is finished, removes from groups files that were not walked."""
+
+        for fileid in self.ids[~self.seen]:
+            self._remove(int(fileid))
+        self.seen[:] = True
+
+    def split_groups(self) -> list[int]:
+        """Called after `remove_missing`, removes from groups the files, that must be grouped again, and returns
+        them. Their hashes are valid, but the representative of their group is not."""
+
+        files = []
+        for kind, key in sorted(self._split):
+            files += self.groups[kind][key]
+            self.groups[kind][key] = []
+        self._split.clear()
+        return files
+
+    def _remove(self, fileid: int) -> None:
+        if self._files_groups is None:
+            self._files_groups = {}
+            for kind, kind_groups in self.groups.items():
+                for key, files_id in kind_groups.items():
+                    self._files_groups.update((i, (kind, key)) for i in files_id)
+        group = self._files_groups.pop(fileid, None)
+        if group is not None:
+            files_id = self.groups[group[0]][group[1]]
+            if files_id[0] == fileid:
+                self._split.add(group)
+            files_id.remove(fileid)
+            self.removed += 1
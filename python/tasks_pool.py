@@ -0,0 +1,65 @@
+"""
+Processing of several tasks in parallel.
+
+Each task runs in a forked worker process, with its own DB connections, lock and keepalive thread, and its own
+groups. Tasks with overlapping target directories are run one after another by the same worker, so hashes of their
+common files are computed once, by the first of them, and the next tasks take them from hashes cache.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from nc_py_api import close_connection, fs_node_info
+
+from .log import logger as log
+from .task import process_task, remove_stale_task_checkpoints
+
+
+def is_in_directory(directory: tuple[int, str], parent: tuple[int, str]) -> bool:
+    """Directories are (storage id, internal path)."""
+
+    if directory[0] != parent[0]:
+        return False
+    return not parent[1] or directory[1] == parent[1] or directory[1].startswith(parent[1] + "/")
+
+
+def split_to_chains(tasks: list[dict]) -> list[list[dict]]:
+    """Returns chains of tasks, tasks with overlapping target directories are in the same chain, in the same order."""
+
+    directories = []
+    for task_info in tasks:
+        fs_objs = fs_node_info(list(map(int, task_info["target_directory_ids"])))
+        directories.append([(i["storageId"], i["internal_path"]) for i in fs_objs])
+    chain_of_task = list(range(len(tasks)))
+    for i in range(len(tasks)):
+        for j in range(i):
+            if any(is_in_directory(a, b) or is_in_directory(b, a) for a in directories[i] for b in directories[j]):
+                old_chain, new_chain = chain_of_task[i], chain_of_task[j]
+                chain_of_task = [new_chain if x == old_chain else x for x in chain_of_task]
+    chains: dict[int, list[dict]] = {}
+    for task_info, chain in zip(tasks, chain_of_task):
+        chains.setdefault(chain, []).append(task_info)
+    return list(chains.values())
+
+
+def process_tasks_chain(tasks: list[dict]) -> None:
+    for task_info in tasks:
+        process_task(task_info)
+
+
+def process_tasks(tasks: list[dict], parallel: int) -> None:
+    """Processes `tasks`, no more than `parallel` of them at the same time."""
+
+    chains = split_to_chains(tasks) if parallel > 1 and len(tasks) > 1 else [tasks]
+    if len(chains) == 1:
+        process_tasks_chain(tasks)
+    else:
+        log.debug("Processing %u tasks in %u chains, parallel: %u", len(tasks), len(chains), parallel)
+        close_connection(0)  # forked workers open their own connections
+        with ProcessPoolExecutor(max_workers=min(parallel, len(chains)), mp_context=get_context("fork")) as pool:
+            for future in [pool.submit(process_tasks_chain, chain) for chain in chains]:
+                try:
+                    future.result()
+                except Exception:  # noqa # pylint: disable=broad-except
+                    log.exception("Exception in worker process of tasks.")
+    remove_stale_task_checkpoints()  # after tasks, so it does not delay their start
@@ -0,0 +1,78 @@
+"""
+Decoders of videos for hashing: duration of video and frames for hash.
+
+`SubprocessDecoder` runs ffprobe and ffmpeg processes, `PyAVDecoder` decodes in the process with PyAV, if it is
+installed. Both take frames at the same timestamps, PyAV returns them as arrays of pixels. Pixels can differ, as
+conversion and scaling of frames are not done by the same code, so hashes of the same video can differ a few bits
+between decoders, and records of hashes cache keep the decoder, see `videos.dump_timestamps`.
+"""
+
+from typing import Optional
+
+from .ffmpeg_probe import ffprobe_get_video_info
+from .video_frames import get_hash_frames, gray_frame_size, spooled_file
+from .video_frames_av import av_get_hash_frames, av_get_video_info, import_av
+
+VIDEO_DECODERS = ("auto", "subprocess", "pyav")
+
+
+class SubprocessDecoder:
+    """Calls ffprobe and ffmpeg, see `video_frames`."""
+
+    name = "subprocess"
+
+    @staticmethod
+    def get_video_info(path, data) -> dict:
+        """Returns {} or {duration:X ms}. Accepts path(bytes/str) or data."""
+
+        return ffprobe_get_video_info(path, data)
+
+    @staticmethod
+    def get_hash_frames(
+        duration: int, path, data, gray_hash: Optional[tuple[str, int]] = None, seek: str = "accurate"
+    ) -> tuple[list[int], list, str]:
+        """Returns timestamps of frames for hash, frames and an error string, that is empty on success.
+
+        Frames are BMP images, or with `gray_hash`(algo, hash_size) arrays of grayscale pixels with the size of hash
+        input. Accepts path(bytes/str) or data."""
+
+        gray_size = None if gray_hash is None else gray_frame_size(*gray_hash)
+        return get_hash_frames(duration, path, data, gray_size, seek)
+
+
+class PyAVDecoder(SubprocessDecoder):
+    """Decodes in the process with PyAV, see `video_frames_av`. Frames are arrays of RGB pixels instead of BMP."""
+
+    name = "pyav"
+
+    @staticmethod
+    def get_video_info(path, data) -> dict:
+        if path is None and data is not None:
+            with spooled_file(data) as spooled_path:
+                return av_get_video_info(spooled_path)
+        return av_get_video_info(path)
+
+    @staticmethod
+    def get_hash_frames(
+        duration: int, path, data, gray_hash: Optional[tuple[str, int]] = None, seek: str = "accurate"
+    ) -> tuple[list[int], list, str]:
+        if path is None and data is not None:
+            with spooled_file(data) as spooled_path:
+                return av_get_hash_frames(duration, spooled_path, gray_hash, seek)
+        return av_get_hash_frames(duration, path, gray_hash, seek)
+
+
+def create_video_decoder(kind: str) -> SubprocessDecoder:
+    """Returns decoder of `kind`. `auto` is PyAV when it is installed, otherwise ffmpeg processes.
+
+    Hashes of the same video can differ between decoders."""
+
+    if kind not in VIDEO_DECODERS:
+        raise ValueError(f"Unknown video decoder: `{kind}`. Supported: {VIDEO_DECODERS}")
+    if kind == "subprocess":
+        return SubprocessDecoder()
+    if kind == "pyav" and import_av() is None:
+        raise ValueError("Video decoder `pyav` requires PyAV package.")
+    if kind == "pyav" or import_av() is not None:
+        return PyAVDecoder()
+    return SubprocessDecoder()
@@ -0,0 +1,388 @@
+"""
+Extraction of frames for video hashes with `ffmpeg`.
+
+Start of video is scanned at low resolution to skip a dark or bright intro, frames for hashes are taken at timestamps
+from `build_times_for_hashes`. Both are done by one ffmpeg process: timestamps are calculated in advance for a video
+that starts from a good frame, that is the most common case. Only if the scan finds another first frame, the missing
+frames are extracted by the second process.
+
+In `keyframe` seek mode only keyframes are demuxed and decoded: the scan looks for the first good keyframe, and
+timestamps are snapped to the nearest keyframes, which are listed before by the demuxer without decoding.
+"""
+
+import os
+import subprocess
+from bisect import bisect_left
+from contextlib import contextmanager
+from math import isqrt
+from tempfile import NamedTemporaryFile
+from threading import Thread
+from typing import Optional
+
+import numpy
+
+FIRST_FRAME_RESOLUTION = 64
+SCAN_FRAME_SIZE = FIRST_FRAME_RESOLUTION * FIRST_FRAME_RESOLUTION * 3
+SCAN_CHUNK_FRAMES = 32
+KEYFRAMES_INPUT_PARAMS = ["-discard", "nokey", "-skip_frame", "nokey"]
+
+
+def build_times_for_hashes(total_duration_ms: int, first_hash_timestamp: int) -> list:
+    pre_interval = int((total_duration_ms - first_hash_timestamp) / 10)
+    round_factor = len(str(pre_interval)) - 1
+    rounded_hash_timestamp = round(pre_interval, ndigits=-round_factor)
+    return [first_hash_timestamp, rounded_hash_timestamp, rounded_hash_timestamp * 2, rounded_hash_timestamp * 4]
+
+
+def get_max_first_frame_time(duration_ms) -> int:
+    max_timestamp = int(duration_ms / 10)
+    if max_timestamp > 14 * 1000:
+        return 14 * 1000
+    return max_timestamp
+
+
+def frames_too_dark(frames: numpy.ndarray) -> numpy.ndarray:
+    """For `(frames, height, width, 3)` array returns which frames have more than 80% of dark pixels."""
+
+    total_allowed_dark_pixels = int(frames.shape[1] * frames.shape[2] / 100 * 80)
+    max_channel = numpy.maximum(numpy.maximum(frames[..., 0], frames[..., 1]), frames[..., 2])
+    dark_pixels = numpy.count_nonzero(max_channel <= 0x20, axis=(1, 2))
+    return dark_pixels > total_allowed_dark_pixels
+
+
+def frames_too_bright(frames: numpy.ndarray) -> numpy.ndarray:
+    """For `(frames, height, width, 3)` array returns which frames have more than 90% of bright pixels."""
+
+    total_allowed_bright_pixels = int(frames.shape[1] * frames.shape[2] / 100 * 90)
+    brightness = frames[..., 0].astype(numpy.uint16) + frames[..., 1] + frames[..., 2]  # int(sum / 3) >= X is sum >= 3X
+    bright_pixels = numpy.count_nonzero(brightness >= 3 * 0xFA, axis=(1, 2))
+    return bright_pixels > total_allowed_bright_pixels
+
+
+def get_first_good_frame(scan: bytes) -> int:
+    """Returns number of the first frame of the scan that is not too dark or bright, or -1."""
+
+    frames_count = int(len(scan) / SCAN_FRAME_SIZE)
+    frames = numpy.frombuffer(scan, dtype=numpy.uint8, count=frames_count * SCAN_FRAME_SIZE).reshape(
+        (frames_count, FIRST_FRAME_RESOLUTION, FIRST_FRAME_RESOLUTION, 3)
+    )
+    # usually the first frames are good, so frames are checked by chunks.
+    for chunk_start in range(0, frames_count, SCAN_CHUNK_FRAMES):
+        chunk = frames[chunk_start : chunk_start + SCAN_CHUNK_FRAMES]
+        good_frames = numpy.flatnonzero(~(frames_too_dark(chunk) | frames_too_bright(chunk)))
+        if good_frames.size:
+            return chunk_start + int(good_frames[0])
+    return -1
+
+
+def get_first_timestamp(scan: bytes, max_timestamp: int) -> tuple[int, int]:
+    """From frames of the scan returns timestamp of the first frame that is not too dark or bright and fps."""
+
+    frames_count = int(len(scan) / SCAN_FRAME_SIZE)
+    frames_per_second = round(frames_count / (max_timestamp / 1000))
+    if frames_per_second == 0:
+        frames_per_second = 1
+    first_good_frame = get_first_good_frame(scan)
+    if first_good_frame == -1:
+        return 0, frames_per_second
+    return int(first_good_frame / frames_per_second * 1000), frames_per_second
+
+
+def parse_keyframes(framecrc: bytes) -> list[int]:
+    """From output of `framecrc` muxer for one stream returns sorted timestamps of keyframes in ms.
+
+    Timestamps are rounded down, so seeking to them with `-ss` does not skip the keyframe."""
+
+    time_base = (1, 1000)
+    keyframes = set()
+    for line in framecrc.decode("utf-8").splitlines():
+        if line.startswith("#tb 0:"):
+            numerator, denominator = line.split(":", 1)[1].split("/")
+            time_base = (int(numerator), int(denominator))
+        elif line and not line.startswith("#"):
+            fields = [i.strip() for i in line.split(",")]
+            if len(fields) > 6 and fields[6].startswith("F=") and not int(fields[6][2:], 16) & 1:
+                continue  # flags are printed only if they differ from the single `key` flag.
+            pts = int(fields[2])
+            if pts >= 0:
+                keyframes.add(pts * time_base[0] * 1000 // time_base[1])
+    return sorted(keyframes)
+
+
+def snap_to_keyframes(timestamps: list[int], keyframes: list[int]) -> list[int]:
+    """For each timestamp returns the nearest keyframe timestamp, on equal distance the earlier one."""
+
+    snapped = []
+    for timestamp in timestamps:
+        index = bisect_left(keyframes, timestamp)
+        if index == len(keyframes) or (index and timestamp - keyframes[index - 1] <= keyframes[index] - timestamp):
+            index -= 1
+        snapped.append(keyframes[index])
+    return snapped
+
+
+def split_bmp_frames(data: bytes) -> list[bytes]:
+    """Splits output of `image2pipe` muxer with `bmp` codec to separate images."""
+
+    frames = []
+    offset = 0
+    while data[offset : offset + 2] == b"BM" and offset + 6 <= len(data):
+        frame_size = int.from_bytes(data[offset + 2 : offset + 6], "little")
+        if frame_size < 6 or offset + frame_size > len(data):
+            break
+        frames.append(data[offset : offset + frame_size])
+        offset += frame_size
+    return frames
+
+
+def split_gray_frames(data: bytes, count: int, width: int) -> list[numpy.ndarray]:
+    """Splits rawvideo of `count` grayscale frames to arrays. With zero `width` frames are square."""
+
+    frame_size = len(data) // count
+    if not frame_size or frame_size * count != len(data):
+        return []
+    width = width if width else isqrt(frame_size)
+    pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape((count, frame_size // width, width))
+    return list(pixels)
+
+
+def gray_frame_size(algo: str, hash_size: int) -> tuple[str, str]:
+    """Returns expressions of width and height for ffmpeg `scale` filter, to which hash algorithm resizes image."""
+
+    if algo == "phash":
+        return str(hash_size * 4), str(hash_size * 4)
+    if algo == "dhash":
+        return str(hash_size + 1), str(hash_size)
+    if algo == "whash":
+        natural_scale = "pow(2\\,floor(log(min(iw\\,ih))/log(2)+1e-9))"
+        return f"max({natural_scale}\\,{hash_size})", f"max({natural_scale}\\,{hash_size})"
+    return str(hash_size), str(hash_size)
+
+
+@contextmanager
+def spooled_file(data: bytes):
+    """Writes `data` once to the in-memory file(memfd), or if it is not supported to the temporary file.
+    Yields path to it, which ffmpeg and ffprobe can open and seek in."""
+
+    if hasattr(os, "memfd_create"):
+        memfd = os.memfd_create("mediadc_video")
+        try:
+            memfd_path = f"/proc/{os.getpid()}/fd/{memfd}"
+            if os.path.exists(memfd_path):
+                with open(memfd, "wb", closefd=False) as memfile:
+                    memfile.write(data)
+                del data
+                yield memfd_path
+                return
+        finally:
+            os.close(memfd)
+    with NamedTemporaryFile(prefix="mediadc_video_") as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        del data
+        yield temp_file.name
+
+
+def _read_pipe(read_fd: int, output: dict) -> None:
+    with os.fdopen(read_fd, "rb") as pipe:
+        output["data"] = pipe.read()
+
+
+def call_ffmpeg(*params, stdin_data: Optional[bytes] = None) -> tuple[bytes, bytes, str]:
+    """Calls ffmpeg with two outputs: the first one(if any) should be `pipe:1`, the second one is added after `params`.
+
+    Returns data of both outputs and an error string, that is empty on success."""
+
+    read_fd, write_fd = os.pipe()
+    second_output: dict = {}
+    reader = Thread(target=_read_pipe, args=(read_fd, second_output), daemon=True)
+    reader.start()
+    try:
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            ["ffmpeg", *params, f"pipe:{write_fd}"],
+            stdin=subprocess.DEVNULL if stdin_data is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=(write_fd,),
+        )
+    except Exception as exception_info:  # noqa # pylint: disable=broad-except
+        return b"", b"", f"ffmpeg raised {type(exception_info).__name__}: {str(exception_info)}"
+    finally:
+        os.close(write_fd)
+    stdout, stderr = process.communicate(stdin_data)
+    reader.join()
+    if process.returncode:
+        return b"", b"", f"ffmpeg raised process error: exit code {process.returncode}"
+    errors = stderr.decode("utf-8")
+    if len(errors):
+        return b"", b"", f"ffmpeg return errors: {errors}"
+    return stdout, second_output.get("data", b""), ""
+
+
+def get_keyframes(path, data) -> tuple[list[int], str]:
+    """Returns timestamps of keyframes from `parse_keyframes` and an error string, that is empty on success.
+    Only the demuxer is used, with `-discard nokey` MP4 demuxer takes keyframes from the index without reading
+    other packets."""
+
+    if path is None and data is None:
+        raise ValueError("`path` or `data` argument must be specified.")
+    _, framecrc, err = call_ffmpeg(
+        "-hide_banner",
+        "-loglevel",
+        "fatal",
+        *KEYFRAMES_INPUT_PARAMS,
+        "-an",
+        "-sn",
+        "-dn",
+        "-i",
+        "pipe:0" if path is None else path,
+        "-map",
+        "0:v:0",
+        "-c",
+        "copy",
+        "-f",
+        "framecrc",
+        stdin_data=data,
+    )
+    if err:
+        return [], err
+    return parse_keyframes(framecrc), ""
+
+
+def extract_frames(
+    timestamps: list[int],
+    scan_to: int,
+    path,
+    data,
+    gray_size: Optional[tuple[str, str]] = None,
+    keyframes_only: bool = False,
+) -> tuple[bytes, list, str]:
+    """Returns scan from start of video up to `scan_to` ms(if it is not zero), frames at `timestamps` and an
+    error string, that is empty on success. Accepts path(bytes/str) or data for processing in memory.
+
+    Scan is the rawvideo of `rgb24` frames with `FIRST_FRAME_RESOLUTION` size. Frames are BMP images, or with
+    `gray_size`(width and height from `gray_frame_size`) arrays of grayscale pixels, scaled by ffmpeg.
+    With `keyframes_only` only keyframes are decoded, both for the scan and for frames at `timestamps`."""
+
+    input_params = [*(KEYFRAMES_INPUT_PARAMS if keyframes_only else []), "-an", "-sn", "-dn"]
+    scan_filter = f"scale={FIRST_FRAME_RESOLUTION}:{FIRST_FRAME_RESOLUTION},format=rgb24[scan]"
+    inputs = []
+    filters = []
+    if path is not None:
+        # each timestamp is a separate input, so ffmpeg seeks to it instead of decoding everything before.
+        inputs_count = 0
+        if scan_to:
+            inputs += [*input_params, "-to", f"{scan_to}ms", "-i", path]
+            inputs_count += 1
+            filters.append("[0:v]split[scan_input][first]")
+            filters.append(f"[scan_input]{scan_filter}")
+        for index, timestamp in enumerate(timestamps):
+            if scan_to and timestamp == 0:
+                filters.append(f"[first]trim=end_frame=1[frame{index}]")
+                continue
+            inputs += [*input_params, "-ss", f"{timestamp}ms", "-i", path]
+            filters.append(f"[{inputs_count}:v]trim=end_frame=1[frame{index}]")
+            inputs_count += 1
+        if scan_to and 0 not in timestamps:
+            filters.append("[first]nullsink")
+    elif data is not None:
+        # input from the pipe can not be seeked, all outputs are taken from the single pass of decoding.
+        inputs += [*input_params, "-i", "pipe:0"]
+        branches = [f"[branch{i}]" for i in range(len(timestamps))]
+        if scan_to:
+            branches.append("[scan_input]")
+            filters.append(f"[scan_input]trim=end={scan_to / 1000},{scan_filter}")
+        filters.insert(0, f"[0:v]split={len(branches)}{''.join(branches)}")
+        for index, timestamp in enumerate(timestamps):
+            filters.append(f"[branch{index}]trim=start={timestamp / 1000},trim=end_frame=1[frame{index}]")
+    else:
+        raise ValueError("`path` or `data` argument must be specified.")
+    frames = "".join(f"[frame{i}]" for i in range(len(timestamps)))
+    # frames from different inputs can have the same timestamps, they are set to one second apart with `-r 1`.
+    frames_filter = f"{frames}concat=n={len(timestamps)},setpts=N/TB"
+    if gray_size is None:
+        filters.append(f"{frames_filter}[frames]")
+        frames_output = ["-c:v", "bmp", "-f", "image2pipe"]
+    else:
+        filters.append(f"{frames_filter},scale={gray_size[0]}:{gray_size[1]}:flags=lanczos,format=gray[frames]")
+        frames_output = ["-f", "rawvideo"]
+    outputs = ["-map", "[scan]", "-f", "rawvideo", "pipe:1"] if scan_to else []
+    if keyframes_only and scan_to:
+        # otherwise keyframes are duplicated to the frame rate of video. `-fps_mode` requires ffmpeg 5.1+.
+        outputs[-1:-1] = ["-fps_mode", "passthrough"]
+    scan, frames_data, err = call_ffmpeg(
+        "-hide_banner",
+        "-loglevel",
+        "fatal",
+        *inputs,
+        "-filter_complex",
+        ";".join(filters),
+        *outputs,
+        "-map",
+        "[frames]",
+        "-r",
+        "1",
+        *frames_output,
+        stdin_data=data,
+    )
+    if gray_size is None:
+        return scan, split_bmp_frames(frames_data), err
+    width = int(gray_size[0]) if gray_size[0].isdigit() else 0
+    return scan, split_gray_frames(frames_data, len(timestamps), width), err
+
+
+def get_hash_frames(
+    duration: int, path, data, gray_size: Optional[tuple[str, str]] = None, seek: str = "accurate"
+) -> tuple[list[int], list, str]:
+    """Returns timestamps of frames for hash, frames(see `extract_frames`) and an error string, that is empty on
+    success. Accepts path(bytes/str) or data for processing in memory.
+
+    With `keyframe` seek returned timestamps are the timestamps of keyframes, that were used for hash."""
+
+    if path is None and data is not None:
+        # data is written once to the file, so ffmpeg can seek in it, instead of decoding from the start.
+        with spooled_file(data) as spooled_path:
+            return _get_hash_frames(duration, spooled_path, None, gray_size, seek)
+    return _get_hash_frames(duration, path, data, gray_size, seek)
+
+
+def _get_hash_frames(duration: int, path, data, gray_size, seek: str) -> tuple[list[int], list, str]:
+    max_timestamp = get_max_first_frame_time(duration)
+    keyframes: list[int] = []
+    if seek == "keyframe":
+        keyframes, err = get_keyframes(path, data)
+        if err:
+            return [], [], err
+        if not keyframes:
+            return [], [], "no keyframes were found"
+        # the scan includes the keyframe nearest to its end, as if the end was snapped too.
+        max_timestamp = snap_to_keyframes([max_timestamp], keyframes)[0] + 1
+    timestamps = build_times_for_hashes(duration, 0)
+    if keyframes:
+        timestamps = snap_to_keyframes(timestamps, keyframes)
+    # with snapping a few timestamps can be the same keyframe, each frame is extracted once.
+    unique_timestamps = list(dict.fromkeys(timestamps))
+    scan, frames, err = extract_frames(unique_timestamps, max_timestamp, path, data, gray_size, bool(keyframes))
+    if err:
+        return [], [], err
+    known_frames = dict(zip(unique_timestamps, frames))
+    if keyframes:
+        # each frame of the scan is the next keyframe.
+        first_good_frame = get_first_good_frame(scan)
+        first_timestamp = keyframes[first_good_frame] if 0 <= first_good_frame < len(keyframes) else keyframes[0]
+    else:
+        first_timestamp, _ = get_first_timestamp(scan, max_timestamp)
+    if first_timestamp != timestamps[0]:
+        timestamps = build_times_for_hashes(duration, first_timestamp)
+        if keyframes:
+            timestamps = snap_to_keyframes(timestamps, keyframes)
+        missing = [i for i in dict.fromkeys(timestamps) if i not in known_frames]
+        if missing:
+            _, missing_frames, err = extract_frames(missing, 0, path, data, gray_size, bool(keyframes))
+            if err:
+                return [], [], err
+            known_frames.update(zip(missing, missing_frames))
+    frames = [known_frames[i] for i in timestamps if i in known_frames]
+    if len(frames) != len(timestamps):
+        return [], [], f"ffmpeg returned {len(frames)} frames instead of {len(timestamps)}"
+    return timestamps, frames, ""
@@ -0,0 +1,180 @@
+"""
+Decoding of frames for video hashes in the process with PyAV, at the same timestamps as `video_frames` extracts
+frames by ffmpeg. Pixels of frames are not guaranteed to be the same as of ffmpeg output.
+
+Container is opened once: the start of video is scanned, then decoder seeks to each timestamp. Frames are returned
+as arrays of pixels, without process startup, pipes and BMP encoding.
+"""
+
+from fractions import Fraction
+from math import floor, log2
+from types import ModuleType
+from typing import Optional
+
+import numpy
+
+from .video_frames import (
+    FIRST_FRAME_RESOLUTION,
+    build_times_for_hashes,
+    get_first_good_frame,
+    get_first_timestamp,
+    get_max_first_frame_time,
+    snap_to_keyframes,
+)
+
+av: Optional[ModuleType] = None  # imported by `import_av` on the first use, as PyAV takes time to load.
+
+
+def import_av() -> Optional[ModuleType]:
+    """Returns PyAV module, or None if it is not installed."""
+
+    global av  # pylint: disable=global-statement
+    if av is None:
+        try:
+            import av as av_module  # pylint: disable=import-outside-toplevel
+
+            av = av_module
+        except ImportError:
+            return None
+    return av
+
+
+def av_gray_frame_size(algo: str, hash_size: int, width: int, height: int) -> tuple[int, int]:
+    """The same as `gray_frame_size`, but returns width and height for the frame of known size."""
+
+    if algo == "phash":
+        return hash_size * 4, hash_size * 4
+    if algo == "dhash":
+        return hash_size + 1, hash_size
+    if algo == "whash":
+        natural_scale = max(2 ** floor(log2(min(width, height)) + 1e-9), hash_size)
+        return natural_scale, natural_scale
+    return hash_size, hash_size
+
+
+def av_get_video_info(path) -> dict:
+    """Returns {} or {duration:X ms}, the same duration as ffprobe `format=duration`."""
+
+    pyav = import_av()
+    if pyav is None:
+        return {}
+    try:
+        with pyav.open(path) as container:
+            if not container.streams.video or container.duration is None:
+                return {}
+            return {"duration": int(container.duration // 1000)}
+    except Exception:  # noqa # pylint: disable=broad-except
+        return {}
+
+
+class _VideoDecoder:
+    """Opened video stream, converts timestamps in ms from start of video, like `-ss` of ffmpeg does."""
+
+    def __init__(self, container, keyframes_only: bool):
+        self.container = container
+        self.stream = container.streams.video[0]
+        self.time_base = self.stream.time_base
+        self.start = Fraction(container.start_time or 0, 1000000)  # ffmpeg seeks relative to start of container
+        if keyframes_only:
+            self.stream.codec_context.skip_frame = "NONKEY"
+
+    def frame_time(self, pts: int) -> Fraction:
+        """Returns time of frame in ms from start of video."""
+
+        return (pts * self.time_base - self.start) * 1000
+
+    def keyframes(self) -> list[int]:
+        """Returns sorted timestamps of keyframes in ms, rounded down like `parse_keyframes` does."""
+
+        discard = getattr(getattr(av, "stream", None), "Discard", None)  # not in old PyAV versions
+        if discard is not None:
+            self.stream.discard = discard.nonkey  # as `-discard nokey`, demuxer skips other packets
+        keyframes = set()
+        for packet in self.container.demux(self.stream):
+            if packet.pts is not None and packet.is_keyframe and packet.pts * self.time_base >= self.start:
+                keyframes.add(floor(self.frame_time(packet.pts)))
+        if discard is not None:
+            self.stream.discard = discard.default
+        return sorted(keyframes)
+
+    def scan(self, scan_to: int) -> bytes:
+        """Returns the same scan as `extract_frames` does: frames up to `scan_to` ms in `rgb24`."""
+
+        self.seek(0)
+        frames = []
+        for frame in self.container.decode(self.stream):
+            if frame.pts is None:
+                continue
+            if self.frame_time(frame.pts) >= scan_to:
+                break
+            scaled = frame.reformat(FIRST_FRAME_RESOLUTION, FIRST_FRAME_RESOLUTION, "rgb24", interpolation="BICUBIC")
+            frames.append(scaled.to_ndarray().tobytes())
+        return b"".join(frames)
+
+    def seek(self, timestamp: int) -> None:
+        self.container.seek(floor((self.start + Fraction(timestamp, 1000)) / self.time_base), stream=self.stream)
+
+    def frame_at(self, timestamp: int):
+        """Returns the first frame at `timestamp` ms or after it, as accurate seek of ffmpeg does."""
+
+        self.seek(timestamp)
+        for frame in self.container.decode(self.stream):
+            if frame.pts is not None and self.frame_time(frame.pts) >= timestamp:
+                return frame
+        return None
+
+
+def frame_to_pixels(frame, gray_hash: Optional[tuple[str, int]]) -> numpy.ndarray:
+    """Returns array of RGB pixels of frame, or with `gray_hash`(algo, hash_size) array of grayscale pixels with the
+    size of hash input. Frame is rotated by its display matrix, as ffmpeg does by default."""
+
+    rotations = round(getattr(frame, "rotation", 0) / 90) % 4  # counterclockwise, as `numpy.rot90`
+    if gray_hash is None:
+        return numpy.rot90(frame.to_ndarray(format="rgb24"), rotations).copy()
+    width, height = (frame.height, frame.width) if rotations % 2 else (frame.width, frame.height)
+    width, height = av_gray_frame_size(*gray_hash, width, height)
+    if rotations % 2:
+        width, height = height, width
+    scaled = frame.reformat(width, height, "gray", interpolation="LANCZOS").to_ndarray()
+    return numpy.rot90(scaled, rotations).copy()
+
+
+def av_get_hash_frames(
+    duration: int, path, gray_hash: Optional[tuple[str, int]] = None, seek: str = "accurate"
+) -> tuple[list[int], list, str]:
+    """The same as `get_hash_frames`, but frames are arrays from `frame_to_pixels`. Accepts path(bytes/str)."""
+
+    pyav = import_av()
+    if pyav is None:
+        return [], [], "PyAV is not installed"
+    try:
+        with pyav.open(path) as container:
+            decoder = _VideoDecoder(container, seek == "keyframe")
+            max_timestamp = get_max_first_frame_time(duration)
+            keyframes = []
+            if seek == "keyframe":
+                keyframes = decoder.keyframes()
+                if not keyframes:
+                    return [], [], "no keyframes were found"
+                max_timestamp = snap_to_keyframes([max_timestamp], keyframes)[0] + 1
+            scan = decoder.scan(max_timestamp)
+            if keyframes:
+                first_good_frame = get_first_good_frame(scan)
+                first_timestamp = (
+                    keyframes[first_good_frame] if 0 <= first_good_frame < len(keyframes) else keyframes[0]
+                )
+            else:
+                first_timestamp, _ = get_first_timestamp(scan, max_timestamp)
+            timestamps = build_times_for_hashes(duration, first_timestamp)
+            if keyframes:
+                timestamps = snap_to_keyframes(timestamps, keyframes)
+            frames = {}
+            for timestamp in dict.fromkeys(timestamps):
+                frame = decoder.frame_at(timestamp)
+                if frame is not None:
+                    frames[timestamp] = frame_to_pixels(frame, gray_hash)
+    except Exception as exception_info:  # noqa # pylint: disable=broad-except
+        return [], [], f"PyAV raised {type(exception_info).__name__}: {str(exception_info)}"
+    if len(frames) != len(set(timestamps)):
+        return [], [], f"PyAV returned {len(frames)} frames instead of {len(set(timestamps))}"
+    return timestamps, [frames[i] for i in timestamps], ""
@@ -2,30 +2,29 @@
 Videos processing functions.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from json import dumps
-from typing import Any, Optional, Union
+from threading import Condition
+from typing import Iterator, Optional, Union, cast
 
 import numpy
-from nc_py_api import FsNodeInfo, fs_file_data, fs_sort_by_id
-
-from .db_requests import (
-    get_videos_caches,
-    store_err_video_hash,
-    store_task_files_group,
-    store_video_hash,
-)
-from .ffmpeg_probe import ffprobe_get_video_info, stub_call_ff
-from .images import arr_hash_from_bytes, arr_hash_to_string, calc_hash
+from nc_py_api import FsNodeInfo, fs_file_data
+
+from .clustering import FilesGroups, create_grouping_index
+from .db_buffer import WriteBuffer
+from .db_requests import get_videos_caches, store_videos_hashes
+from .hash_index import hash_from_bytes, hash_from_hex
+from .hashes_cache import HashesCache, RecordsMemory
+from .images import arr_hash_to_string, calc_hash, calc_pixels_hash
 from .log import logger as log
-
-try:
-    from hexhamming import check_hexstrings_within_dist
-except ImportError:
-    check_hexstrings_within_dist = None
+from .video_decoders import SubprocessDecoder, create_video_decoder
+from .video_frames import spooled_file
 
 
 class MdcVideoInfo(FsNodeInfo):
-    hash: Optional[Union[bytes, str]]
+    hash: Optional[Union[bytes, numpy.ndarray]]
     duration: Optional[int]
     timestamps: Optional[list[int]]
     skipped: Optional[int]
@@ -35,15 +34,123 @@ class InvalidVideo(Exception):
     """Exception for use inside `process_video_hash` function."""
 
 
-VideoGroups: dict[int, list[int]] = {}
-SetOfGroups: list[Any] = []  # hashes[ABCD+EFGH+IMGH+ZXCV,xx1+xx2+xx3+xx4]
+class MemoryBudget:
+    """Limits total size of videos data, that worker threads hold in memory. A video bigger than the limit is
+    allowed only when nothing else is held."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = Condition()
+
+    @contextmanager
+    def reserve(self, size: int):
+        with self._condition:
+            self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+
+VideosPool: Optional[ThreadPoolExecutor] = None  # each worker runs no more than one ffmpeg/ffprobe at a time
+VideosMemory = MemoryBudget(0)
+HashesBuffer = WriteBuffer(store_videos_hashes)  # new records of hashes cache
+VideoDecoder: SubprocessDecoder = SubprocessDecoder()
+VIDEO_FRAMES = 4  # number of frames in video hash
 MIN_VIDEO_DURATION = 3000
-FIRST_FRAME_RESOLUTION = 64
+FRAMES_FORMATS = ("bmp", "gray")
+SEEK_MODES = ("accurate", "keyframe")
+CACHE_FIELDS = ("hash", "skipped", "duration", "timestamps")
+# frames format, seek mode and decoder of hashes: hashes of frames extracted in another way differ. `mediadc_videos`
+# has no column for it, rows of other extraction keep it in `timestamps`, see `dump_timestamps`.
+CACHE_EXTRACTION = ("bmp", "accurate", "subprocess")
+VideoExtraction: tuple[str, ...] = CACHE_EXTRACTION
+HashesCaches = HashesCache(get_videos_caches, CACHE_FIELDS)
+HashesMemory = RecordsMemory()  # records of hashes cache, that are kept between tasks
+
+
+def init_videos(settings: dict):
+    """Prepares processing of videos, groups of task are created as `videos_groups` of `settings`."""
+
+    global VideosPool, VideosMemory, VideoDecoder, VideoExtraction  # pylint: disable=global-statement
+    global HashesBuffer, HashesCaches  # pylint: disable=global-statement
+    # representatives are hashes of frames: [ABCD+EFGH+IMGH+ZXCV,xx1+xx2+xx3+xx4]
+    settings["videos_groups"] = FilesGroups(
+        create_grouping_index(
+            settings["grouping_mode"],
+            settings["hash_index"],
+            settings["precision_vid"],
+            VIDEO_FRAMES * settings["hash_size"] ** 2,
+            parts=VIDEO_FRAMES,
+            workers=settings["workers"],
+        )
+    )
+    if settings["video_frames"] not in FRAMES_FORMATS:
+        raise ValueError(f"Unknown format of video frames: `{settings['video_frames']}`. Supported: {FRAMES_FORMATS}")
+    if settings["video_seek"] not in SEEK_MODES:
+        raise ValueError(f"Unknown seek mode for videos: `{settings['video_seek']}`. Supported: {SEEK_MODES}")
+    VideoDecoder = create_video_decoder(settings["video_decoder"])
+    close_videos_pool()
+    VideosMemory = MemoryBudget(settings["videos_memory"])
+    VideoExtraction = (settings["video_frames"], settings["video_seek"], VideoDecoder.name)
+    HashesBuffer = WriteBuffer(store_videos_hashes, settings["db_batch"], settings["db_delay"])
+    HashesMemory.setup(settings["hashes_memory"], (settings["hash_algo"], settings["hash_size"], *VideoExtraction))
+    HashesCaches = HashesCache(
+        partial(get_extraction_caches, extraction=VideoExtraction, lookup=settings["cache_lookup"]),
+        CACHE_FIELDS,
+        settings["db_batch"],
+        HashesMemory,
+    )
+    if settings["workers"] > 1:
+        VideosPool = ThreadPoolExecutor(max_workers=settings["workers"])
+
+
+def dump_timestamps(timestamps: list[int]) -> str:
+    """Returns `timestamps` field of hashes cache record. For `CACHE_EXTRACTION` it is the list of timestamps,
+    as before, otherwise an object with `extraction` of frames and `timestamps`."""
+
+    if VideoExtraction == CACHE_EXTRACTION:
+        return dumps(timestamps)
+    return dumps({"extraction": "/".join(VideoExtraction), "timestamps": timestamps})
+
+
+def get_extraction_caches(file_ids: list[int], extraction: tuple[str, ...], lookup: str) -> list:
+    """Returns records of hashes cache with frames of `extraction`, with list of timestamps as `timestamps`.
+    Records of other extraction are not returned, video is hashed again and its record is replaced."""
+
+    records = []
+    for record in get_videos_caches(file_ids, lookup=lookup):
+        record_extraction: tuple[str, ...] = CACHE_EXTRACTION
+        if isinstance(record["timestamps"], dict):
+            record_extraction = tuple(str(record["timestamps"].get("extraction", "")).split("/"))
+            record["timestamps"] = record["timestamps"].get("timestamps")
+        if record_extraction == extraction:
+            records.append(record)
+    return records
+
+
+def close_videos_pool():
+    global VideosPool  # pylint: disable=global-statement
+    if VideosPool is not None:
+        VideosPool.shutdown(cancel_futures=True)
+        VideosPool = None
 
 
 def process_videos(settings: dict, fs_objs: list[FsNodeInfo]):
-    mdc_videos_info = load_videos_caches(fs_objs)
-    for mdc_video_info in mdc_videos_info:
+    store_videos(settings, *hash_videos(settings, fs_objs))
+
+
+def hash_videos(settings: dict, fs_objs: list[FsNodeInfo]) -> tuple[list[MdcVideoInfo], Iterator[dict]]:
+    """Loads hashes cache and starts hashing of videos without it in `VideosPool`, if there is one.
+
+    Returns videos and iterator over results for videos without hash, that are taken by `store_videos`."""
+
+    mdc_videos_info: list[MdcVideoInfo] = []
+    for mdc_video_info in cast(list[MdcVideoInfo], HashesCaches.load(fs_objs)):
         if mdc_video_info["skipped"] is not None:
             if mdc_video_info["skipped"] >= 2:
                 continue
@@ -51,287 +158,141 @@ def process_videos(settings: dict, fs_objs: list[FsNodeInfo]):
                 mdc_video_info["hash"] = None
         else:
             mdc_video_info["skipped"] = 0
-        if mdc_video_info["hash"] is None:
-            log.debug("processing video: fileid = %u", mdc_video_info["id"])
-            process_video_hash(
-                settings["hash_algo"],
-                settings["hash_size"],
-                mdc_video_info,
-            )
-        else:
-            if check_hexstrings_within_dist:
-                mdc_video_info["hash"] = mdc_video_info["hash"].hex()
-            else:
-                mdc_video_info["hash"] = arr_hash_from_bytes(mdc_video_info["hash"])
-        if mdc_video_info["hash"] is not None:
-            process_video_record(settings["precision_vid"], mdc_video_info)
-
-
-def process_video_record(precision: int, mdc_video_info: MdcVideoInfo):
-    video_group_number = len(VideoGroups)
-    if check_hexstrings_within_dist:
-        for i in range(video_group_number):
-            if check_hexstrings_within_dist(SetOfGroups[i], mdc_video_info["hash"], precision):
-                VideoGroups[i].append(mdc_video_info["id"])
-                return
+        mdc_videos_info.append(mdc_video_info)
+    to_hash = [i for i in mdc_videos_info if i["hash"] is None]
+    hash_params = (settings["hash_algo"], settings["hash_size"], settings["video_frames"], settings["video_seek"])
+    results: Iterator[dict]
+    if VideosPool is None or not to_hash:
+        results = (process_video_hash(*hash_params, i) for i in to_hash)
     else:
-        for i in range(video_group_number):
-            if numpy.count_nonzero(SetOfGroups[i] != mdc_video_info["hash"]) <= precision:
-                VideoGroups[i].append(mdc_video_info["id"])
-                return
-    SetOfGroups.append(mdc_video_info["hash"])
-    VideoGroups[video_group_number] = [mdc_video_info["id"]]
+        results = VideosPool.map(process_video_hash, *[[i] * len(to_hash) for i in hash_params], to_hash)
+    return mdc_videos_info, results
+
+
+def store_videos(settings: dict, mdc_videos_info: list[MdcVideoInfo], results: Iterator[dict]) -> None:
+    # results are taken in order of files, DB is updated and groups are built only from this thread.
+    try:
+        for mdc_video_info in mdc_videos_info:
+            if mdc_video_info["hash"] is None:
+                store_video_result(mdc_video_info, next(results))
+            else:
+                mdc_video_info["hash"] = hash_from_bytes(mdc_video_info["hash"])
+            if mdc_video_info["hash"] is not None:
+                settings["videos_groups"].add(mdc_video_info["id"], mdc_video_info["hash"])
+    finally:
+        HashesBuffer.flush()
+
+
+def store_video_result(mdc_video_info: MdcVideoInfo, result: dict) -> None:
+    if not result:
+        return
+    if "hash" not in result:
+        HashesBuffer.add(
+            mdc_video_info["id"],
+            (
+                mdc_video_info["id"],
+                result["duration"],
+                dump_timestamps([0]),
+                "00",
+                mdc_video_info["mtime"],
+                mdc_video_info["skipped"] + 1,
+            ),
+        )
+        return
+    mdc_video_info["hash"] = hash_from_hex(result["hash"])
+    mdc_video_info["timestamps"] = result["timestamps"]
+    mdc_video_info["duration"] = result["duration"]
+    HashesBuffer.add(
+        mdc_video_info["id"],
+        (
+            mdc_video_info["id"],
+            result["duration"],
+            dump_timestamps(result["timestamps"]),
+            result["hash"],
+            mdc_video_info["mtime"],
+            0,
+        ),
+    )
 
 
 def reset_videos():
-    VideoGroups.clear()
-    SetOfGroups.clear()
+    close_videos_pool()
+    HashesBuffer.clear()
+
 
+def process_video_hash(algo: str, hash_size: int, frames_format: str, seek: str, mdc_video_info: MdcVideoInfo) -> dict:
+    """Probes and hashes video without access to DB, can be run in worker thread.
 
-def process_video_hash(algo: str, hash_size: int, mdc_video_info: MdcVideoInfo):
+    Returns `hash` as hex string, `timestamps` and `duration`. For invalid video returns only `duration`,
+    for video that was not processed returns an empty dict."""
+
+    log.debug("processing video: fileid = %u", mdc_video_info["id"])
     ff_info = {}
     try:
         while True:
             if not mdc_video_info["direct_access"]:
                 break
-            ff_info = ffprobe_get_video_info(mdc_video_info["abs_path"], None)
+            ff_info = VideoDecoder.get_video_info(mdc_video_info["abs_path"], None)
             if not ff_info:
                 break
-            if not do_hash_video(algo, hash_size, ff_info, mdc_video_info, mdc_video_info["abs_path"], None):
+            result = do_hash_video(algo, hash_size, frames_format, seek, ff_info, mdc_video_info["abs_path"], None)
+            if not result:
+                raise InvalidVideo
+            return result
+        with VideosMemory.reserve(mdc_video_info["size"]):
+            data = fs_file_data(mdc_video_info)
+            if len(data) == 0:
+                return {}
+            # decoder gets the path to the spooled file, so it can seek in any container.
+            with spooled_file(data) as spooled_path:
+                del data
+                ff_info = VideoDecoder.get_video_info(spooled_path, None)
+                if not ff_info:
+                    raise InvalidVideo
+                result = do_hash_video(algo, hash_size, frames_format, seek, ff_info, spooled_path, None)
+            if not result:
                 raise InvalidVideo
-            return
-        if mdc_video_info["name"].lower().endswith((".mkv",)):
-            return
-        data = fs_file_data(mdc_video_info)
-        if len(data) == 0:
-            return
-        ff_info = ffprobe_get_video_info(None, data)
-        if not ff_info.get("fast_start", False):
-            raise InvalidVideo
-        if not do_hash_video(algo, hash_size, ff_info, mdc_video_info, None, data):
-            raise InvalidVideo
+            return result
     except Exception as exception_info:  # noqa # pylint: disable=broad-except
-        store_err_video_hash(
-            mdc_video_info["id"], ff_info.get("duration", 0), mdc_video_info["mtime"], mdc_video_info["skipped"] + 1
-        )
         exception_name = type(exception_info).__name__
         if exception_name != "InvalidVideo":
             log.debug("Exception in video processing:\n%s\n%s", mdc_video_info["internal_path"], str(exception_info))
+        return {"duration": ff_info.get("duration", 0)}
 
 
-def do_hash_video(algo: str, hash_size: int, video_info: dict, mdc_video_info: MdcVideoInfo, path, data) -> bool:
-    """Accepts path(bytes/str) or data for processing in memory."""
+def do_hash_video(algo: str, hash_size: int, frames_format: str, seek: str, video_info: dict, path, data) -> dict:
+    """Accepts path(bytes/str) or data for processing in memory. Returns empty dict if video can not be hashed.
+
+    With `gray` format of frames, decoder scales them to the input size of hash algorithm, instead of full size.
+    With `keyframe` seek, frames are the nearest keyframes and their timestamps are returned."""
 
     if video_info["duration"] < MIN_VIDEO_DURATION:
         if video_info["duration"] < 0:
             video_info["duration"] = 0
-        return False
+        return {}
     if video_info["duration"] > 24 * 60 * 60 * 1000:  # let's only process videos with duration <= 24 hours.
         video_info["duration"] = 1 + 24 * 60 * 60 * 1000
-        return False
-    first_timestamp = get_first_timestamp(video_info, path, data)
-    if first_timestamp == -1:
-        return False
-    frames_timestamps = build_times_for_hashes(video_info["duration"], first_timestamp)
-    ex = ()
-    res = get_frames(frames_timestamps, path, data, *ex)
-    if not res[0]:
-        return False
-    if any(len(x) == 0 for x in res[1:]):
-        return False
+        return {}
+    gray_hash = (algo, hash_size) if frames_format == "gray" else None
+    frames_timestamps, frames, err = VideoDecoder.get_hash_frames(video_info["duration"], path, data, gray_hash, seek)
+    if err:
+        log.debug("get_hash_frames error(%s): %s", VideoDecoder.name, err)
+        return {}
     hashes_l = [
-        calc_hash(algo, hash_size, res[1]),
-        calc_hash(algo, hash_size, res[2]),
-        calc_hash(algo, hash_size, res[3]),
-        calc_hash(algo, hash_size, res[4]),
+        calc_hash(algo, hash_size, frame) if isinstance(frame, bytes) else calc_pixels_hash(algo, hash_size, frame)
+        for frame in frames
     ]
     if any(x is None for x in hashes_l):
-        return False
-    hashes = numpy.concatenate((hashes_l[0], hashes_l[1], hashes_l[2], hashes_l[3]), axis=0)
-    hashes_str = arr_hash_to_string(hashes)
-    if check_hexstrings_within_dist:
-        mdc_video_info["hash"] = hashes_str
-    else:
-        mdc_video_info["hash"] = hashes
-    mdc_video_info["timestamps"] = frames_timestamps
-    mdc_video_info["duration"] = video_info["duration"]
-    store_video_hash(
-        mdc_video_info["id"], video_info["duration"], dumps(frames_timestamps), hashes_str, mdc_video_info["mtime"]
-    )
-    return True
-
-
-def build_times_for_hashes(total_duration_ms: int, first_hash_timestamp: int) -> list:
-    pre_interval = int((total_duration_ms - first_hash_timestamp) / 10)
-    round_factor = len(str(pre_interval)) - 1
-    rounded_hash_timestamp = round(pre_interval, ndigits=-round_factor)
-    return [first_hash_timestamp, rounded_hash_timestamp, rounded_hash_timestamp * 2, rounded_hash_timestamp * 4]
-
-
-def get_max_first_frame_time(duration_ms) -> int:
-    max_timestamp = int(duration_ms / 10)
-    if max_timestamp > 14 * 1000:
-        return 14 * 1000
-    return max_timestamp
-
-
-def get_first_timestamp(video_info: dict, path, data) -> int:
-    """Accepts path(bytes/str) or data for processing in memory."""
-    max_timestamp = get_max_first_frame_time(video_info["duration"])
-    ffmpeg_input_params = ["-hide_banner", "-loglevel", "fatal", "-an", "-sn", "-dn", "-to", f"{max_timestamp}ms"]
-    if path is not None:
-        result, err = stub_call_ff(
-            "ffmpeg",
-            *ffmpeg_input_params,
-            "-i",
-            path,
-            "-f",
-            "rawvideo",
-            "-s",
-            f"{FIRST_FRAME_RESOLUTION}x{FIRST_FRAME_RESOLUTION}",
-            "-pix_fmt",
-            "rgb24",
-            "pipe:",
-        )
-    elif data is not None:
-        result, err = stub_call_ff(
-            "ffmpeg",
-            *ffmpeg_input_params,
-            "-i",
-            "pipe:0",
-            "-f",
-            "rawvideo",
-            "-s",
-            f"{FIRST_FRAME_RESOLUTION}x{FIRST_FRAME_RESOLUTION}",
-            "-pix_fmt",
-            "rgb24",
-            "pipe:1",
-            stdin_data=data,
-        )
-    else:
-        raise ValueError("`path` or `data` argument must be specified.")
-    if err:
-        log.debug("get_first_timestamp error: %s", err)
-        return -1
-    frame_size = FIRST_FRAME_RESOLUTION * FIRST_FRAME_RESOLUTION * 3
-    frames_count = int(len(result.stdout) / frame_size)
-    frames_per_second = round(frames_count / (max_timestamp / 1000))
-    if frames_per_second == 0:
-        frames_per_second = 1
-    video_info["fps"] = frames_per_second
-    for i in range(frames_count):
-        if is_frame_too_dark(result.stdout, i, frame_size):
-            continue
-        if is_frame_too_bright(result.stdout, i, frame_size):
-            continue
-        return int(i / frames_per_second * 1000)
-    return 0
-
-
-def get_frames(timestamps: list, path, data, *ffmpeg_out_params) -> list:
-    """Accepts path(bytes/str) or data for processing in memory."""
-
-    ret: list[Any] = [False]
-    for _ in range(len(timestamps)):
-        ret.append(b"")
-    if path is None and data is None:
-        raise ValueError("`path` or `data` argument must be specified.")
-    ffmpeg_input_params = ["-hide_banner", "-loglevel", "fatal", "-an", "-sn", "-dn"]
-    for index, timestamp in enumerate(timestamps):
-        if path is not None:
-            result, err = stub_call_ff(
-                "ffmpeg",
-                *ffmpeg_input_params,
-                "-ss",
-                f"{timestamp}ms",
-                "-i",
-                path,
-                "-f",
-                "image2",
-                "-c:v",
-                "bmp",
-                "-frames",
-                "1",
-                *ffmpeg_out_params,
-                "pipe:",
-            )
-        else:
-            result, err = stub_call_ff(
-                "ffmpeg",
-                *ffmpeg_input_params,
-                "-ss",
-                f"{timestamp}ms",
-                "-i",
-                "pipe:0",
-                "-f",
-                "image2",
-                "-c:v",
-                "bmp",
-                "-frames",
-                "1",
-                *ffmpeg_out_params,
-                "pipe:1",
-                stdin_data=data,
-            )
-        if err:
-            log.debug("get_frames error: %s", err)
-            return ret
-        ret[index + 1] = result.stdout
-    ret[0] = True
-    return ret
-
-
-def is_frame_too_dark(data: bytes, frame_offset: int, frame_size: int) -> bool:
-    dark_allow_percent = 80
-    total_allowed_dark_pixels = int(((frame_size / 3) / 100) * dark_allow_percent)
-    dark_pixels = 0
-    frame_bytes = data[frame_size * frame_offset : frame_size * (frame_offset + 1)]
-    for pixel_index in range(int(len(frame_bytes) / 3)):
-        pixel_data = frame_bytes[pixel_index * 3 : pixel_index * 3 + 3]
-        if pixel_data[0] <= 0x20 and pixel_data[1] <= 0x20 and pixel_data[2] <= 0x20:
-            dark_pixels += 1
-    if dark_pixels > total_allowed_dark_pixels:
-        return True
-    return False
-
-
-def is_frame_too_bright(data: bytes, frame_offset: int, frame_size: int) -> bool:
-    bright_allow_percent = 90
-    total_allowed_bright_pixels = int(((frame_size / 3) / 100) * bright_allow_percent)
-    bright_pixels = 0
-    frame_bytes = data[frame_size * frame_offset : frame_size * (frame_offset + 1)]
-    for pixel_index in range(int(len(frame_bytes) / 3)):
-        pixel_data = frame_bytes[pixel_index * 3 : pixel_index * 3 + 3]
-        brightness = int(sum([pixel_data[0], pixel_data[1], pixel_data[2]]) / 3)
-        if brightness >= 0xFA:
-            bright_pixels += 1
-    if bright_pixels > total_allowed_bright_pixels:
-        return True
-    return False
-
-
-def remove_solo_groups():
-    groups_to_remove = []
-    for group_key, files_id in VideoGroups.items():
-        if len(files_id) == 1:
-            groups_to_remove.append(group_key)
-    for key in groups_to_remove:
-        del VideoGroups[key]
-
-
-def save_video_results(task_id: int, group_offset: int):
-    remove_solo_groups()
-    log.debug("Videos: Number of groups: %u", len(VideoGroups))
-    n_group = group_offset if group_offset else 1
-    for files_id in VideoGroups.values():
-        for file_id in files_id:
-            store_task_files_group(task_id, n_group, file_id)
-        n_group += 1
-
-
-def load_videos_caches(images: list[FsNodeInfo]) -> list[MdcVideoInfo]:
-    if not images:
-        return []
-    images = fs_sort_by_id(images)
-    cache_records = get_videos_caches([image["id"] for image in images])
-    return [images[i] | cache_records[i] for i in range(len(images))]
+        return {}
+    hashes = numpy.concatenate(hashes_l, axis=0)
+    return {"hash": arr_hash_to_string(hashes), "timestamps": frames_timestamps, "duration": video_info["duration"]}
+
+
+def get_video_results(settings: dict) -> list[list[int]]:
+    """Finishes processing of videos, returns files of groups with similar videos."""
+
+    close_videos_pool()
+    HashesBuffer.flush()
+    groups = settings["videos_groups"].get_results()
+    log.debug("Videos: Number of groups: %u", len(groups))
+    return groups
@@ -0,0 +1,95 @@
+import pytest
+
+from python import fs_walk
+
+DIR = 2
+IMAGE = 10
+
+# fileid: parent of directories, each directory has two images with ids `fileid * 10 + 1` and `fileid * 10 + 2`.
+TREE = {1: 0, 2: 1, 3: 1, 4: 1, 5: 1, 6: 3, 7: 6, 8: 4}
+
+
+class Storage:
+    def __init__(self):
+        self.records = {}
+        for fileid, parent in TREE.items():
+            self.records[fileid] = {"fileid": fileid, "parent": parent, "mimetype": DIR, "mimepart": 1}
+            for image_id in (fileid * 10 + 1, fileid * 10 + 2):
+                self.records[image_id] = {"fileid": image_id, "parent": fileid, "mimetype": 9, "mimepart": IMAGE}
+
+    def delete(self, fileid):
+        for record in [i for i in self.records.values() if i["parent"] == fileid]:
+            self.delete(record["fileid"])
+        self.records.pop(fileid, None)
+
+    def list(self, dir_ids, _mount_ids, after_fileid, limit):
+        records = [i for i in self.records.values() if i["parent"] in dir_ids and i["fileid"] > after_fileid]
+        return sorted(records, key=lambda i: i["fileid"])[:limit]
+
+    def node_info(self, fileids):
+        return [to_fs_node(self.records[i]) for i in fileids if i in self.records]
+
+
+def to_fs_node(record):
+    return {
+        "id": record["fileid"],
+        "parent_id": record["parent"],
+        "mimetype": record["mimetype"],
+        "mimepart": record["mimepart"],
+        "internal_path": f"files/{record['fileid']}",
+        "storageId": 1,
+    }
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = Storage()
+    monkeypatch.setattr("nc_py_api.mimetype.DIR", DIR)
+    monkeypatch.setattr(fs_walk, "LIST_PAGE_ROWS", 3)
+    monkeypatch.setattr(fs_walk, "get_directories_list", storage.list)
+    monkeypatch.setattr(fs_walk, "fs_node_info", storage.node_info)
+    monkeypatch.setattr(fs_walk, "db_record_to_fs_node", to_fs_node)
+    monkeypatch.setattr(fs_walk, "get_mounts_to", lambda storage_id, path: [])
+    monkeypatch.setattr(fs_walk, "get_ignored_directories", lambda dir_ids: [])
+    return storage
+
+
+def walk(storage, batch_size, position=None):
+    positions = []
+    files = []
+    directories = [] if position else storage.node_info([1])
+    for fs_objs in fs_walk.walk_media_files(
+        directories, [IMAGE], [], [], batch_size, position, lambda i: positions.append((i, len(files)))
+    ):
+        files += [fs_obj["id"] for fs_obj in fs_objs]
+    return files, positions
+
+
+def subtree_files(fileid):
+    files = {fileid * 10 + 1, fileid * 10 + 2}
+    for child in [i for i, parent in TREE.items() if parent == fileid]:
+        files |= subtree_files(child)
+    return files
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3])
+def test_walk(storage, batch_size):
+    files, positions = walk(storage, batch_size)
+    assert sorted(files) == sorted(subtree_files(1))
+    assert positions[-1] == ({"level": [], "next_level": []}, len(files))
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_resume_after_delete(storage, batch_size, monkeypatch):
+    # resumed walk must not skip or repeat files, when any directory was deleted after the position was saved.
+    all_files, positions = walk(storage, batch_size)
+    for position, files_done in positions:
+        for deleted in TREE:
+            storage = Storage()
+            storage.delete(deleted)
+            monkeypatch.setattr(fs_walk, "get_directories_list", storage.list)
+            monkeypatch.setattr(fs_walk, "fs_node_info", storage.node_info)
+            files, _ = walk(storage, batch_size, position)
+            removed = subtree_files(deleted)
+            expected = [i for i in all_files[files_done:] if i not in removed]
+            assert files == expected, (position, deleted)
@@ -0,0 +1,93 @@
+import numpy
+import pytest
+
+from python import hash_index
+from python.clustering import cluster_hashes
+from python.hash_index import LinearIndex, MultiIndex
+
+
+def generate_hashes(count: int, hash_bits: int, max_flips: int, seed: int = 0) -> numpy.ndarray:
+    """Returns packed hashes: random ones, and copies of a few of them with up to `max_flips` flipped bits. Bits are
+    flipped in the same `2 * max_flips` bits, so copies are often within precision from several others."""
+
+    rng = numpy.random.default_rng(seed)
+    bits = rng.integers(0, 2, (count, hash_bits), dtype=numpy.uint8)
+    flip_bits = rng.choice(hash_bits, 2 * max_flips, replace=False)
+    for i in range(count // 2, count):
+        bits[i] = bits[rng.integers(0, count // 20)]
+        bits[i, rng.choice(flip_bits, rng.integers(0, max_flips + 1), replace=False)] ^= 1
+    return numpy.packbits(bits, axis=1).view(">u8").astype(numpy.uint64)
+
+
+def distance(a: numpy.ndarray, b: numpy.ndarray) -> int:
+    return sum(int(x ^ y).bit_count() for x, y in zip(a.tolist(), b.tolist()))
+
+
+def brute_find(representatives: list, packed_hash: numpy.ndarray, precision: int) -> int:
+    return next((i for i, row in enumerate(representatives) if distance(row, packed_hash) <= precision), -1)
+
+
+@pytest.mark.parametrize("min_rows", [4096, 8])  # with 8 tables are built at 8 * parts representatives
+@pytest.mark.parametrize("parts, precision", [(1, 0), (1, 4), (1, 12), (1, 26), (4, 16), (4, 104)])
+def test_find(monkeypatch, min_rows, parts, precision):
+    monkeypatch.setattr(hash_index, "MULTI_INDEX_MIN_ROWS", min_rows)
+    hash_bits = 256 * parts
+    hashes = generate_hashes(600, hash_bits, 2 * precision + 2)
+    multi, linear = MultiIndex(precision, hash_bits, parts), LinearIndex(precision, hash_bits)
+    representatives: list = []
+    for packed_hash in hashes:
+        expected = brute_find(representatives, packed_hash, precision)
+        assert multi.find(packed_hash) == expected
+        assert linear.find(packed_hash) == expected
+        if expected == -1:
+            representatives.append(packed_hash)
+            assert multi.add(packed_hash) == linear.add(packed_hash) == len(representatives) - 1
+    assert len(representatives) < len(hashes)  # some hashes were found
+    assert (min_rows == 8) == bool(multi.tables)
+    extended = MultiIndex(precision, hash_bits, parts)
+    extended.extend(numpy.array(representatives))
+    for packed_hash in hashes[::7]:
+        assert extended.find(packed_hash) == brute_find(representatives, packed_hash, precision)
+
+
+@pytest.mark.parametrize("parts, precision", [(1, 4), (1, 12), (1, 26), (4, 16), (4, 104)])
+def test_find_at_precision(monkeypatch, parts, precision):
+    # the worst case for index: radius + 1 flipped bits in each substring, while there are flips left.
+    monkeypatch.setattr(hash_index, "MULTI_INDEX_MIN_ROWS", 8)
+    hash_bits = 256 * parts
+    hashes = generate_hashes(100, hash_bits, 0)
+    multi = MultiIndex(precision, hash_bits, parts)
+    multi.extend(hashes)
+    radius = max(i.bit_count() for i in multi.flip_masks[0])
+    bits = numpy.unpackbits(hashes.astype(">u8").view(numpy.uint8), axis=1)
+    for flips, expected in ((precision, 10), (precision + 1, -1)):
+        positions = [j for i in multi.starts.tolist() for j in range(i, i + radius + 1)][:flips]
+        positions += sorted(set(range(hash_bits)) - set(positions))[: flips - len(positions)]
+        query = bits[10].copy()
+        query[positions] ^= 1
+        assert multi.find(numpy.packbits(query).view(">u8").astype(numpy.uint64)) == expected
+
+
+def connected_components(hashes: numpy.ndarray, precision: int) -> list[int]:
+    """Returns the smallest index of hash in its component for each hash."""
+
+    roots = list(range(len(hashes)))
+    for i in range(len(hashes)):
+        for j in range(i):
+            if distance(hashes[i], hashes[j]) <= precision:
+                old_root, new_root = max(roots[i], roots[j]), min(roots[i], roots[j])
+                roots = [new_root if x == old_root else x for x in roots]
+    return roots
+
+
+@pytest.mark.parametrize("precision", [0, 8, 26])
+def test_cluster_hashes(precision):
+    hashes = generate_hashes(300, 256, precision * 2)
+    expected = connected_components(hashes, precision)
+    assert cluster_hashes(hashes, precision, workers=2, block_rows=64).tolist() == expected
+    assert cluster_hashes(hashes, precision, workers=1).tolist() == expected
+    # groups do not depend on order of hashes.
+    order = numpy.random.default_rng(1).permutation(len(hashes))
+    roots = cluster_hashes(hashes[order], precision, workers=2, block_rows=64)
+    groups = {frozenset(order[roots == root].tolist()) for root in roots}
+    assert groups == {frozenset(i for i, x in enumerate(expected) if x == root) for root in expected}
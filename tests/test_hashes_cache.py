@@ -0,0 +1,73 @@
+from python.hashes_cache import HashesCache, RecordsMemory
+
+
+class Table:
+    """Records of hashes cache by fileid, remembers queries."""
+
+    def __init__(self, *records):
+        self.records = {i["fileid"]: i for i in records}
+        self.queries = []
+
+    def get(self, file_ids):
+        self.queries.append(file_ids)
+        return [dict(self.records[i]) for i in file_ids if i in self.records]
+
+
+def record(fileid, mtime, image_hash=b"\x01", skipped=0):
+    return {"fileid": fileid, "mtime": mtime, "hash": image_hash, "skipped": skipped}
+
+
+def fs_objs(*files):
+    return [{"id": fileid, "mtime": mtime} for fileid, mtime in files]
+
+
+def test_records_memory_eviction():
+    memory = RecordsMemory(2)
+    memory.put(1, record(1, 10))
+    memory.put(2, record(2, 20))
+    assert memory.get(1)["mtime"] == 10  # 2 is the least recently used now
+    memory.put(3, record(3, 30))
+    assert memory.get(2) is None
+    assert memory.get(1) is not None and memory.get(3) is not None
+    memory.put(3, record(3, 31))
+    assert list(memory.records) == [1, 3] and memory.get(3)["mtime"] == 31
+
+
+def test_records_memory_setup():
+    memory = RecordsMemory()
+    memory.put(1, record(1, 10))
+    assert memory.get(1) is None  # zero size keeps nothing
+    memory.setup(3, ("dhash", 16))
+    for i in range(1, 4):
+        memory.put(i, record(i, 10))
+    memory.setup(2, ("dhash", 16))
+    assert list(memory.records) == [2, 3]
+    memory.setup(2, ("phash", 16))
+    assert not memory.records
+
+
+def test_load():
+    table = Table(record(3, 30), record(1, 10), record(2, 99), record(4, 40, None, 1))
+    cache = HashesCache(table.get, ("hash", "skipped"), batch_size=2)
+    result = cache.load(fs_objs((5, 50), (4, 40), (3, 30), (2, 20), (1, 10)))
+    assert table.queries == [[1, 2], [3, 4], [5]]
+    assert [(i["id"], i["hash"], i["skipped"]) for i in result] == [
+        (1, b"\x01", 0),
+        (2, None, None),  # record of other mtime is not valid
+        (3, b"\x01", 0),
+        (4, None, 1),
+        (5, None, None),
+    ]
+
+
+def test_load_from_memory():
+    table = Table(record(1, 10), record(2, 20), record(3, 30, None, 1))
+    memory = RecordsMemory(10)
+    cache = HashesCache(table.get, ("hash", "skipped"), batch_size=10, memory=memory)
+    cache.load(fs_objs((1, 10), (2, 20), (3, 30)))
+    # records with hash are kept, record of file that was not hashed changes on the next try.
+    assert sorted(memory.records) == [1, 2]
+    table.queries.clear()
+    result = cache.load(fs_objs((1, 10), (2, 21), (3, 30)))
+    assert table.queries == [[2, 3]]
+    assert [(i["id"], i["hash"]) for i in result] == [(1, b"\x01"), (2, None), (3, None)]
@@ -0,0 +1,50 @@
+from io import BytesIO
+from pathlib import Path
+
+import numpy
+import pytest
+from PIL import Image
+
+from python.image_decode import hash_input_size, reduce_image
+from python.images import calc_hash, pil_to_hash, register_heif
+
+MAX_DISTANCE = 5  # percents of hash bits
+
+
+@pytest.fixture(scope="module")
+def images():
+    """`cat.hif` enlarged to 2400x1600 with noise like from camera, saved as JPEG and PNG."""
+
+    register_heif()
+    photo = Image.open(Path(__file__).parent.joinpath("cat.hif")).convert("RGB").resize((2400, 1600), Image.BICUBIC)
+    pixels = numpy.asarray(photo) + numpy.random.default_rng(0).normal(0, 4, (1600, 2400, 3))
+    result = {}
+    for image_format in ("JPEG", "PNG"):
+        buf = BytesIO()
+        Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8)).save(buf, format=image_format, quality=90)
+        result[image_format] = buf.getvalue()
+    return result
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+@pytest.mark.parametrize("hash_size", [8, 16])
+@pytest.mark.parametrize("algo", ["average", "dhash", "phash", "whash"])
+def test_reduced_decode_hash(images, image_format, hash_size, algo):
+    full_hash = pil_to_hash(algo, hash_size, Image.open(BytesIO(images[image_format]))).flatten()
+    reduced_hash = calc_hash(algo, hash_size, images[image_format])
+    assert numpy.count_nonzero(full_hash != reduced_hash) <= hash_size**2 * MAX_DISTANCE / 100
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+@pytest.mark.parametrize("algo", ["average", "phash", "whash"])
+def test_reduced_size(images, image_format, algo):
+    pil_image = Image.open(BytesIO(images[image_format]))
+    min_size = hash_input_size(algo, 16, pil_image.size) * 8
+    pil_image = reduce_image(pil_image, hash_input_size(algo, 16, pil_image.size))
+    pil_image.load()
+    if algo == "whash":
+        # input of whash is the natural scale of image, more than a half of its smaller side: it is not reduced.
+        assert pil_image.size == (2400, 1600)
+    else:
+        # JPEG is scaled on decode by 1/2, 1/4 or 1/8, other images are reduced by integer factor.
+        assert min_size <= min(pil_image.size) < 2 * min_size
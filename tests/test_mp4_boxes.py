@@ -0,0 +1,73 @@
+from python.mp4_boxes import mp4_get_video_info, parse_mvhd
+
+
+def box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+def large_box(box_type: bytes, payload: bytes) -> bytes:
+    return (1).to_bytes(4, "big") + box_type + (16 + len(payload)).to_bytes(8, "big") + payload
+
+
+def mvhd_v0(time_scale: int, duration: int) -> bytes:
+    return box(b"mvhd", bytes(12) + time_scale.to_bytes(4, "big") + duration.to_bytes(4, "big") + bytes(80))
+
+
+def mvhd_v1(time_scale: int, duration: int) -> bytes:
+    return box(b"mvhd", b"\x01" + bytes(19) + time_scale.to_bytes(4, "big") + duration.to_bytes(8, "big") + bytes(80))
+
+
+FTYP = box(b"ftyp", b"isom" + bytes(4) + b"isomiso2mp41")
+MDAT = box(b"mdat", bytes(1000))
+
+
+def write(tmp_path, data: bytes) -> str:
+    path = tmp_path / "video.mp4"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_moov_first(tmp_path):
+    path = write(tmp_path, FTYP + box(b"moov", mvhd_v0(1000, 12345) + box(b"trak")) + MDAT)
+    assert mp4_get_video_info(path) == {"duration": 12345, "fast_start": True}
+
+
+def test_moov_last(tmp_path):
+    path = write(tmp_path, FTYP + box(b"free") + MDAT + box(b"moov", box(b"trak") + mvhd_v0(600, 6000)))
+    assert mp4_get_video_info(path) == {"duration": 10000, "fast_start": False}
+
+
+def test_large_mdat(tmp_path):
+    path = write(tmp_path, FTYP + large_box(b"mdat", bytes(100)) + box(b"moov", mvhd_v1(90000, 900000)))
+    assert mp4_get_video_info(path) == {"duration": 10000, "fast_start": False}
+
+
+def test_last_box_to_end_of_file(tmp_path):
+    moov = box(b"moov", mvhd_v0(1000, 5000))
+    path = write(tmp_path, FTYP + MDAT + bytes(4) + moov[4:])  # size 0: box goes up to the end of file
+    assert mp4_get_video_info(path) == {"duration": 5000, "fast_start": False}
+
+
+def test_fragmented(tmp_path):
+    # duration of fragmented MP4 is in fragments, ffprobe is used for it.
+    path = write(tmp_path, FTYP + box(b"moov", mvhd_v0(1000, 0) + box(b"mvex", box(b"trex"))) + MDAT)
+    assert mp4_get_video_info(path) == {}
+
+
+def test_not_mp4(tmp_path):
+    assert mp4_get_video_info(write(tmp_path, b"RIFF" + bytes(100))) == {}
+    assert mp4_get_video_info(write(tmp_path, b"")) == {}
+    assert mp4_get_video_info(str(tmp_path / "missing.mp4")) == {}
+
+
+def test_damaged(tmp_path):
+    moov = box(b"moov", mvhd_v0(1000, 5000))
+    assert mp4_get_video_info(write(tmp_path, FTYP + moov[:-10])) == {}
+    assert mp4_get_video_info(write(tmp_path, FTYP + MDAT)) == {}
+
+
+def test_unknown_duration():
+    assert parse_mvhd(mvhd_v0(1000, 2**32 - 1)[8:]) is None
+    assert parse_mvhd(mvhd_v1(1000, 2**64 - 1)[8:]) is None
+    assert parse_mvhd(mvhd_v0(0, 1000)[8:]) is None
+    assert parse_mvhd(bytes(10)) is None
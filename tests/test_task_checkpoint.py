@@ -0,0 +1,83 @@
+import os
+from time import time
+
+import numpy
+
+from python.task_checkpoint import (
+    TaskCheckpoint,
+    checkpoint_path,
+    remove_stale_checkpoints,
+)
+
+
+def checkpoint_data():
+    state = {"position": {"level": [7, 8], "next_level": [9]}, "files_scanned": 5, "settings": {"hash_size": 16}}
+    groups = {
+        "images": (numpy.arange(6, dtype=numpy.uint64).reshape(3, 2), {0: [11, 12], 1: [13], 2: []}),
+        "videos": (numpy.zeros((0, 8), dtype=numpy.uint64), {}),
+    }
+    files = numpy.array([[11, 100], [12, 200], [13, 300]], dtype=numpy.int64)
+    return state, groups, files
+
+
+def test_round_trip(tmp_path):
+    checkpoint = TaskCheckpoint(checkpoint_path(str(tmp_path / "checkpoints"), 3), 60)
+    assert checkpoint.load() is None
+    state, groups, files = checkpoint_data()
+    checkpoint.save(state, groups, files, force=True)
+    loaded_state, loaded_groups, loaded_files = checkpoint.load()
+    assert loaded_state == state
+    assert numpy.array_equal(loaded_files, files)
+    assert set(loaded_groups) == {"images", "videos"}
+    for kind, (hashes, kind_groups) in groups.items():
+        assert numpy.array_equal(loaded_groups[kind][0], hashes)
+        assert loaded_groups[kind][1] == kind_groups
+    checkpoint.remove()
+    assert checkpoint.load() is None
+
+
+def test_interval(tmp_path):
+    checkpoint = TaskCheckpoint(checkpoint_path(str(tmp_path), 3), 60)
+    state, groups, files = checkpoint_data()
+    checkpoint.save(state, groups, files)
+    assert checkpoint.load() is None
+    checkpoint.save(state, groups, files, force=True)
+    checkpoint.save(dict(state, files_scanned=6), groups, files)
+    assert checkpoint.load()[0]["files_scanned"] == 5
+
+
+def test_disabled(tmp_path):
+    checkpoint = TaskCheckpoint(checkpoint_path("", 3), 0)
+    checkpoint.save(*checkpoint_data(), force=True)
+    assert checkpoint.load() is None
+    assert not os.listdir(tmp_path)
+
+
+def test_bad_file(tmp_path):
+    path = tmp_path / "task_3.npz"
+    path.write_bytes(b"not a checkpoint")
+    assert TaskCheckpoint(str(path), 0).load() is None
+
+
+def test_save_error(tmp_path):
+    (tmp_path / "file").write_bytes(b"")
+    checkpoint = TaskCheckpoint(checkpoint_path(str(tmp_path / "file"), 3), 0)
+    checkpoint.save(*checkpoint_data(), force=True)
+    assert checkpoint.load() is None
+
+
+def test_remove_stale_checkpoints(tmp_path):
+    for name in ("task_1.npz", "task_2.npz", "task_3.npz", "task_4.npz.tmp", "other.npz"):
+        (tmp_path / name).write_bytes(b"")
+    old_time = time() - 3600
+    os.utime(tmp_path / "task_3.npz", (old_time, old_time))
+    assert remove_stale_checkpoints(str(tmp_path), {1, 3, 4}, 600) == 2
+    assert sorted(os.listdir(tmp_path)) == ["other.npz", "task_1.npz", "task_4.npz.tmp"]
+    assert remove_stale_checkpoints(str(tmp_path / "missing"), set(), 600) == 0
+
+
+def test_is_due(tmp_path):
+    checkpoint = TaskCheckpoint(checkpoint_path(str(tmp_path), 3), 60)
+    assert not checkpoint.is_due() and checkpoint.is_due(force=True)
+    assert TaskCheckpoint(checkpoint_path(str(tmp_path), 3), 0).is_due()
+    assert not TaskCheckpoint(checkpoint_path("", 3), 0).is_due(force=True)
@@ -0,0 +1,91 @@
+import numpy
+
+from python import task
+from python.clustering import FilesGroups
+from python.hash_index import LinearIndex
+from python.task_checkpoint import TaskCheckpoint
+from python.task_delta import TaskDelta
+
+
+def previous_run():
+    files = numpy.array([[5, 50], [1, 10], [2, 20], [3, 30], [4, 40]], dtype=numpy.int64)
+    groups = {"images": {0: [1, 2], 1: [3]}, "videos": {0: [4, 5]}}
+    return files, groups
+
+
+def fs_objs(*files):
+    return [{"id": fileid, "mtime": mtime} for fileid, mtime in files]
+
+
+def test_filter():
+    files, groups = previous_run()
+    delta = TaskDelta(files, groups)
+    # 1 and 4 are unchanged, 2 is changed, 6 is added.
+    assert delta.filter(fs_objs((2, 21), (1, 10), (6, 60), (4, 40))) == fs_objs((2, 21), (6, 60))
+    assert groups == {"images": {0: [1], 1: [3]}, "videos": {0: [4, 5]}}
+    assert delta.removed == 1
+
+
+def test_remove_missing():
+    files, groups = previous_run()
+    delta = TaskDelta(files, groups)
+    assert delta.filter(fs_objs((1, 10), (2, 20))) == []
+    assert delta.filter(fs_objs((5, 55))) == fs_objs((5, 55))
+    delta.remove_missing()
+    assert groups == {"images": {0: [1, 2], 1: []}, "videos": {0: []}}
+    assert delta.removed == 3
+    delta.remove_missing()
+    assert delta.removed == 3
+
+
+def test_no_previous_files():
+    delta = TaskDelta(numpy.zeros((0, 2), dtype=numpy.int64), {"images": {}})
+    assert delta.filter(fs_objs((1, 10))) == fs_objs((1, 10))
+    assert delta.filter([]) == []
+    delta.remove_missing()
+    assert delta.removed == 0
+
+
+def packed(value: int) -> numpy.ndarray:
+    return numpy.array([value], dtype=numpy.uint64)
+
+
+def test_incremental_walk_splits_group_of_changed_file(monkeypatch):
+    # 1 is representative of group [1, 2, 5], it is changed and its new hash is far from all others. New file 3 is
+    # within precision from the old hash of 1, but not from 2 and 5: it must not join them.
+    hashes = {1: 0xFFFF0000FFFF0000, 2: 0b111, 3: 0b111000, 4: 0xFFFFFFFFFFFFFFFF, 5: 0b11}
+    walked = [(1, 11), (2, 20), (3, 30), (4, 40), (5, 50)]
+    files_groups = FilesGroups(LinearIndex(4, 64))
+    task_settings = {i: None for i in task.CHECKPOINT_SETTINGS} | {
+        "id": 1,
+        "target_dirs": [1],
+        "exclude_fileid": [],
+        "exclude_mask": [],
+        "db_batch": 10,
+        "files_scanned": 0,
+        "incremental": True,
+        "checkpoint": TaskCheckpoint("", 0),
+        "images_groups": files_groups,
+        "saved": (
+            {"position": None},
+            {"images": (numpy.array([[0], [hashes[4]]], dtype=numpy.uint64), {0: [1, 2, 5], 1: [4]})},
+            numpy.array([[1, 10], [2, 20], [4, 40], [5, 50]], dtype=numpy.int64),
+        ),
+    }
+    processed = []
+    monkeypatch.setattr(task.mimetype, "IMAGE", 2)
+    monkeypatch.setattr(task.mimetype, "VIDEO", 3)
+    monkeypatch.setattr(task, "fs_node_info", lambda ids: [{"id": i, "mtime": dict(walked)[i]} for i in ids])
+    monkeypatch.setattr(task, "fs_apply_exclude_lists", lambda *args: None)
+    monkeypatch.setattr(task, "walk_media_files", lambda *args, **kwargs: iter([fs_objs(*walked)]))
+    monkeypatch.setattr(task, "increase_processed_files_count", lambda task_id, count: processed.append(count))
+    yielded = []
+    for batch in task.walk_task_files(task_settings, [2]):
+        yielded.append([i["id"] for i in batch])
+        for fs_obj in batch:
+            files_groups.add(fs_obj["id"], packed(hashes[fs_obj["id"]]))
+        processed.append(len(batch))
+    assert yielded == [[1, 3], [2, 5]]
+    assert sum(processed) == len(walked)
+    assert sorted(files_groups.groups.values()) == [[1], [2, 5], [3], [4]]
+    assert files_groups.get_results() == [[2, 5]]
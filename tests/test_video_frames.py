@@ -0,0 +1,66 @@
+import math
+from io import BytesIO
+
+import numpy
+import pytest
+from PIL import Image
+
+from python.images import calc_hash, calc_pixels_hash
+from python.video_frames import gray_frame_size, parse_keyframes, snap_to_keyframes
+
+FRAMECRC = b"""#software: Lavf60.3.100
+#tb 0: 1/12800
+#media_type 0: video
+#codec_id 0: rawvideo
+#dimensions 0: 64x64
+#sar 0: 1/1
+#stream#, dts,        pts, duration,     size, hash
+0,      51200,      51200,      512,    12288, 0x1d2a3b4c, F=0x1
+0,      -1024,          0,      512,    12288, 0x5e6f7a8b
+0,      12800,      12800,      512,    12288, 0x9c0d1e2f, F=0x0
+0,      25600,      25600,      512,    12288, 0x3a4b5c6d
+0,      25600,      25600,      512,    12288, 0x3a4b5c6d
+0,      -2048,      -1024,      512,    12288, 0x7e8f9a0b
+"""
+
+
+def test_parse_keyframes():
+    # not key frames(F=0x0) and negative timestamps are skipped, the same keyframe is returned once.
+    assert parse_keyframes(FRAMECRC) == [0, 2000, 4000]
+
+
+def test_parse_keyframes_rounds_down():
+    assert parse_keyframes(b"#tb 0: 1/3\n0, 1, 1, 1, 10, 0x0\n0, 5, 5, 1, 10, 0x0\n") == [333, 1666]
+
+
+def test_parse_keyframes_default_time_base():
+    assert parse_keyframes(b"0, 40, 40, 40, 10, 0x0\n") == [40]
+    assert parse_keyframes(b"") == []
+
+
+def test_snap_to_keyframes():
+    keyframes = [0, 2000, 4000]
+    assert snap_to_keyframes([0, 999, 1000, 1001, 3500, 4000, 99999], keyframes) == [0, 0, 0, 2000, 4000, 4000, 4000]
+    assert snap_to_keyframes([0, 500, 10000], [1000]) == [1000, 1000, 1000]
+    assert snap_to_keyframes([], keyframes) == []
+
+
+def scale_size(expression: str, width: int, height: int) -> int:
+    """Evaluates expression of ffmpeg `scale` filter."""
+
+    functions = {"pow": pow, "floor": math.floor, "log": math.log, "min": min, "max": max, "iw": width, "ih": height}
+    return int(eval(expression.replace("\\,", ","), {"__builtins__": {}}, functions))  # pylint: disable=eval-used
+
+
+@pytest.mark.parametrize("algo", ["average", "dhash", "phash", "whash"])
+@pytest.mark.parametrize("frame_size", [(160, 90), (64, 48)])
+def test_gray_frames_hash(algo, frame_size):
+    # gray frame is scaled by ffmpeg to `gray_frame_size`, its hash must be the same as of BMP frame hashed with PIL.
+    width, height = frame_size
+    y, x = numpy.mgrid[0:height, 0:width]
+    rgb = numpy.stack((x * 255 // width, y * 255 // height, (x * y) % 256), axis=-1).astype(numpy.uint8)
+    bmp = BytesIO()
+    Image.fromarray(rgb).save(bmp, format="BMP")
+    gray_size = [scale_size(i, width, height) for i in gray_frame_size(algo, 8)]
+    pixels = numpy.asarray(Image.fromarray(rgb).convert("L").resize(gray_size, Image.LANCZOS))
+    assert numpy.array_equal(calc_pixels_hash(algo, 8, pixels), calc_hash(algo, 8, bmp.getvalue()))
@@ -0,0 +1,53 @@
+from json import loads
+
+import pytest
+
+from python import videos
+
+KEYFRAME = ("bmp", "keyframe", "subprocess")
+
+
+def record(fileid, timestamps, skipped=0):
+    return {
+        "fileid": fileid,
+        "mtime": 1,
+        "duration": 5000,
+        "timestamps": timestamps,
+        "hash": b"\x01",
+        "skipped": skipped,
+    }
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    # rows of `mediadc_videos`, as they are returned by DB: JSON of `timestamps` is decoded.
+    rows = {}
+    monkeypatch.setattr(
+        videos, "get_videos_caches", lambda file_ids, lookup: [dict(rows[i]) for i in file_ids if i in rows]
+    )
+    return rows
+
+
+@pytest.mark.parametrize("extraction", [videos.CACHE_EXTRACTION, KEYFRAME, ("gray", "accurate", "pyav")])
+def test_extraction_round_trip(monkeypatch, stored, extraction):
+    monkeypatch.setattr(videos, "VideoExtraction", extraction)
+    stored[1] = record(1, loads(videos.dump_timestamps([100, 2000])))
+    stored[2] = record(2, loads(videos.dump_timestamps([0])), skipped=1)
+    records = videos.get_extraction_caches([1, 2, 3], extraction, "fileid")
+    assert [(i["fileid"], i["timestamps"], i["skipped"]) for i in records] == [(1, [100, 2000], 0), (2, [0], 1)]
+
+
+def test_default_extraction_format(monkeypatch):
+    # rows of default extraction keep the list of timestamps, as rows written before.
+    assert loads(videos.dump_timestamps([1, 2])) == [1, 2]
+    monkeypatch.setattr(videos, "VideoExtraction", KEYFRAME)
+    assert loads(videos.dump_timestamps([1, 2])) == {"extraction": "bmp/keyframe/subprocess", "timestamps": [1, 2]}
+
+
+def test_other_extraction_is_rejected(stored):
+    stored[1] = record(1, [100, 2000])
+    stored[2] = record(2, {"extraction": "bmp/keyframe/subprocess", "timestamps": [0, 1000]})
+    stored[3] = record(3, {"extraction": "gray/keyframe/subprocess", "timestamps": [0, 1000]})
+    stored[4] = record(4, None)  # `join` lookup returns NULL fields for files without cache
+    assert [i["fileid"] for i in videos.get_extraction_caches([1, 2, 3, 4], KEYFRAME, "join")] == [2]
+    assert [i["fileid"] for i in videos.get_extraction_caches([1, 2, 3, 4], videos.CACHE_EXTRACTION, "join")] == [1, 4]